@@ -0,0 +1,126 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# answer-encoding-benchmark.py
+# compares the encodings of the provisioning answer: size on the wire and
+# time to encode in the Lambda function and to decode on the device, for
+# answers with private key (no CSR) and without (CSR). gzip stands for the
+# compression of API Gateway, cbor-base64 is the size of the envelope body
+# that API Gateway converts to binary.
+
+import argparse
+import base64
+import datetime
+import gzip
+import json
+import os
+import sys
+import time
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmark_dir, '..', 'global-device'))
+sys.path.insert(0, os.path.join(benchmark_dir, '..', 'lambda'))
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+import answer_encoding
+import device_provisioning
+
+
+def sample_answer(with_key):
+    # an answer like the one of AWS IoT: RSA 2048 certificate and PKCS#1 key
+    key = rsa.generate_private_key(public_exponent = 65537, key_size = 2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, u'AWS IoT Certificate')])
+    now = datetime.datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(
+        x509.Name([x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, u'Amazon Web Services O=Amazon.com Inc. '
+                                                                         u'L=Seattle ST=Washington C=US')])
+    ).public_key(key.public_key()).serial_number(x509.random_serial_number()).not_valid_before(now) \
+        .not_valid_after(now + datetime.timedelta(days = 10950)).sign(key, hashes.SHA256())
+
+    answer = {
+        'status': 'success',
+        'region': 'eu-west-1',
+        'distance': 463.8124,
+        'endpointAddress': 'a1b2c3d4e5f6g7-ats.iot.eu-west-1.amazonaws.com',
+        'certificateArn': 'arn:aws:iot:eu-west-1:123456789012:cert/' + os.urandom(32).hex(),
+        'certificatePem': cert.public_bytes(serialization.Encoding.PEM).decode('ascii')
+    }
+    if with_key:
+        answer['PrivateKey'] = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                                                 serialization.NoEncryption()).decode('ascii')
+    return answer
+
+
+def encodings(answer):
+    # name: (encode, content type, decode of the body on the device)
+    def cbor():
+        return base64.b64decode(answer_encoding.encode(answer, answer_encoding.CBOR)['body'])
+
+    def as_json():
+        return json.dumps(answer_encoding.encode(answer, answer_encoding.JSON)).encode('utf-8')
+
+    return {
+        'json': (as_json, 'application/json', lambda body: device_provisioning.parse_answer('application/json', body)),
+        'json+gzip': (lambda: gzip.compress(as_json(), 6), 'application/json',
+                      lambda body: device_provisioning.parse_answer('application/json', gzip.decompress(body))),
+        'cbor': (cbor, 'application/cbor', lambda body: device_provisioning.parse_answer('application/cbor', body)),
+        'cbor+gzip': (lambda: gzip.compress(cbor(), 6), 'application/cbor',
+                      lambda body: device_provisioning.parse_answer('application/cbor', gzip.decompress(body))),
+        'cbor-base64': (lambda: base64.b64encode(cbor()), 'application/cbor',
+                        lambda body: device_provisioning.parse_answer('application/cbor', base64.b64decode(body))),
+    }
+
+
+def timed(f, n):
+    start = time.perf_counter()
+    for i in range(n):
+        result = f()
+    return (time.perf_counter() - start) * 1e6 / n, result
+
+
+parser = argparse.ArgumentParser(description='Size and decode time of the answer encodings')
+parser.add_argument("-n", "--iterations", action="store", type=int, dest="iterations", default=2000,
+                    help="iterations per measurement, default: 2000")
+parser.add_argument("-o", "--output", action="store", dest="output", help="write the results as JSON")
+args = parser.parse_args()
+
+results = {}
+for path, with_key in [('no-csr', True), ('csr', False)]:
+    answer = sample_answer(with_key)
+    reference = device_provisioning.parse_answer('application/json', json.dumps(answer).encode('utf-8'))
+    results[path] = {}
+    print("\n{}: answer {} private key".format(path, 'with' if with_key else 'without'))
+    print("   {:<12} {:>8} {:>8} {:>12} {:>12}".format('encoding', 'bytes', 'vs json', 'encode us', 'decode us'))
+    json_bytes = len(encodings(answer)['json'][0]())
+    for name, (encode, content_type, decode) in sorted(encodings(answer).items()):
+        encode_us, body = timed(encode, args.iterations)
+        decode_us, decoded = timed(lambda: decode(body), args.iterations)
+        # the device gets the same certificate and key in every encoding
+        assert decoded['certificatePem'] == reference['certificatePem']
+        assert decoded.get('PrivateKey') == reference.get('PrivateKey')
+        results[path][name] = {'bytes': len(body), 'encode_us': round(encode_us, 1), 'decode_us': round(decode_us, 1)}
+        print("   {:<12} {:>8} {:>7.0f}% {:>12.1f} {:>12.1f}".format(name, len(body), 100.0 * len(body) / json_bytes,
+                                                                   encode_us, decode_us))
+
+if args.output:
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent = 2, sort_keys = True)
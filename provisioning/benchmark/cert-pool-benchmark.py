@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# cert-pool-benchmark.py
+# runs the certificate pool end-to-end against moto (pip install moto): fills
+# the pool of a region, claims certificates and compares provision_device with
+# and without pool. Reports pool depth and claim latency.
+
+import argparse
+import os
+import sys
+import time
+
+lambda_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda')
+sys.path.insert(0, lambda_dir)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def report(name, latencies):
+    print("{:<32} n: {:>4}  p50: {:>7.1f} ms  p95: {:>7.1f} ms  max: {:>7.1f} ms".format(
+        name, len(latencies), percentile(latencies, 50), percentile(latencies, 95), max(latencies)))
+
+
+def timed(f):
+    start = time.time()
+    f()
+    return (time.time() - start) * 1000
+
+
+parser = argparse.ArgumentParser(description='Certificate pool benchmark against moto')
+parser.add_argument("-r", "--region", action="store", dest="region", default="eu-west-2", help="region, default: eu-west-2")
+parser.add_argument("-n", "--devices", action="store", type=int, dest="devices", default=20,
+                    help="number of devices to provision per mode, default: 20")
+args = parser.parse_args()
+
+from moto import mock_aws
+
+os.environ.update({
+    'AWS_DEFAULT_REGION': args.region,
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'CERT_POOL_TABLE': 'iot-global-provisioning-cert-pool',
+    'CERT_POOL_LOW_WATER': str(args.devices),
+    'CERT_POOL_HIGH_WATER': str(args.devices * 2)
+})
+
+with mock_aws():
+    import boto3
+
+    c_kms = boto3.client('kms')
+    os.environ['CERT_POOL_KMS_KEY_ID'] = c_kms.create_key()['KeyMetadata']['KeyId']
+    boto3.client('dynamodb').create_table(
+        TableName = os.environ['CERT_POOL_TABLE'],
+        KeySchema = [{'AttributeName': 'aws_region', 'KeyType': 'HASH'},
+                     {'AttributeName': 'cert_id', 'KeyType': 'RANGE'}],
+        AttributeDefinitions = [{'AttributeName': 'aws_region', 'AttributeType': 'S'},
+                                {'AttributeName': 'cert_id', 'AttributeType': 'S'}],
+        BillingMode = 'PAY_PER_REQUEST'
+    )
+
+    import logging
+    import lambda_function
+    logging.getLogger().setLevel(logging.WARN)
+
+    pool = lambda_function.get_cert_pool()
+    c_iot = lambda_function.get_region_state(args.region)['client']
+
+    start = time.time()
+    depth, issued = pool.refill(c_iot, args.region)
+    print("=> refill: depth before: {}, issued: {}, {:.1f}s".format(depth, issued, time.time() - start))
+    print("=> pool depth: {}".format(pool.depth(args.region)))
+
+    report("claim", [timed(lambda: pool.claim(args.region)) for i in range(args.devices)])
+    print("=> pool depth: {}".format(pool.depth(args.region)))
+
+    report("provision_device (pool)",
+           [timed(lambda: lambda_function.provision_device('pooled-{}'.format(i), args.region, None))
+            for i in range(args.devices)])
+    print("=> pool depth: {}".format(pool.depth(args.region)))
+
+    del os.environ['CERT_POOL_TABLE']
+    lambda_function.cert_pool = None
+    report("provision_device (no pool)",
+           [timed(lambda: lambda_function.provision_device('direct-{}'.format(i), args.region, None))
+            for i in range(args.devices)])
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# credential-store-benchmark.py
+# compares the start of a global device on a gateway with many devices:
+# checking and reading the credential files of a device against a lookup
+# in the credential store, and the time to migrate the files into the store.
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'global-device'))
+
+import device_provisioning
+from credential_store import CredentialStore
+
+
+def lookup_files(directory, thing_name):
+    # what global-device.py does at start without a store
+    files = dict((k, os.path.join(directory, v))
+                 for k, v in device_provisioning.credential_files(thing_name).items())
+    if os.path.isfile(files['key_file']) and os.path.isfile(files['cert_file']):
+        return device_provisioning.read_endpoint(files['endpoint_file'])
+    return None
+
+
+def lookup_store(store, thing_name):
+    credentials = store.get(thing_name)
+    return (credentials['endpoint'], credentials['region']) if credentials else None
+
+
+def timed(f, names):
+    start = time.time()
+    for name in names:
+        assert f(name) is not None
+    return (time.time() - start) * 1e6 / len(names)
+
+
+parser = argparse.ArgumentParser(description='Credential files against the credential store')
+parser.add_argument("-n", "--devices", action="store", type=int, dest="devices", default=10000,
+                    help="number of devices on the gateway, default: 10000")
+parser.add_argument("-l", "--lookups", action="store", type=int, dest="lookups", default=2000,
+                    help="number of device starts, default: 2000")
+parser.add_argument("-d", "--dir", action="store", dest="directory",
+                    help="directory for the test files, e.g. on the flash of the gateway, default: temp dir")
+args = parser.parse_args()
+
+directory = tempfile.mkdtemp(prefix = 'credential-store-', dir = args.directory)
+try:
+    key_pem, csr_pem = device_provisioning.create_key_and_csr('benchmark', 'ec-p256')
+    answer = {'certificatePem': '-----BEGIN CERTIFICATE-----\n' + 'A' * 1200 + '\n-----END CERTIFICATE-----\n',
+              'endpointAddress': 'abcdefghijklm-ats.iot.eu-west-1.amazonaws.com', 'region': 'eu-west-1'}
+    names = ['device-{}'.format(i) for i in range(args.devices)]
+
+    start = time.time()
+    for name in names:
+        files = dict((k, os.path.join(directory, v)) for k, v in device_provisioning.credential_files(name).items())
+        device_provisioning.store_credentials(files, answer, key_pem)
+    print("=> wrote files of {} devices: {:.1f}s".format(args.devices, time.time() - start))
+
+    store = CredentialStore(os.path.join(directory, 'credentials.db'))
+    start = time.time()
+    imported, skipped = store.migrate(directory)
+    print("=> migrated {} devices: {:.1f}s".format(imported, time.time() - start))
+
+    start = time.time()
+    store.store_answer('device-new', answer, key_pem, csr_pem)
+    print("=> stored one device: {:.2f} ms".format((time.time() - start) * 1000))
+
+    sample = [random.choice(names) for i in range(args.lookups)]
+    print("\n{:<24} {:>12}".format("lookup at start", "us/device"))
+    print("{:<24} {:>12.1f}".format("files", timed(lambda n: lookup_files(directory, n), sample)))
+    print("{:<24} {:>12.1f}".format("credential store", timed(lambda n: lookup_store(store, n), sample)))
+
+    start = time.time()
+    store.materialize(sample[0])
+    print("{:<24} {:>12.1f}".format("materialize key/cert", (time.time() - start) * 1e6))
+    store.close()
+finally:
+    shutil.rmtree(directory)
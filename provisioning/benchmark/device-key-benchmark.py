@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# device-key-benchmark.py
+# compares the key types of the global device: time to create the device
+# key, the CSR and the thing name signature, the verification time in the
+# Lambda function and the sizes of key, CSR, signature and provisioning
+# request. Run it on the target hardware, key generation dominates on
+# small CPUs.
+
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmark_dir, '..', 'global-device'))
+sys.path.insert(0, os.path.join(benchmark_dir, '..', 'lambda'))
+
+from cryptography.hazmat.primitives import serialization
+
+import device_provisioning
+from keyring import Verifier
+
+
+def timed(f, n):
+    # mean time in ms of n calls and the result of the last call
+    start = time.time()
+    for i in range(n):
+        result = f()
+    return (time.time() - start) * 1000 / n, result
+
+
+parser = argparse.ArgumentParser(description='Key generation, signing and payload sizes per device key type')
+parser.add_argument("-n", "--iterations", action="store", type=int, dest="iterations", default=20,
+                    help="iterations per measurement, default: 20")
+parser.add_argument("-t", "--thing-name", action="store", dest="thing_name", default="mydevice1",
+                    help="thing name for signature and CSR, default: mydevice1")
+args = parser.parse_args()
+
+thing_name = args.thing_name
+n = args.iterations
+
+print("{:<9} {:>9} {:>9} {:>9} {:>9} {:>8} {:>8} {:>6} {:>9} {:>9}".format(
+    "key type", "keygen ms", "csr ms", "sign ms", "verify ms", "key B", "csr B", "sig B", "request B", "no-csr B"))
+for key_type in device_provisioning.KEY_TYPES:
+    keygen_ms, key = timed(lambda: device_provisioning.generate_private_key(key_type), n)
+    csr_ms, (key_pem, csr_pem) = timed(lambda: device_provisioning.create_key_and_csr(thing_name, key_type), n)
+    csr_ms -= keygen_ms
+
+    # the same key type signs the thing name
+    sign_ms, sig = timed(lambda: device_provisioning.sign_thing_name(key, thing_name), n)
+    verifier = Verifier(key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo))
+    verify_ms, verified = timed(lambda: verifier.verify(thing_name, base64.b64decode(sig)), n)
+    assert verified, key_type
+
+    request = json.dumps(device_provisioning.build_payload(thing_name, sig, csr_pem))
+    request_no_csr = json.dumps(device_provisioning.build_payload(thing_name, sig))
+    print("{:<9} {:>9.2f} {:>9.2f} {:>9.3f} {:>9.3f} {:>8} {:>8} {:>6} {:>9} {:>9}".format(
+        key_type, keygen_ms, max(csr_ms, 0), sign_ms, verify_ms, len(key_pem), len(csr_pem),
+        len(base64.b64decode(sig)), len(request), len(request_no_csr)))
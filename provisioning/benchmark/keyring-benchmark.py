@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# keyring-benchmark.py
+# compares the signature verification throughput of the key types that are
+# supported by the keyring of the Lambda function, with a cached verifier and
+# with parsing the PEM for every request.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+
+from keyring import Verifier, ecdsa_hash
+
+
+def generate(key_type):
+    if key_type == 'rsa-2048':
+        key = rsa.generate_private_key(public_exponent = 65537, key_size = 2048)
+        sign = lambda m: key.sign(m, padding.PKCS1v15(), hashes.SHA256())
+    elif key_type == 'ecdsa-p256':
+        key = ec.generate_private_key(ec.SECP256R1())
+        sign = lambda m: key.sign(m, ec.ECDSA(ecdsa_hash(key.curve)))
+    elif key_type == 'ecdsa-p384':
+        key = ec.generate_private_key(ec.SECP384R1())
+        sign = lambda m: key.sign(m, ec.ECDSA(ecdsa_hash(key.curve)))
+    else:
+        key = ed25519.Ed25519PrivateKey.generate()
+        sign = lambda m: key.sign(m)
+
+    pub_key_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+    return pub_key_pem, sign
+
+
+def rate(f, seconds):
+    n = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        f()
+        n += 1
+    return n / (time.time() - start)
+
+
+parser = argparse.ArgumentParser(description='Signature verification throughput per key type')
+parser.add_argument("-s", "--seconds", action="store", type=float, dest="seconds", default=2.0,
+                    help="seconds per measurement, default: 2")
+args = parser.parse_args()
+
+message = b'mydevice1'
+
+print("{:<12} {:>14} {:>14} {:>10}".format("key type", "cached/s", "parse+verify/s", "sig bytes"))
+for key_type in ['rsa-2048', 'ecdsa-p256', 'ecdsa-p384', 'ed25519']:
+    pub_key_pem, sign = generate(key_type)
+    sig = sign(message)
+    verifier = Verifier(pub_key_pem)
+    assert verifier.verify(message, sig)
+
+    cached = rate(lambda: verifier.verify(message, sig), args.seconds)
+    uncached = rate(lambda: Verifier(pub_key_pem).verify(message, sig), args.seconds)
+    print("{:<12} {:>14.0f} {:>14.0f} {:>10}".format(key_type, cached, uncached, len(sig)))
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# lambda-benchmark.py
+# drives lambda_handler with synthetic provisioning requests against the
+# in-process fakes of aws_fakes.py and reports wall time per stage,
+# allocations and throughput for requests with and without CSR. The fake IoT
+# API can be limited to requests per second, the results then show the
+# throttled calls and the sustained throughput of the IoT limiter. The results
+# can be written as JSON and compared with the results of another commit.
+
+import argparse
+import base64
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+lambda_dir = os.path.join(benchmark_dir, '..', 'lambda')
+sys.path.insert(0, lambda_dir)
+
+import boto3
+import requests
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.x509.oid import NameOID
+
+from aws_fakes import FakeAWS, FakeIpstack
+
+STAGES = ['sig_verified', 'claim_device_for_provisioning', 'get_ip_location', 'find_best_region',
+          'provision_device', 'update_device_provisioning_status']
+
+
+class Context(object):
+    def __init__(self, request_id):
+        self.aws_request_id = request_id
+
+
+class StageTimer(object):
+    # wraps module level functions of the Lambda and records their wall time
+    def __init__(self, module, names):
+        self.samples = dict((n, []) for n in names)
+        for name in names:
+            setattr(module, name, self.wrap(name, getattr(module, name)))
+
+    def wrap(self, name, func):
+        samples = self.samples[name]
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                samples.append((time.perf_counter() - start) * 1000)
+        return timed
+
+    def reset(self):
+        for samples in self.samples.values():
+            del samples[:]
+
+
+def parse_latency(value):
+    latency = {}
+    for part in value.split(','):
+        if part:
+            service, ms = part.split('=')
+            latency[service.strip()] = float(ms)
+    return latency
+
+
+def parse_tps(value):
+    # "10" for all APIs or "CreateThing=20,AttachPolicy=5"
+    if value and '=' not in value:
+        return {'*': float(value)}
+    return parse_latency(value or '')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))] if values else 0.0
+
+
+def summary(values):
+    return {
+        'n': len(values),
+        'mean_ms': round(sum(values) / len(values), 3) if values else 0.0,
+        'p50_ms': round(percentile(values, 50), 3),
+        'p95_ms': round(percentile(values, 95), 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd = benchmark_dir,
+                                       stderr = subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+class Bench(object):
+    def __init__(self, args):
+        self.args = args
+        self.fake_aws = FakeAWS(parse_latency(args.latency), parse_tps(args.iot_tps))
+        self.fake_ipstack = FakeIpstack(self.fake_aws.latency_ms.get('ipstack', 0))
+        self.counter = 0
+        self.errors = 0
+
+        # the Lambda reads the public key from its working directory
+        self.work_dir = tempfile.mkdtemp(prefix = 'lambda-benchmark-')
+        self.signing_key = rsa.generate_private_key(public_exponent = 65537, key_size = 2048)
+        with open(os.path.join(self.work_dir, 'global-provisioning.pub.key.pem'), 'wb') as f:
+            f.write(self.signing_key.public_key().public_bytes(
+                serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo))
+        os.chdir(self.work_dir)
+
+        device_key = rsa.generate_private_key(public_exponent = 65537, key_size = 2048)
+        self.csr = x509.CertificateSigningRequestBuilder().subject_name(
+            x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'benchmark')])
+        ).sign(device_key, hashes.SHA256()).public_bytes(serialization.Encoding.PEM).decode('ascii')
+
+        os.environ.update({
+            'AWS_DEFAULT_REGION': 'eu-west-2',
+            'GEO_BACKENDS': args.geo,
+            'IPSTACK_API_KEY': 'benchmark',
+            'GEO_CACHE_TABLE': '',
+            'CERT_POOL_TABLE': '',
+            'ANSWER_TABLE': '',
+            'RTT_STATS_TABLE': '',
+            'IOT_LIMITER': 'false' if args.no_limiter else 'true',
+            'IOT_API_LIMITS': args.iot_api_limits or '',
+            'IOT_LIMITER_TABLE': 'iot-global-provisioning-iot-limiter' if args.shared_limiter else ''
+        })
+        boto3.client = self.fake_aws.client
+        requests.get = self.fake_ipstack.get
+
+        import lambda_function
+        self.lf = lambda_function
+        logging.getLogger().setLevel(getattr(logging, args.log_level))
+        self.timer = StageTimer(lambda_function, STAGES)
+        # the metric records are written, but not to the console
+        lambda_function.metrics.stream = open(os.devnull, 'w')
+
+    def event(self, with_csr):
+        self.counter += 1
+        thing_name = 'bench-{}'.format(self.counter)
+        self.fake_aws.dynamodb.put_item(
+            TableName = self.lf.dynamodb_table_name,
+            Item = {'thing_name': {'S': thing_name}, 'prov_status': {'S': 'unprovisioned'}})
+        sig = self.signing_key.sign(thing_name.encode('utf-8'), padding.PKCS1v15(), hashes.SHA256())
+        body = {'thing-name': thing_name, 'thing-name-sig': base64.b64encode(sig).decode('ascii')}
+        if with_csr:
+            body['CSR'] = self.csr
+        ip = '10.{}.{}.{}'.format(*[random.randint(0, 255) for i in range(3)]) \
+            if random.random() < self.args.new_ip_ratio else '10.0.0.1'
+        return {'body-json': body, 'params': {'header': {'X-Forwarded-For': ip}}}
+
+    def invoke(self, event):
+        answer = self.lf.lambda_handler(event, Context(str(self.counter)))
+        if answer.get('status') != 'success':
+            if not self.args.iot_tps:
+                raise RuntimeError("request failed: {}".format(answer))
+            # rejected by a throttled IoT API
+            self.errors += 1
+        return answer
+
+    def timed_invoke(self, event):
+        t = time.perf_counter()
+        self.invoke(event)
+        return (time.perf_counter() - t) * 1000
+
+    def run_path(self, with_csr):
+        # warm up the container: region state, keys, caches
+        for i in range(self.args.warmup):
+            self.invoke(self.event(with_csr))
+
+        events = [self.event(with_csr) for i in range(self.args.requests)]
+        self.timer.reset()
+        self.errors = 0
+        throttled = sum(self.fake_aws.throttled().values())
+        start = time.perf_counter()
+        if self.args.concurrency > 1:
+            with ThreadPoolExecutor(max_workers = self.args.concurrency) as executor:
+                latencies = list(executor.map(self.timed_invoke, events))
+        else:
+            latencies = [self.timed_invoke(event) for event in events]
+        elapsed = time.perf_counter() - start
+        errors = self.errors
+        throttled = sum(self.fake_aws.throttled().values()) - throttled
+
+        stages = dict((name, summary(samples)) for name, samples in self.timer.samples.items())
+
+        # allocations in a separate pass, tracing slows down the requests
+        events = [self.event(with_csr) for i in range(self.args.alloc_requests)]
+        peaks = []
+        allocated = []
+        tracemalloc.start()
+        for event in events:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            self.invoke(event)
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append((peak - before) / 1024.0)
+            allocated.append((current - before) / 1024.0)
+        tracemalloc.stop()
+
+        return {
+            'requests': len(latencies),
+            'throughput_per_s': round(len(latencies) / elapsed, 1),
+            'provisioned_per_s': round((len(latencies) - errors) / elapsed, 1),
+            'errors': errors,
+            'throttled_calls': throttled,
+            'request': summary(latencies),
+            'stages': stages,
+            'alloc_peak_kb': round(sum(peaks) / len(peaks), 1) if peaks else 0.0,
+            'alloc_retained_kb': round(sum(allocated) / len(allocated), 1) if allocated else 0.0
+        }
+
+    def run(self):
+        results = {
+            'commit': git_commit(),
+            'config': {
+                'latency_ms': self.fake_aws.latency_ms,
+                'geo': self.args.geo,
+                'requests': self.args.requests,
+                'new_ip_ratio': self.args.new_ip_ratio,
+                'concurrency': self.args.concurrency,
+                'iot_tps': parse_tps(self.args.iot_tps),
+                'limiter': 'off' if self.args.no_limiter else 'shared' if self.args.shared_limiter else 'local'
+            },
+            'paths': {}
+        }
+        for path, with_csr in [('no-csr', False), ('csr', True)]:
+            results['paths'][path] = self.run_path(with_csr)
+        results['calls'] = self.fake_aws.calls()
+        results['throttled'] = self.fake_aws.throttled()
+        if self.lf.iot_limiter is not None:
+            results['limiter'] = self.lf.iot_limiter.stats()
+        return results
+
+
+def print_results(results, baseline = None):
+    print("=> commit: {}, latency: {}".format(results['commit'], results['config']['latency_ms']))
+    for path, r in sorted(results['paths'].items()):
+        b = baseline['paths'].get(path) if baseline else None
+        print("\n{}: {} requests, {}/s, p50: {} ms, p95: {} ms, alloc peak: {} kB, retained: {} kB".format(
+            path, r['requests'], r['throughput_per_s'], r['request']['p50_ms'], r['request']['p95_ms'],
+            r['alloc_peak_kb'], r['alloc_retained_kb']))
+        if r['throttled_calls'] or r['errors']:
+            print("   provisioned: {}/s, failed requests: {}, throttled IoT calls: {}".format(
+                r['provisioned_per_s'], r['errors'], r['throttled_calls']))
+        if b:
+            print("   baseline {}: {}/s, p50: {} ms".format(baseline['commit'], b['throughput_per_s'], b['request']['p50_ms']))
+        print("   {:<36} {:>10} {:>10} {:>10}".format('stage', 'mean ms', 'p95 ms', 'baseline'))
+        for stage, s in r['stages'].items():
+            base = b['stages'].get(stage, {}).get('mean_ms', '-') if b else '-'
+            print("   {:<36} {:>10} {:>10} {:>10}".format(stage, s['mean_ms'], s['p95_ms'], base))
+
+    if results.get('limiter'):
+        print("\nIoT limiter: {}".format(results['config']['limiter']))
+        print("   {:<36} {:>10} {:>10} {:>10} {:>10}".format('api', 'calls', 'throttled', 'retries', 'waited ms'))
+        for api, c in sorted(results['limiter'].items()):
+            print("   {:<36} {:>10} {:>10} {:>10} {:>10}".format(api, c['calls'], c['throttled'], c['retries'],
+                                                                c['waited_ms']))
+
+
+parser = argparse.ArgumentParser(description='Offline benchmark of the provisioning Lambda')
+parser.add_argument("-n", "--requests", action="store", type=int, dest="requests", default=200,
+                    help="measured requests per path, default: 200")
+parser.add_argument("--warmup", action="store", type=int, dest="warmup", default=5,
+                    help="requests before measuring, default: 5")
+parser.add_argument("--alloc-requests", action="store", type=int, dest="alloc_requests", default=20,
+                    help="requests for the allocation pass, default: 20")
+parser.add_argument("-l", "--latency", action="store", dest="latency",
+                    default="iot=15,dynamodb=5,sts=10,ipstack=40",
+                    help="injected latency in ms per service call, default: iot=15,dynamodb=5,sts=10,ipstack=40")
+parser.add_argument("--geo", action="store", dest="geo", default="ipstack",
+                    help="geolocation backends, default: ipstack (fake)")
+parser.add_argument("--new-ip-ratio", action="store", type=float, dest="new_ip_ratio", default=1.0,
+                    help="share of requests from a new IP address, default: 1.0")
+parser.add_argument("--concurrency", action="store", type=int, dest="concurrency", default=1,
+                    help="concurrent requests, default: 1")
+parser.add_argument("--iot-tps", action="store", dest="iot_tps",
+                    help="requests per second of the fake IoT API per region, for all APIs or per API, "
+                         "e.g. 10 or CreateThing=20,AttachPolicy=5")
+parser.add_argument("--iot-api-limits", action="store", dest="iot_api_limits",
+                    help="IOT_API_LIMITS of the Lambda, default: the AWS IoT quotas")
+parser.add_argument("--no-limiter", action="store_true", dest="no_limiter", default=False,
+                    help="disable the IoT limiter, botocore retries")
+parser.add_argument("--shared-limiter", action="store_true", dest="shared_limiter", default=False,
+                    help="coordinate the limit in the (fake) DynamoDB table")
+parser.add_argument("--log-level", action="store", dest="log_level", default="WARNING",
+                    help="log level of the Lambda, default: WARNING")
+parser.add_argument("-o", "--output", action="store", dest="output", help="write the results as JSON")
+parser.add_argument("-c", "--compare", action="store", dest="compare", help="JSON results of a previous run")
+args = parser.parse_args()
+
+baseline = None
+if args.compare:
+    with open(args.compare) as f:
+        baseline = json.load(f)
+
+results = Bench(args).run()
+print_results(results, baseline)
+
+if args.output:
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent = 2, sort_keys = True)
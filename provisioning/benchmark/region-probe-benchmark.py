@@ -0,0 +1,131 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# region-probe-benchmark.py
+# runs the region probes of the global device against local TLS stand-ins
+# with injected delays per region and routes the measurements with the
+# region selection of the Lambda function. It reports the measured against
+# the injected delays, the probe time per device and the region chosen by
+# distance, by the device's own probes and, for devices of the same network
+# that do not probe, by the aggregated probes of the others.
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmark_dir, '..', 'global-device'))
+sys.path.insert(0, os.path.join(benchmark_dir, '..', 'lambda'))
+
+import region_probe
+from region_index import load_index
+from rtt_routing import RttRouter, RttStats
+
+
+def parse_delays(value):
+    delays = {}
+    for part in value.split(','):
+        if part:
+            region, ms = part.split('=')
+            delays[region.strip()] = float(ms)
+    return delays
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))] if values else 0.0
+
+
+parser = argparse.ArgumentParser(description='Region probes against local TLS stand-ins and RTT based routing')
+parser.add_argument("-d", "--delays", action="store", dest="delays",
+                    default="eu-west-2=60,eu-west-1=25,eu-central-1=35,us-east-1=110,ap-south-1=2000",
+                    help="injected handshake delay in ms per region, default: "
+                         "eu-west-2=60,eu-west-1=25,eu-central-1=35,us-east-1=110,ap-south-1=2000")
+parser.add_argument("-n", "--devices", action="store", type=int, dest="devices", default=10,
+                    help="probing devices, default: 10")
+parser.add_argument("--lat", action="store", type=float, dest="lat", default=51.5,
+                    help="latitude of the devices, default: 51.5 (London)")
+parser.add_argument("--lon", action="store", type=float, dest="lon", default=-0.1,
+                    help="longitude of the devices, default: -0.1")
+parser.add_argument("--timeout", action="store", type=float, dest="timeout", default=1.0,
+                    help="probe timeout in seconds, default: 1.0")
+parser.add_argument("--distance-weight", action="store", type=float, dest="distance_weight", default=0.01,
+                    help="ms per km added to the handshake time, default: 0.01")
+parser.add_argument("-o", "--output", action="store", dest="output", help="write the results as JSON")
+args = parser.parse_args()
+
+delays = parse_delays(args.delays)
+work_dir = tempfile.mkdtemp(prefix = 'region-probe-')
+cert_file, key_file = region_probe.stand_in_certificate(work_dir)
+endpoints = dict((region, region_probe.StandInEndpoint(ms, cert_file, key_file)) for region, ms in delays.items())
+targets = region_probe.targets(sorted(endpoints), dict((r, e.address()) for r, e in endpoints.items()))
+
+region_index = load_index()
+router = RttRouter(region_index, RttStats(table_name = ''), distance_weight = args.distance_weight)
+prefix = 'v4/24:benchmark'
+
+samples = dict((region, []) for region in delays)
+probe_ms = []
+chosen = {}
+for i in range(args.devices):
+    start = time.time()
+    rtt = region_probe.probe_regions(targets, timeout = args.timeout)
+    probe_ms.append((time.time() - start) * 1000)
+    for region, ms in rtt.items():
+        samples[region].append(ms)
+    placement = router.place(prefix, rtt, args.lat, args.lon)
+    # as the Lambda function does after the claim
+    router.record(prefix, rtt)
+    region = placement['region'] if placement else None
+    chosen[region] = chosen.get(region, 0) + 1
+
+geo = region_index.lookup(args.lat, args.lon)
+warm = router.place(prefix, None, args.lat, args.lon)
+
+for endpoint in endpoints.values():
+    endpoint.close()
+shutil.rmtree(work_dir)
+
+results = {
+    'devices': args.devices,
+    'probe_ms': {'p50': round(percentile(probe_ms, 50), 1), 'p95': round(percentile(probe_ms, 95), 1)},
+    'regions': {},
+    'geo_region': geo['region'],
+    'rtt_regions': chosen,
+    'prefix_region': warm['region'] if warm else None
+}
+print("=> {} devices, probe time p50: {} ms, p95: {} ms, timeout: {} s".format(
+    args.devices, results['probe_ms']['p50'], results['probe_ms']['p95'], args.timeout))
+print("   {:<16} {:>10} {:>10} {:>10} {:>8}".format('region', 'injected', 'p50 ms', 'p95 ms', 'answered'))
+for region in sorted(delays, key = delays.get):
+    s = samples[region]
+    results['regions'][region] = {'injected_ms': delays[region], 'answered': len(s),
+                                  'p50_ms': round(percentile(s, 50), 1), 'p95_ms': round(percentile(s, 95), 1)}
+    print("   {:<16} {:>10} {:>10} {:>10} {:>8}".format(region, delays[region], results['regions'][region]['p50_ms'],
+                                                      results['regions'][region]['p95_ms'], len(s)))
+print("=> region by distance: {} ({:.0f} km)".format(geo['region'], geo['distance']))
+print("=> region by probes: {}".format(", ".join("{}: {}".format(r, n) for r, n in sorted(chosen.items()))))
+print("=> region for a device of the same network without probes: {}".format(results['prefix_region']))
+
+if args.output:
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent = 2, sort_keys = True)
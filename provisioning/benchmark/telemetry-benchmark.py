@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# telemetry-benchmark.py
+# runs the telemetry publisher of the global device against the local
+# broker stand-in with a simulated clock. The broker goes offline for a
+# part of the run, the benchmark reports messages and bytes per reading,
+# the maximum queue depth and dropped readings for the message formats and
+# compares them with one pretty printed JSON message per reading.
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'global-device'))
+
+import telemetry
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def reading(i):
+    return {"global": "device provisioning",
+            "datetime": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(1500000000 + i * 2))}
+
+
+def run(args, batch_size, compress, queue_dir):
+    clock = Clock()
+    broker = telemetry.StandInBroker()
+    if queue_dir:
+        queue = telemetry.DiskQueue(queue_dir, max_messages = args.queue_size, drop = args.drop)
+    else:
+        queue = telemetry.MemoryQueue(args.queue_size, drop = args.drop)
+    publisher = telemetry.Publisher(broker, 'data/mydevice1/misc', header = {"thing-name": "mydevice1"},
+                                    batch_size = batch_size, max_rate = args.max_rate, compress = compress,
+                                    queue = queue, clock = clock)
+
+    outage = range(int(args.readings * args.outage_start), int(args.readings * args.outage_end))
+    max_depth = 0
+    start = time.time()
+    for i in range(args.readings):
+        broker.online = i not in outage
+        publisher.add(reading(i))
+        publisher.pump()
+        max_depth = max(max_depth, len(queue))
+        clock.now += args.interval
+
+    # reconnected, drain the queue
+    broker.online = True
+    publisher.flush()
+    while len(queue):
+        clock.now += 1
+        publisher.pump()
+    elapsed = time.time() - start
+
+    delivered = broker.readings()
+    datetimes = [r['datetime'] for r in delivered]
+    assert datetimes == sorted(datetimes), "readings out of order"
+    stats = publisher.stats()
+    return {
+        'messages': stats['messages'],
+        'bytes': stats['bytes'],
+        'delivered': len(delivered),
+        'max_depth': max_depth,
+        'dropped': stats['dropped'],
+        'cpu_ms': elapsed * 1000
+    }
+
+
+parser = argparse.ArgumentParser(description='Telemetry publisher against a local broker stand-in')
+parser.add_argument("-n", "--readings", action="store", type=int, dest="readings", default=10000,
+                    help="number of readings, default: 10000")
+parser.add_argument("--interval", action="store", type=float, dest="interval", default=2.0,
+                    help="simulated seconds between readings, default: 2")
+parser.add_argument("--max-rate", action="store", type=float, dest="max_rate", default=5.0,
+                    help="maximum messages per second, default: 5")
+parser.add_argument("--queue-size", action="store", type=int, dest="queue_size", default=200,
+                    help="maximum number of queued messages, default: 200")
+parser.add_argument("--drop", action="store", choices=telemetry.DROP_POLICIES, dest="drop", default="oldest",
+                    help="drop policy of the queue, default: oldest")
+parser.add_argument("--outage", action="store", dest="outage", default="0.3,0.6",
+                    help="start and end of the outage as share of the run, default: 0.3,0.6")
+parser.add_argument("--memory", action="store_true", dest="memory", default=False,
+                    help="use the in-memory queue instead of the disk queue")
+args = parser.parse_args()
+args.outage_start, args.outage_end = [float(v) for v in args.outage.split(',')]
+
+legacy = len(json.dumps(dict(reading(0), **{"thing-name": "mydevice1"}), indent = 4))
+print("=> {} readings, outage: {}, queue size: {} messages, drop: {}".format(
+    args.readings, args.outage, args.queue_size, args.drop))
+print("   one pretty printed message per reading: {} messages, {} bytes/reading".format(args.readings, legacy))
+print("{:<18} {:>9} {:>10} {:>10} {:>10} {:>9} {:>8} {:>8}".format(
+    "format", "messages", "bytes", "B/reading", "delivered", "max depth", "dropped", "cpu ms"))
+
+for batch_size, compress in [(1, False), (10, False), (10, True), (50, True)]:
+    queue_dir = None if args.memory else tempfile.mkdtemp(prefix = 'telemetry-queue-')
+    try:
+        r = run(args, batch_size, compress, queue_dir)
+    finally:
+        if queue_dir:
+            shutil.rmtree(queue_dir)
+    name = "batch {}{}".format(batch_size, " zlib" if compress else "")
+    print("{:<18} {:>9} {:>10} {:>10.1f} {:>10} {:>9} {:>8} {:>8.0f}".format(
+        name, r['messages'], r['bytes'], r['bytes'] / float(max(r['delivered'], 1)), r['delivered'],
+        r['max_depth'], r['dropped'], r['cpu_ms']))
@@ -0,0 +1,96 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# cbor_decode.py
+# minimal CBOR (RFC 8949) decoder for the compact provisioning answer, the
+# counterpart of lambda/cbor_encode.py: maps, arrays, text and byte strings,
+# integers, floats, booleans and null. Byte strings are returned as bytes.
+
+import struct
+
+
+class Decoder(object):
+    def __init__(self, data):
+        self.data = bytearray(data)
+        self.pos = 0
+
+    def take(self, n):
+        if self.pos + n > len(self.data):
+            raise ValueError("truncated CBOR data")
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return bytes(chunk)
+
+    def length(self, info):
+        if info < 24:
+            return info
+        if info == 24:
+            return struct.unpack('>B', self.take(1))[0]
+        if info == 25:
+            return struct.unpack('>H', self.take(2))[0]
+        if info == 26:
+            return struct.unpack('>I', self.take(4))[0]
+        if info == 27:
+            return struct.unpack('>Q', self.take(8))[0]
+        raise ValueError("unsupported CBOR length: {}".format(info))
+
+    def decode(self):
+        initial = self.take(1)[0]
+        if not isinstance(initial, int):
+            initial = ord(initial)
+        major, info = initial >> 5, initial & 0x1f
+
+        if major == 7:
+            if info == 20:
+                return False
+            if info == 21:
+                return True
+            if info == 22:
+                return None
+            if info == 26:
+                return struct.unpack('>f', self.take(4))[0]
+            if info == 27:
+                return struct.unpack('>d', self.take(8))[0]
+            raise ValueError("unsupported CBOR simple value: {}".format(info))
+
+        n = self.length(info)
+        if major == 0:
+            return n
+        if major == 1:
+            return -1 - n
+        if major == 2:
+            return self.take(n)
+        if major == 3:
+            return self.take(n).decode('utf-8')
+        if major == 4:
+            return [self.decode() for i in range(n)]
+        if major == 5:
+            result = {}
+            for i in range(n):
+                key = self.decode()
+                result[key] = self.decode()
+            return result
+        raise ValueError("unsupported CBOR major type: {}".format(major))
+
+
+def loads(data):
+    decoder = Decoder(data)
+    obj = decoder.decode()
+    if decoder.pos != len(decoder.data):
+        raise ValueError("trailing data after CBOR item")
+    return obj
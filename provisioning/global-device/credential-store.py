@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# credential-store.py
+# manages the credential store of a gateway: import the credential files
+# that global-device.py writes per device, list, show, export and delete
+# devices.
+
+from __future__ import print_function
+
+import argparse
+import sys
+
+from credential_store import CredentialStore
+
+
+def migrate(store, args):
+    imported, skipped = store.migrate(args.directory, args.remove)
+    print("=> imported {} devices into {}".format(imported, store.path))
+    for thing_name in skipped:
+        print("   skipped {}: key or endpoint file missing".format(thing_name))
+
+
+def list_things(store, args):
+    for thing_name in store.things():
+        print(thing_name)
+    print("=> {} devices".format(len(store)), file = sys.stderr)
+
+
+def show(store, args):
+    credentials = store.get(args.thing_name)
+    if credentials is None:
+        sys.exit("error: {} not found".format(args.thing_name))
+    for column in ['thing_name', 'endpoint', 'region', 'provisioned_at']:
+        print("{}: {}".format(column, credentials[column]))
+    print("csr: {}".format('yes' if credentials['csr'] else 'no'))
+
+
+def export(store, args):
+    files = store.export(args.thing_name, args.directory)
+    if files is None:
+        sys.exit("error: {} not found".format(args.thing_name))
+    for name in sorted(files.values()):
+        print(name)
+
+
+def delete(store, args):
+    if not store.delete(args.thing_name):
+        sys.exit("error: {} not found".format(args.thing_name))
+    print("=> deleted {}".format(args.thing_name))
+
+
+parser = argparse.ArgumentParser(description='Credential store of the global devices on a gateway')
+parser.add_argument("-s", "--store", action="store", dest="store", default="credentials.db",
+                    help="credential store, default: credentials.db")
+commands = parser.add_subparsers(dest="command")
+commands.required = True
+
+p = commands.add_parser("migrate", help="import the credential files of all devices in a directory")
+p.add_argument("-d", "--directory", action="store", dest="directory", default=".",
+               help="directory with the credential files, default: .")
+p.add_argument("--remove", action="store_true", dest="remove", default=False,
+               help="remove the files of imported devices")
+p.set_defaults(func=migrate)
+
+p = commands.add_parser("list", help="list the devices")
+p.set_defaults(func=list_things)
+
+p = commands.add_parser("show", help="show endpoint and region of a device")
+p.add_argument("thing_name")
+p.set_defaults(func=show)
+
+p = commands.add_parser("export", help="write the credential files of a device")
+p.add_argument("thing_name")
+p.add_argument("-d", "--directory", action="store", dest="directory", default=".",
+               help="directory for the files, default: .")
+p.set_defaults(func=export)
+
+p = commands.add_parser("delete", help="delete a device")
+p.add_argument("thing_name")
+p.set_defaults(func=delete)
+
+args = parser.parse_args()
+store = CredentialStore(args.store)
+try:
+    args.func(store, args)
+finally:
+    store.close()
@@ -0,0 +1,163 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# credential_store.py
+# credentials of the devices that run on a gateway in one SQLite database,
+# keyed by thing name: private key, certificate, CSR, endpoint and region.
+# A device is stored in a single transaction when it has been provisioned,
+# a crash leaves either all or none of its credentials. The files that
+# global-device.py writes without a store can be imported with migrate().
+
+import atexit
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import device_provisioning
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS credentials (
+    thing_name TEXT PRIMARY KEY,
+    private_key TEXT NOT NULL,
+    certificate TEXT NOT NULL,
+    csr TEXT,
+    endpoint TEXT NOT NULL,
+    region TEXT NOT NULL,
+    provisioned_at TEXT NOT NULL
+)
+'''
+
+COLUMNS = ['thing_name', 'private_key', 'certificate', 'csr', 'endpoint', 'region', 'provisioned_at']
+INSERT = 'INSERT OR REPLACE INTO credentials ({}) VALUES ({})'.format(', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)))
+
+
+class CredentialStore(object):
+    def __init__(self, path):
+        self.path = path
+        # the store holds private keys
+        if not os.path.exists(path):
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        self.db = sqlite3.connect(path, timeout = 30)
+        # several device processes of a gateway can share the store
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(SCHEMA)
+        self.db.commit()
+        self.run_dir = None
+
+    def close(self):
+        self.db.close()
+
+    def get(self, thing_name):
+        row = self.db.execute('SELECT {} FROM credentials WHERE thing_name = ?'.format(', '.join(COLUMNS)),
+                              (thing_name,)).fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def put(self, thing_name, private_key, certificate, endpoint, region, csr = None):
+        with self.db:
+            self.db.execute(INSERT, (thing_name, private_key, certificate, csr, endpoint, region,
+                                     time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())))
+
+    def store_answer(self, thing_name, answer, key_pem = None, csr_pem = None):
+        # stores the answer of a provisioning request
+        self.put(thing_name, key_pem if key_pem else answer['PrivateKey'], answer['certificatePem'],
+                 answer['endpointAddress'], answer['region'], csr_pem)
+
+    def delete(self, thing_name):
+        with self.db:
+            return self.db.execute('DELETE FROM credentials WHERE thing_name = ?', (thing_name,)).rowcount > 0
+
+    def things(self):
+        return [r[0] for r in self.db.execute('SELECT thing_name FROM credentials ORDER BY thing_name')]
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM credentials').fetchone()[0]
+
+    def __contains__(self, thing_name):
+        return self.db.execute('SELECT 1 FROM credentials WHERE thing_name = ?', (thing_name,)).fetchone() is not None
+
+    def export(self, thing_name, directory):
+        # writes the credentials as files, returns the file names like
+        # device_provisioning.credential_files()
+        credentials = self.get(thing_name)
+        if credentials is None:
+            return None
+        files = dict((k, os.path.join(directory, v))
+                     for k, v in device_provisioning.credential_files(thing_name).items())
+        write_private(files['key_file'], credentials['private_key'])
+        device_provisioning.write_file(files['cert_file'], credentials['certificate'])
+        device_provisioning.write_file(files['endpoint_file'], credentials['endpoint'] + '::' + credentials['region'])
+        if credentials['csr']:
+            device_provisioning.write_file(files['csr_file'], credentials['csr'])
+        else:
+            del files['csr_file']
+        return files
+
+    def materialize(self, thing_name):
+        # the MQTT client reads key and certificate from files, also when it
+        # reconnects. They are written to a private directory that is removed
+        # when the process exits.
+        if self.run_dir is None:
+            self.run_dir = tempfile.mkdtemp(prefix = 'global-device-')
+            atexit.register(shutil.rmtree, self.run_dir, True)
+        return self.export(thing_name, self.run_dir)
+
+    def migrate(self, directory = '.', remove = False):
+        # imports the credential files of all devices in directory in one
+        # transaction, returns (imported, skipped thing names)
+        imported = []
+        skipped = []
+        suffix = '.device.cert.pem'
+        with self.db:
+            for name in sorted(os.listdir(directory)):
+                if not name.endswith(suffix):
+                    continue
+                thing_name = name[:-len(suffix)]
+                files = dict((k, os.path.join(directory, v))
+                             for k, v in device_provisioning.credential_files(thing_name).items())
+                if not os.path.isfile(files['key_file']) or not os.path.isfile(files['endpoint_file']):
+                    skipped.append(thing_name)
+                    continue
+
+                endpoint, region = device_provisioning.read_endpoint(files['endpoint_file'])
+                csr = read_file(files['csr_file']) if os.path.isfile(files['csr_file']) else None
+                self.db.execute(INSERT, (
+                    thing_name, read_file(files['key_file']), read_file(files['cert_file']), csr, endpoint, region,
+                    time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(os.path.getmtime(files['cert_file'])))))
+                imported.append(thing_name)
+
+        # files are removed after the transaction has been committed
+        if remove:
+            for thing_name in imported:
+                for f in device_provisioning.credential_files(thing_name).values():
+                    path = os.path.join(directory, f)
+                    if os.path.isfile(path):
+                        os.remove(path)
+        return len(imported), skipped
+
+
+def read_file(file_name):
+    with open(file_name, 'r') as f:
+        return f.read()
+
+
+def write_private(file_name, content):
+    fd = os.open(file_name, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
@@ -0,0 +1,174 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# device_provisioning.py
+# provisioning flow of the global device: sign the thing name, optionally
+# create a private key and CSR, send the provisioning request and store the
+# answer. Used by global-device.py and the fleet load generator.
+
+import base64
+import json
+
+import requests
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+from cryptography.x509.oid import NameOID
+
+import cbor_decode
+
+# key types for the device key and CSR. AWS IoT issues certificates for
+# RSA and ECDSA P-256/P-384 keys, EC keys are faster to create and give
+# smaller keys, CSRs and signatures.
+KEY_TYPES = ['rsa', 'ec-p256', 'ec-p384']
+DEFAULT_KEY_TYPE = 'rsa'
+
+
+def generate_private_key(key_type = DEFAULT_KEY_TYPE):
+    if key_type == 'rsa':
+        return rsa.generate_private_key(public_exponent = 65537, key_size = 2048)
+    if key_type == 'ec-p256':
+        return ec.generate_private_key(ec.SECP256R1())
+    if key_type == 'ec-p384':
+        return ec.generate_private_key(ec.SECP384R1())
+    raise ValueError("unknown key type: {}".format(key_type))
+
+
+def signature_hash(key):
+    # the Lambda function verifies ECDSA signatures with SHA-256 for
+    # curves up to 256 bits and SHA-384 above
+    if isinstance(key, ec.EllipticCurvePrivateKey) and key.curve.key_size > 256:
+        return hashes.SHA384()
+    return hashes.SHA256()
+
+
+def sign(key, data):
+    if isinstance(key, rsa.RSAPrivateKey):
+        return key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+    if isinstance(key, ec.EllipticCurvePrivateKey):
+        return key.sign(data, ec.ECDSA(signature_hash(key)))
+    if isinstance(key, ed25519.Ed25519PrivateKey):
+        return key.sign(data)
+    raise ValueError("unsupported signing key: {}".format(type(key).__name__))
+
+
+def load_signing_key(priv_key_file):
+    with open(priv_key_file, 'rb') as f:
+        return serialization.load_pem_private_key(f.read(), password = None)
+
+
+def sign_thing_name(signing_key, thing_name):
+    # base64 encoded signature of the thing name, the algorithm follows the
+    # type of the signing key
+    sig = sign(signing_key, thing_name.encode('utf-8'))
+    return base64.b64encode(sig).decode('ascii')
+
+
+def create_key_and_csr(thing_name, key_type = DEFAULT_KEY_TYPE):
+    # returns private key and CSR as PEM
+    device_priv_key = generate_private_key(key_type)
+    csr = x509.CertificateSigningRequestBuilder().subject_name(
+        x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, thing_name)])
+    ).sign(device_priv_key, signature_hash(device_priv_key))
+
+    key_pem = device_priv_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ).decode('ascii')
+    csr_pem = csr.public_bytes(serialization.Encoding.PEM).decode('ascii')
+    return key_pem, csr_pem
+
+
+def build_payload(thing_name, sig, csr_pem = None, region_rtt = None):
+    # region_rtt: handshake times in ms per region, see region_probe.py
+    payload = {'thing-name': thing_name, 'thing-name-sig': sig}
+    if csr_pem:
+        payload['CSR'] = csr_pem
+    if region_rtt:
+        payload['region-rtt'] = region_rtt
+    return payload
+
+
+# encodings of the answer, see lambda/answer_encoding.py. JSON answers are
+# compressed by API Gateway, requests asks for gzip by default.
+ENCODINGS = {'json': 'application/json', 'cbor': 'application/cbor'}
+
+
+def send_request(api_gw, payload, timeout = 30, encoding = 'json'):
+    # returns the response and the parsed answer
+    r = requests.post(api_gw, data = json.dumps(payload), headers = {'Accept': ENCODINGS[encoding]},
+                      timeout = timeout)
+    return r, parse_answer(r.headers.get('Content-Type'), r.content)
+
+
+def parse_answer(content_type, body):
+    # parses the body once, compact answers are expanded to the JSON form
+    # with PEM certificate and key
+    if (content_type or '').startswith(ENCODINGS['cbor']):
+        return expand(cbor_decode.loads(body))
+
+    answer = json.loads(body.decode('utf-8'))
+    if isinstance(answer, dict) and answer.get('content-type') == ENCODINGS['cbor']:
+        # the envelope of the Lambda function, e.g. when it is invoked directly
+        return expand(cbor_decode.loads(base64.b64decode(answer['body'])))
+    return answer
+
+
+def der_to_pem(der, label):
+    b64 = base64.b64encode(der).decode('ascii')
+    body = '\n'.join(b64[i:i + 64] for i in range(0, len(b64), 64))
+    return '-----BEGIN {0}-----\n{1}\n-----END {0}-----\n'.format(label, body)
+
+
+def expand(answer):
+    answer = dict(answer)
+    if 'certificateDer' in answer:
+        answer['certificatePem'] = der_to_pem(answer.pop('certificateDer'), 'CERTIFICATE')
+    if 'privateKeyDer' in answer:
+        answer['PrivateKey'] = der_to_pem(answer.pop('privateKeyDer'), answer.pop('privateKeyLabel', 'RSA PRIVATE KEY'))
+    if 'results' in answer:
+        answer['results'] = [expand(r) for r in answer['results']]
+    return answer
+
+
+def write_file(file_name, content):
+    with open(file_name, 'w') as f:
+        f.write(content)
+
+
+def store_credentials(files, answer, key_pem = None):
+    # files: dict with key_file, cert_file, endpoint_file
+    write_file(files['cert_file'], answer['certificatePem'])
+    write_file(files['key_file'], key_pem if key_pem else answer['PrivateKey'])
+    write_file(files['endpoint_file'], answer['endpointAddress'] + '::' + answer['region'])
+
+
+def credential_files(thing_name):
+    return {
+        'key_file': thing_name + '.device.key.pem',
+        'csr_file': thing_name + '.device.csr.pem',
+        'cert_file': thing_name + '.device.cert.pem',
+        'endpoint_file': thing_name + '.endpoint'
+    }
+
+
+def read_endpoint(endpoint_file):
+    # returns (endpoint, region)
+    with open(endpoint_file, 'r') as f:
+        line = f.readline().rstrip('\n')
+    endpoint_region = line.split('::')
+    return endpoint_region[0], endpoint_region[1]
@@ -25,18 +25,24 @@
 # With this information the device is able to connect to the endpoint where it has been provisioned and may publish data.
 
 import argparse
-import base64
 import json
 import os
-import requests
 import sys
 import time
 import uuid
 from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
-from OpenSSL import crypto
-from OpenSSL.crypto import X509
 from time import gmtime, strftime
 
+import credential_store
+import device_provisioning
+import region_probe
+import telemetry
+
+try:
+    input = raw_input
+except NameError:
+    pass
+
 # globals
 
 # signing key file
@@ -45,91 +51,59 @@ priv_key_file = 'global-provisioning.priv.key.pem'
 #rootCAPath = "root.ca.pem"
 rootCAPath = 'root.ca.bundle.pem'
 
+continue_provisioning = False
 
-#
-# parse command line args
-#
-parser = argparse.ArgumentParser(description='Sample device for global provisiong with AWS IoT Core')
-parser.add_argument("-t", "--thing-name", action="store", required=True, dest="thing_name", help="thing name for your device")
-parser.add_argument("-a", "--api-gw", action="store", required=True, dest="api_gw", help="API Gateway URL for device provisioning")
-parser.add_argument("-k", "--own-key", action="store_true", dest="use_own_priv_key", default=False,
-                    help="Use own private key for the device")
-parser.add_argument("-c", "--continue", action="store_true", dest="continue_provisioning", default=False,
-                    help="continue the provisioning process without interaction")
-parser.add_argument("-f", "--fake-device", action="store_true", dest="fake_device", default=False,
-                    help="use a fake device name to demonstrate that verifying the sig fails")
-
-args = parser.parse_args()
-thing_name = args.thing_name
-api_gw = args.api_gw
-use_own_priv_key = args.use_own_priv_key
-continue_provisioning = args.continue_provisioning
-fake_device = args.fake_device
-
-endpoint = None
 
 def cont():
     if continue_provisioning:
         return
-    raw_input("== press <enter> to continue, <ctrl+c> to abort!\n")
-
-# key/cert/csr file name for the thing
-key_file = thing_name + '.device.key.pem'
-csr_file = thing_name + '.device.csr.pem'
-cert_file = thing_name + '.device.cert.pem'
-endpoint_file = thing_name + '.endpoint'
-
-
-if os.path.isfile(key_file) and os.path.isfile(cert_file):
-    print("=> device already provisioned")
-    f = open(endpoint_file, 'r')
-    line = f.readline().rstrip('\n')
-    f.close()
-    endpoint_region = line.split('::')
-    endpoint = endpoint_region[0]
-    region = endpoint_region[1]
-    print("   endpoint: {}, region: {}".format(endpoint, region))
-    cont()
-else:
+    input("== press <enter> to continue, <ctrl+c> to abort!\n")
+
+
+def probe(regions, endpoint, timeout):
+    # handshake times to the regional endpoints for the region selection
+    print("=> probing {} regions...".format(len(regions)))
+    rtt = region_probe.probe_regions(region_probe.targets(regions, endpoint), timeout = timeout)
+    for region in sorted(rtt, key = rtt.get):
+        print("   {}: {} ms".format(region, rtt[region]))
+    if not rtt:
+        print("   no region answered, the region is chosen by location")
+    return rtt
+
+
+def provision(thing_name, api_gw, use_own_priv_key, fake_device, files, key_type = device_provisioning.DEFAULT_KEY_TYPE,
+              store = None, region_rtt = None, encoding = 'json'):
+    # returns (thing_name, endpoint, region) or None if the device has not
+    # been provisioned. With a credential store the credentials are stored
+    # there instead of in files.
+    store_name = thing_name
     print("=> provisioning device with AWS IoT Core...")
     print("   thing-name: {}".format(thing_name))
     print("   use_own_priv_key: {}".format(use_own_priv_key))
+    if use_own_priv_key:
+        print("   key_type: {}".format(key_type))
     cont()
 
     # ### Create Signature for Thing Name
     # For a valid provisioning request the device must send it's name as well as the sig for the thing name. The signature is created with a private key.
-    f = open(priv_key_file, 'r')
-    priv_key_pem = f.read()
-    f.close()
-    priv_key = crypto.load_privatekey(crypto.FILETYPE_PEM, priv_key_pem)
-    sig = crypto.sign(priv_key, thing_name, 'sha256')
-    sig = base64.b64encode(sig)
+    signing_key = device_provisioning.load_signing_key(priv_key_file)
+    sig = device_provisioning.sign_thing_name(signing_key, thing_name)
 
 
     # ### Create a Provisioning Request with own private key and CSR
     # If you want to create the private on your own you can send a CSR together with the provisioning request and let AWS IoT issue the certificate.
 
+    key_pem = None
+    csr_pem = None
     if use_own_priv_key:
         print("=> creating own private key...")
         cont()
-        device_priv_key = crypto.PKey()
-        device_priv_key.generate_key(crypto.TYPE_RSA, 2048)
-        print(crypto.dump_privatekey(crypto.FILETYPE_PEM, device_priv_key))
-
-        file_k = open(key_file,"w")
-        file_k.write(crypto.dump_privatekey(crypto.FILETYPE_PEM, device_priv_key))
-        file_k.close()
-
-        csr = crypto.X509Req()
-        subj = csr.get_subject()
-        setattr(subj, "CN", thing_name)
-        csr.set_pubkey(device_priv_key)
-        csr.sign(device_priv_key, 'sha256')
-        print(crypto.dump_certificate_request(crypto.FILETYPE_PEM, csr))
-
-        file_cs= open(csr_file,"w")
-        file_cs.write(crypto.dump_certificate_request(crypto.FILETYPE_PEM, csr))
-        file_cs.close()
+        key_pem, csr_pem = device_provisioning.create_key_and_csr(thing_name, key_type)
+        print(key_pem)
+        print(csr_pem)
+        if store is None:
+            device_provisioning.write_file(files['key_file'], key_pem)
+            device_provisioning.write_file(files['csr_file'], csr_pem)
     else:
         print("=> using private key from AWS IoT")
 
@@ -138,9 +112,7 @@ else:
         print("=> faking device name")
         thing_name = str(uuid.uuid4())
 
-    payload = {'thing-name': thing_name, 'thing-name-sig': sig}
-    if use_own_priv_key:
-        payload = {'thing-name': thing_name, 'thing-name-sig': sig, 'CSR': crypto.dump_certificate_request(crypto.FILETYPE_PEM, csr)}
+    payload = device_provisioning.build_payload(thing_name, sig, csr_pem, region_rtt)
 
     print("=> request payload that will be send to the API Gateway...")
     print("   api gateway url: {}".format(api_gw))
@@ -150,97 +122,213 @@ else:
     # ### Send Provisioning Request
     # Send the provisioning request to an API Gateway. The API Gateway will call a Lambda which provisions the device.
     print("=> sending request to API Gateway...")
-    r = requests.post(api_gw, data=json.dumps(payload))
+    r, answer = device_provisioning.send_request(api_gw, payload, encoding = encoding)
     print("<= headers: {}".format(r.headers))
-    print("<= text: {}".format(r.text))
-    status = r.json()["status"]
-    if status == "error":
+    if encoding == 'json':
+        print("<= text: {}".format(r.text))
+    else:
+        print("<= {} bytes {}".format(len(r.content), r.headers.get('Content-Type')))
+    if answer["status"] == "error":
         print("<= error: device not provisioned")
-        sys.exit()
+        return None
     cont()
 
 
     # ### Return Values
     # Testing some return values from the provisioning request.
 
-    region = r.json()["region"]
-    endpoint = r.json()["endpointAddress"]
+    region = answer["region"]
+    endpoint = answer["endpointAddress"]
     print("<= region: {}".format(region))
     print("<= endpoint: {}".format(endpoint))
-    print("<= certificatePem:\n{}".format(r.json()["certificatePem"]))
+    print("<= certificatePem:\n{}".format(answer["certificatePem"]))
 
     if not use_own_priv_key:
-        print("<= PrivateKey\n{}".format(r.json()["PrivateKey"]))
+        print("<= PrivateKey\n{}".format(answer["PrivateKey"]))
 
 
     # ### Store Key and Certificate
     # Write key and certificate to file.
 
-    print("=> writing cert/key to file...")
-    file_c = open(cert_file,"w")
-    file_c.write(r.json()["certificatePem"])
-    file_c.close()
-
-    if not use_own_priv_key:
-        file_k = open(key_file,"w")
-        file_k.write(r.json()["PrivateKey"])
-        file_k.close()
-
-    file_e = open(endpoint_file,"w")
-    file_e.write(endpoint + '::' + region)
-    file_e.close()
-
-
-print("=> device is ready to communicate with AWS IoT...")
-cont()
+    if store is not None:
+        print("=> writing cert/key to credential store {}...".format(store.path))
+        store.store_answer(store_name, answer, key_pem, csr_pem)
+    else:
+        print("=> writing cert/key to file...")
+        device_provisioning.store_credentials(files, answer, key_pem)
+
+    return thing_name, endpoint, region
+
+
+def main():
+    global continue_provisioning, priv_key_file
+
+    #
+    # parse command line args
+    #
+    parser = argparse.ArgumentParser(description='Sample device for global provisiong with AWS IoT Core')
+    parser.add_argument("-t", "--thing-name", action="store", required=True, dest="thing_name", help="thing name for your device")
+    parser.add_argument("-a", "--api-gw", action="store", required=True, dest="api_gw", help="API Gateway URL for device provisioning")
+    parser.add_argument("-k", "--own-key", action="store_true", dest="use_own_priv_key", default=False,
+                        help="Use own private key for the device")
+    parser.add_argument("--key-type", action="store", choices=device_provisioning.KEY_TYPES, dest="key_type",
+                        default=device_provisioning.DEFAULT_KEY_TYPE,
+                        help="type of the own private key, default: " + device_provisioning.DEFAULT_KEY_TYPE)
+    parser.add_argument("-s", "--signing-key", action="store", dest="signing_key", default=priv_key_file,
+                        help="key to sign the thing name (RSA, EC P-256/P-384 or Ed25519), default: " + priv_key_file)
+    parser.add_argument("-c", "--continue", action="store_true", dest="continue_provisioning", default=False,
+                        help="continue the provisioning process without interaction")
+    parser.add_argument("-f", "--fake-device", action="store_true", dest="fake_device", default=False,
+                        help="use a fake device name to demonstrate that verifying the sig fails")
+    parser.add_argument("--store", action="store", dest="store",
+                        help="credential store (SQLite) instead of files per device, e.g. credentials.db")
+    parser.add_argument("--encoding", action="store", choices=sorted(device_provisioning.ENCODINGS), dest="encoding",
+                        default="json", help="encoding of the answer, cbor sends DER certificate and key, default: json")
+    parser.add_argument("--probe", action="store_true", dest="probe", default=False,
+                        help="measure the TLS handshake time to the regions and send it with the request")
+    parser.add_argument("--probe-regions", action="store", dest="probe_regions",
+                        help="comma separated regions to probe, default: all regions of --regions-file")
+    parser.add_argument("--regions-file", action="store", dest="regions_file", default=region_probe.DEFAULT_REGIONS_FILE,
+                        help="regions.json of the Lambda function, default: ../lambda/regions.json")
+    parser.add_argument("--probe-endpoint", action="store", dest="probe_endpoint", default=region_probe.DEFAULT_ENDPOINT,
+                        help="host:port to probe per region, default: " + region_probe.DEFAULT_ENDPOINT)
+    parser.add_argument("--probe-timeout", action="store", type=float, dest="probe_timeout", default=1.0,
+                        help="seconds to wait for a handshake, default: 1.0")
+    parser.add_argument("--interval", action="store", type=float, dest="interval", default=2.0,
+                        help="seconds between readings, default: 2")
+    parser.add_argument("--batch-size", action="store", type=int, dest="batch_size", default=10,
+                        help="readings per message, default: 10")
+    parser.add_argument("--max-rate", action="store", type=float, dest="max_rate", default=5.0,
+                        help="maximum messages per second, also while sending queued messages, default: 5")
+    parser.add_argument("-z", "--compress", action="store_true", dest="compress", default=False,
+                        help="compress messages with zlib, they are published to <topic>/z")
+    parser.add_argument("--qos", action="store", type=int, choices=[0, 1], dest="qos", default=0,
+                        help="MQTT QoS, default: 0")
+    parser.add_argument("--queue-dir", action="store", dest="queue_dir",
+                        help="directory of the offline queue, default: <thing name>.queue")
+    parser.add_argument("--queue-size", action="store", type=int, dest="queue_size", default=1000,
+                        help="maximum number of queued messages, default: 1000")
+    parser.add_argument("--drop", action="store", choices=telemetry.DROP_POLICIES, dest="drop", default="oldest",
+                        help="message to drop if the queue is full, default: oldest")
+    parser.add_argument("--stats-interval", action="store", type=float, dest="stats_interval", default=60,
+                        help="seconds between publisher statistics, default: 60")
+
+    args = parser.parse_args()
+    thing_name = args.thing_name
+    continue_provisioning = args.continue_provisioning
+    priv_key_file = args.signing_key
+
+    # key/cert/csr file name for the thing
+    files = device_provisioning.credential_files(thing_name)
+    store = credential_store.CredentialStore(args.store) if args.store else None
+
+    if store is not None and thing_name in store:
+        print("=> device already provisioned, credentials in {}".format(args.store))
+        credentials = store.get(thing_name)
+        endpoint, region = credentials['endpoint'], credentials['region']
+        print("   endpoint: {}, region: {}".format(endpoint, region))
+        files = store.materialize(thing_name)
+        cont()
+    elif store is None and os.path.isfile(files['key_file']) and os.path.isfile(files['cert_file']):
+        print("=> device already provisioned")
+        endpoint, region = device_provisioning.read_endpoint(files['endpoint_file'])
+        print("   endpoint: {}, region: {}".format(endpoint, region))
+        cont()
+    else:
+        stored_name = thing_name
+        region_rtt = None
+        if args.probe:
+            if args.probe_regions:
+                regions = args.probe_regions.split(',')
+            else:
+                regions = region_probe.load_regions(args.regions_file)
+            region_rtt = probe(regions, args.probe_endpoint, args.probe_timeout)
+        result = provision(thing_name, args.api_gw, args.use_own_priv_key, args.fake_device, files, args.key_type,
+                           store, region_rtt, args.encoding)
+        if result is None:
+            sys.exit()
+        thing_name, endpoint, region = result
+        if store is not None:
+            files = store.materialize(stored_name)
+
+
+    print("=> device is ready to communicate with AWS IoT...")
+    cont()
 
-host = endpoint
-certificatePath = cert_file
-privateKeyPath = key_file
-clientId = thing_name
-topic = "data/" + thing_name + "/misc"
+    host = endpoint
+    certificatePath = files['cert_file']
+    privateKeyPath = files['key_file']
+    clientId = thing_name
+    topic = "data/" + thing_name + "/misc"
+
+
+    myAWSIoTMQTTClient = None
+    myAWSIoTMQTTClient = AWSIoTMQTTClient(clientId)
+    myAWSIoTMQTTClient.configureEndpoint(host, 8883)
+    myAWSIoTMQTTClient.configureCredentials(rootCAPath, privateKeyPath, certificatePath)
+
+    # AWSIoTMQTTClient connection configuration
+    myAWSIoTMQTTClient.configureAutoReconnectBackoffTime(1, 32, 20)
+    myAWSIoTMQTTClient.configureOfflinePublishQueueing(0)  # queued by the telemetry publisher on disk
+    myAWSIoTMQTTClient.configureDrainingFrequency(2)  # Draining: 2 Hz
+    myAWSIoTMQTTClient.configureConnectDisconnectTimeout(10)  # 10 sec
+    myAWSIoTMQTTClient.configureMQTTOperationTimeout(5)  # 5 sec
+
+    # Connect and subscribe to AWS IoT
+    if myAWSIoTMQTTClient.connect():
+        print("<= device connected to AWS IoT in region: {}".format(region))
+        print("   before you continue subscribe in the AWS IoT console to the topic: {}".format(topic))
+        cont()
+    else:
+        print("error: device could not connect to AWS IoT in region: {}".format(region))
+        print("       check logs, thing, certificate, key, policy")
+        sys.exit()
 
 
-myAWSIoTMQTTClient = None
-myAWSIoTMQTTClient = AWSIoTMQTTClient(clientId)
-myAWSIoTMQTTClient.configureEndpoint(host, 8883)
-myAWSIoTMQTTClient.configureCredentials(rootCAPath, privateKeyPath, certificatePath)
 
-# AWSIoTMQTTClient connection configuration
-myAWSIoTMQTTClient.configureAutoReconnectBackoffTime(1, 32, 20)
-myAWSIoTMQTTClient.configureOfflinePublishQueueing(-1)  # Infinite offline Publish queueing
-myAWSIoTMQTTClient.configureDrainingFrequency(2)  # Draining: 2 Hz
-myAWSIoTMQTTClient.configureConnectDisconnectTimeout(10)  # 10 sec
-myAWSIoTMQTTClient.configureMQTTOperationTimeout(5)  # 5 sec
+    # ### Publish a message
+    # **Before you publish a message to the AWS IoT Console and subcribe to "data/#"**. The device publishes a message. If everthing went well during the registration process the message should be seen in the AWS IoT Console.
+    print("=> start publishing... press <ctrl+c> to abort")
 
-# Connect and subscribe to AWS IoT
-if myAWSIoTMQTTClient.connect():
-    print("<= device connected to AWS IoT in region: {}".format(region))
-    print("   before you continue subscribe in the AWS IoT console to the topic: {}".format(topic))
-    cont()
-else:
-    print("error: device could not connect to AWS IoT in region: {}".format(region))
-    print("       check logs, thing, certificate, key, policy")
-    sys.exit()
+    # readings are batched into one message per --batch-size readings,
+    # messages that can not be published are queued on disk
+    queue = telemetry.DiskQueue(args.queue_dir or thing_name + '.queue', max_messages = args.queue_size,
+                                drop = args.drop)
+    publisher = telemetry.Publisher(myAWSIoTMQTTClient, topic, header = {"thing-name": thing_name},
+                                    batch_size = args.batch_size, max_rate = args.max_rate,
+                                    compress = args.compress, queue = queue, qos = args.qos)
+    if len(queue):
+        print("=> {} queued messages from a previous run".format(len(queue)))
 
+    next_stats = time.time() + args.stats_interval
+    try:
+        while True:
+            reading = {"global": "device provisioning", "datetime": time.strftime("%Y-%m-%dT%H:%M:%S", gmtime())}
+            print ("=> reading: {}".format(reading))
+            publisher.add(reading)
+            publisher.pump()
 
+            if time.time() >= next_stats:
+                stats = publisher.stats()
+                print("=> messages/s: {messages_per_s:.2f}, bytes/s: {bytes_per_s:.0f}, queue depth: {queue_depth}, "
+                      "dropped: {dropped}, failed: {failed}".format(**stats))
+                next_stats += args.stats_interval
+            time.sleep(args.interval)
+    finally:
+        # readings of the incomplete batch are sent after the next start
+        publisher.close()
+        if len(queue):
+            print("=> {} messages queued for the next run".format(len(queue)))
 
-# ### Publish a message
-# **Before you publish a message to the AWS IoT Console and subcribe to "data/#"**. The device publishes a message. If everthing went well during the registration process the message should be seen in the AWS IoT Console.
-print("=> start publishing... press <ctrl+c> to abort")
 
-while True:
-    message = {"thing-name": thing_name, "global": "device provisioning",
-               "datetime": time.strftime("%Y-%m-%dT%H:%M:%S", gmtime())}
-    print ("=> publishing message: {}".format(message))
-    myAWSIoTMQTTClient.publish(topic, json.dumps(message, indent=4), 0)
-    time.sleep(2)
+    # This message should not arrive because the policy in this example allows the device only to publish to "data/${iot:
+    # ClientId}/#'
 
+    # In[ ]:
 
-# This message should not arrive because the policy in this example allows the device only to publish to "data/${iot:
-# ClientId}/#'
 
-# In[ ]:
+    #myAWSIoTMQTTClient.publish('other/topic', json.dumps(message, indent=4), 0)
 
 
-#myAWSIoTMQTTClient.publish('other/topic', json.dumps(message, indent=4), 0)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# region_probe.py
+# measures the time of a TCP connect and TLS handshake to the AWS IoT
+# endpoint of every candidate region, concurrently and with a short
+# timeout. The times are sent as region-rtt in the provisioning request;
+# the Lambda function prefers the region with the lowest time over the
+# closest one. Only the handshake is measured, no data is sent, so the
+# server certificate is not verified. StandInEndpoint is a local TLS server
+# with an injected delay to test the probes without AWS.
+
+import datetime
+import json
+import os
+import socket
+import ssl
+import threading
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+# the regions of the Lambda function, copy the file to devices that are
+# deployed without the repository
+DEFAULT_REGIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda', 'regions.json')
+DEFAULT_ENDPOINT = 'iot.{region}.amazonaws.com:443'
+
+
+def load_regions(regions_file = DEFAULT_REGIONS_FILE):
+    with open(regions_file) as f:
+        return [r['name'] for r in json.load(f)['regions']]
+
+
+def probe_context():
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def handshake_ms(host, port = 443, timeout = 1.0, context = None):
+    context = context or probe_context()
+    start = time.time()
+    sock = socket.create_connection((host, port), timeout = timeout)
+    try:
+        tls = context.wrap_socket(sock, server_hostname = host)
+        elapsed = (time.time() - start) * 1000
+        tls.close()
+    finally:
+        sock.close()
+    return elapsed
+
+
+def targets(regions, endpoint = DEFAULT_ENDPOINT):
+    # {region: (host, port)} for an endpoint template like
+    # iot.{region}.amazonaws.com:443, or a mapping region=host:port
+    result = {}
+    for region in regions:
+        address = endpoint[region] if isinstance(endpoint, dict) else endpoint.format(region = region)
+        host, _, port = address.rpartition(':') if ':' in address else (address, None, '443')
+        result[region] = (host, int(port))
+    return result
+
+
+def probe_regions(targets, timeout = 1.0, samples = 1):
+    # returns {region: ms}, the fastest of samples handshakes. Regions that
+    # fail or do not answer within timeout are left out.
+    results = {}
+    lock = threading.Lock()
+    context = probe_context()
+
+    def probe(region, host, port):
+        times = []
+        for i in range(samples):
+            try:
+                times.append(handshake_ms(host, port, timeout, context))
+            except (socket.error, ssl.SSLError, socket.timeout):
+                pass
+        if times:
+            with lock:
+                results[region] = round(min(times), 1)
+
+    threads = [threading.Thread(target = probe, args = (region, host, port))
+               for region, (host, port) in targets.items()]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join(timeout * samples + 1)
+    with lock:
+        return dict(results)
+
+
+def stand_in_certificate(directory):
+    # self-signed certificate for stand-in endpoints, returns (cert_file, key_file)
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, u'localhost')])
+    now = datetime.datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()).not_valid_before(now - datetime.timedelta(days = 1)) \
+        .not_valid_after(now + datetime.timedelta(days = 1)).sign(key, hashes.SHA256())
+
+    cert_file = os.path.join(directory, 'stand-in.cert.pem')
+    key_file = os.path.join(directory, 'stand-in.key.pem')
+    with open(cert_file, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_file, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_file, key_file
+
+
+class StandInEndpoint(object):
+    # local TLS server that waits delay_ms before it answers a handshake
+    def __init__(self, delay_ms, cert_file, key_file, host = '127.0.0.1'):
+        self.delay = delay_ms / 1000.0
+        self.context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+        self.context.load_cert_chain(cert_file, key_file)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, 0))
+        self.sock.listen(64)
+        self.host, self.port = self.sock.getsockname()
+        self.handshakes = 0
+        self.running = True
+        self.thread = threading.Thread(target = self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def address(self):
+        return '{}:{}'.format(self.host, self.port)
+
+    def serve(self):
+        while self.running:
+            try:
+                conn, addr = self.sock.accept()
+            except socket.error:
+                return
+            t = threading.Thread(target = self.handshake, args = (conn,))
+            t.daemon = True
+            t.start()
+
+    def handshake(self, conn):
+        try:
+            time.sleep(self.delay)
+            tls = self.context.wrap_socket(conn, server_side = True)
+            self.handshakes += 1
+            tls.close()
+        except (socket.error, ssl.SSLError):
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        self.running = False
+        self.sock.close()
@@ -0,0 +1,278 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# telemetry.py
+# publisher for the readings of the global device. Readings are batched
+# into compact, optionally zlib compressed messages and published with a
+# maximum rate. Messages that can not be published, e.g. during a network
+# outage, are kept in a bounded queue on disk and sent in order when the
+# device is connected again. The client is any object with a method
+# publish(topic, payload, qos), like AWSIoTMQTTClient or StandInBroker.
+
+import json
+import os
+import time
+import zlib
+from collections import deque
+
+DROP_POLICIES = ['oldest', 'newest']
+
+# topic suffix of compressed messages
+COMPRESSED_SUFFIX = '/z'
+
+
+def encode(header, readings, compress = False):
+    message = dict(header)
+    message['readings'] = readings
+    payload = json.dumps(message, separators = (',', ':')).encode('utf-8')
+    if compress:
+        payload = zlib.compress(payload, 6)
+    return payload
+
+
+def decode(topic, payload):
+    # returns the message of a payload that has been published on topic
+    if topic.endswith(COMPRESSED_SUFFIX):
+        payload = zlib.decompress(payload)
+    return json.loads(payload.decode('utf-8'))
+
+
+class MemoryQueue(object):
+    # bounded queue of (suffix, payload) in memory
+    def __init__(self, max_messages = 1000, drop = 'oldest'):
+        if drop not in DROP_POLICIES:
+            raise ValueError("unknown drop policy: {}".format(drop))
+        self.max_messages = max_messages
+        self.drop = drop
+        self.dropped = 0
+        self.items = deque()
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, suffix, payload):
+        # returns False if the message has been dropped
+        if len(self.items) >= self.max_messages:
+            self.dropped += 1
+            if self.drop == 'newest':
+                return False
+            self.pop()
+        self.items.append((suffix, payload))
+        return True
+
+    def peek(self):
+        return self.items[0] if self.items else None
+
+    def pop(self):
+        self.items.popleft()
+
+
+class DiskQueue(object):
+    # bounded queue with one file per message, the queue survives restarts
+    # of the device. Files are written to a temporary name and renamed, a
+    # crash leaves no partial message in the queue.
+    def __init__(self, directory, max_messages = 1000, max_bytes = 10 * 1024 * 1024, drop = 'oldest'):
+        if drop not in DROP_POLICIES:
+            raise ValueError("unknown drop policy: {}".format(drop))
+        self.directory = directory
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.drop = drop
+        self.dropped = 0
+        self.bytes = 0
+        self.files = deque()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.seq = 0
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+                continue
+            # other files in the directory are not messages
+            seq, _, kind = name.partition('.')
+            if not seq.isdigit() or kind not in ('json', 'z'):
+                continue
+            size = os.path.getsize(path)
+            self.files.append((name, size))
+            self.bytes += size
+            self.seq = int(seq) + 1
+
+    def __len__(self):
+        return len(self.files)
+
+    def full(self, size):
+        return len(self.files) >= self.max_messages or self.bytes + size > self.max_bytes
+
+    def put(self, suffix, payload):
+        while self.files and self.full(len(payload)):
+            self.dropped += 1
+            if self.drop == 'newest':
+                return False
+            self.pop()
+
+        # the suffix is kept in the file name: 0000000000000042.json, .z
+        name = '{:016d}.{}'.format(self.seq, 'z' if suffix == COMPRESSED_SUFFIX else 'json')
+        path = os.path.join(self.directory, name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(payload)
+        os.rename(path + '.tmp', path)
+        self.seq += 1
+        self.files.append((name, len(payload)))
+        self.bytes += len(payload)
+        return True
+
+    def peek(self):
+        if not self.files:
+            return None
+        name = self.files[0][0]
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            payload = f.read()
+        return (COMPRESSED_SUFFIX if name.endswith('.z') else ''), payload
+
+    def pop(self):
+        name, size = self.files.popleft()
+        os.remove(os.path.join(self.directory, name))
+        self.bytes -= size
+
+
+class Publisher(object):
+    def __init__(self, client, topic, header = None, batch_size = 10, max_rate = 5.0, compress = False,
+                 queue = None, qos = 0, clock = time.time):
+        self.client = client
+        self.topic = topic
+        self.header = header or {}
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+        self.compress = compress
+        self.queue = queue if queue is not None else MemoryQueue()
+        self.qos = qos
+        self.clock = clock
+
+        self.batch = []
+        # token bucket for the publish rate, one second of burst
+        self.tokens = max(1.0, max_rate)
+        self.refilled = clock()
+        # after a failed publish the queue is retried with backoff
+        self.retry_at = 0
+        self.backoff = 1.0
+
+        self.counters = {'readings': 0, 'messages': 0, 'bytes': 0, 'failed': 0}
+        self.last_stats = (clock(), 0, 0)
+
+    def add(self, reading):
+        self.batch.append(reading)
+        self.counters['readings'] += 1
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # encodes the current batch, it is published right away if nothing is
+        # queued, otherwise it is queued to keep the order
+        if not self.batch:
+            return
+        payload = encode(self.header, self.batch, self.compress)
+        suffix = COMPRESSED_SUFFIX if self.compress else ''
+        self.batch = []
+
+        if len(self.queue) == 0 and self.ready() and self.send(suffix, payload):
+            return
+        self.queue.put(suffix, payload)
+
+    def close(self):
+        # queues the readings of an incomplete batch, e.g. on shutdown. With a
+        # DiskQueue they are published after the next start.
+        if not self.batch:
+            return
+        payload = encode(self.header, self.batch, self.compress)
+        self.batch = []
+        self.queue.put(COMPRESSED_SUFFIX if self.compress else '', payload)
+
+    def ready(self):
+        now = self.clock()
+        if now < self.retry_at:
+            return False
+        self.tokens = min(max(1.0, self.max_rate), self.tokens + (now - self.refilled) * self.max_rate)
+        self.refilled = now
+        return self.tokens >= 1
+
+    def send(self, suffix, payload):
+        self.tokens -= 1
+        try:
+            ok = self.client.publish(self.topic + suffix, payload, self.qos)
+        except Exception:
+            ok = False
+        if ok is False:
+            self.counters['failed'] += 1
+            self.retry_at = self.clock() + self.backoff
+            self.backoff = min(self.backoff * 2, 60.0)
+            return False
+
+        self.backoff = 1.0
+        self.counters['messages'] += 1
+        self.counters['bytes'] += len(payload)
+        return True
+
+    def pump(self):
+        # publishes queued messages as far as the rate allows, returns the
+        # number of published messages
+        sent = 0
+        while len(self.queue) and self.ready():
+            suffix, payload = self.queue.peek()
+            if not self.send(suffix, payload):
+                break
+            self.queue.pop()
+            sent += 1
+        return sent
+
+    def stats(self):
+        # counters and rates since the previous call
+        now = self.clock()
+        last, messages, sent_bytes = self.last_stats
+        elapsed = max(now - last, 1e-9)
+        self.last_stats = (now, self.counters['messages'], self.counters['bytes'])
+
+        stats = dict(self.counters)
+        stats['messages_per_s'] = (self.counters['messages'] - messages) / elapsed
+        stats['bytes_per_s'] = (self.counters['bytes'] - sent_bytes) / elapsed
+        stats['queue_depth'] = len(self.queue)
+        stats['dropped'] = self.queue.dropped
+        return stats
+
+
+class StandInBroker(object):
+    # local stand-in for the MQTT connection, records the published
+    # messages. While offline publish raises like AWSIoTMQTTClient does
+    # with offline queueing disabled.
+    def __init__(self):
+        self.online = True
+        self.messages = []
+
+    def publish(self, topic, payload, qos):
+        if not self.online:
+            raise IOError("stand-in broker is offline")
+        self.messages.append((topic, payload))
+        return True
+
+    def readings(self):
+        readings = []
+        for topic, payload in self.messages:
+            readings.extend(decode(topic, payload)['readings'])
+        return readings
@@ -0,0 +1,107 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# answer_encoding.py
+# encodings of the provisioning answer, negotiated with the Accept header of
+# the request:
+#
+#   application/json (default)  the answer with PEM certificate and key
+#   application/cbor            CBOR map with DER certificate and key, without
+#                               the message of successful requests
+#
+# API Gateway compresses JSON answers for clients that send
+# Accept-Encoding: gzip. The Lambda function returns a CBOR answer base64
+# encoded in the envelope {"content-type": "application/cbor", "body": ...},
+# the integration response of API Gateway converts the body to binary. The
+# conversion applies to both encodings, the JSON template base64 encodes the
+# answer for it.
+
+import base64
+import re
+
+import cbor_encode
+
+JSON = 'application/json'
+CBOR = 'application/cbor'
+CONTENT_TYPES = [JSON, CBOR]
+
+# PEM fields of the answer and their DER fields in the compact answer
+DER_FIELDS = {'certificatePem': 'certificateDer', 'PrivateKey': 'privateKeyDer'}
+# keys of AWS IoT are PKCS#1 RSA keys, other labels are sent along
+DEFAULT_KEY_LABEL = 'RSA PRIVATE KEY'
+
+PEM_RE = re.compile(r'-----BEGIN ([A-Z0-9 ]+)-----(.*?)-----END \1-----', re.S)
+
+
+def accept_header(event):
+    headers = event.get('params', {}).get('header', {})
+    for name, value in headers.items():
+        if name.lower() == 'accept':
+            return value
+    return None
+
+
+def negotiate(accept):
+    # content type for an Accept header like "application/cbor, application/json;q=0.5"
+    best, best_q = JSON, 0.0
+    for media_range in (accept or '').split(','):
+        parts = [p.strip() for p in media_range.split(';')]
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if parts[0] in CONTENT_TYPES and q > best_q:
+            best, best_q = parts[0], q
+    return best
+
+
+def pem_to_der(pem):
+    # returns (label, der) of the first PEM block
+    match = PEM_RE.search(pem)
+    if match is None:
+        raise ValueError("no PEM block found")
+    return match.group(1), base64.b64decode(''.join(match.group(2).split()))
+
+
+def compact(answer):
+    result = {}
+    for name, value in answer.items():
+        if name in DER_FIELDS:
+            label, der = pem_to_der(value)
+            result[DER_FIELDS[name]] = bytearray(der)
+            if name == 'PrivateKey' and label != DEFAULT_KEY_LABEL:
+                result['privateKeyLabel'] = label
+        elif name == 'message' and answer.get('status') == 'success':
+            continue
+        elif name == 'distance':
+            result[name] = int(round(value))
+        elif name == 'results':
+            result[name] = [compact(r) for r in value]
+        else:
+            result[name] = value
+    return result
+
+
+def encode(answer, content_type):
+    if content_type == CBOR:
+        body = cbor_encode.dumps(compact(answer))
+        return {'content-type': CBOR, 'body': base64.b64encode(body).decode('ascii')}
+    return answer
@@ -0,0 +1,128 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# answer_store.py
+# answers of successful provisioning requests. A device that retries after a
+# timeout finds itself already provisioned; instead of an error it gets the
+# stored answer with a single read, no AWS IoT call is made. Answers are
+# keyed by a hash of the thing name and the CSR and expire after
+# ANSWER_TTL seconds. They are envelope encrypted with AWS KMS, bound to
+# their key. Without a KMS key, e.g. against DynamoDB Local, only answers
+# without private key are stored, in plain text.
+#
+# Answer table: request_key (hash key), thing_name, aws_region, cert_arn,
+# answer_enc, answer_nonce, answer_data_key (or answer), expires_at
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+import aws_clients
+from kms_envelope import Envelope
+
+logger = logging.getLogger()
+
+
+def request_key(thing_name, CSR = None):
+    # the signature is verified before the lookup and not part of the key,
+    # ECDSA signatures differ between retries
+    h = hashlib.sha256(thing_name.encode('utf-8'))
+    h.update(b'\n')
+    if CSR:
+        h.update(CSR.strip().encode('utf-8'))
+    return h.hexdigest()
+
+
+class AnswerStore(object):
+    def __init__(self, table_name, key_id = None, ttl = None):
+        self.table_name = table_name
+        self.envelope = Envelope(key_id, {'purpose': 'iot-global-provisioning-answers'}) if key_id else None
+        self.ttl = ttl if ttl is not None else int(os.environ.get('ANSWER_TTL', '3600'))
+
+    def put(self, thing_name, CSR, answer):
+        key = request_key(thing_name, CSR)
+        item = {
+            'request_key': {'S': key},
+            'thing_name': {'S': thing_name},
+            'aws_region': {'S': answer['region']},
+            'expires_at': {'N': str(int(time.time()) + self.ttl)}
+        }
+        if 'certificateArn' in answer:
+            item['cert_arn'] = {'S': answer['certificateArn']}
+
+        if self.envelope is not None:
+            encrypted = self.envelope.encrypt(json.dumps(answer), key.encode('ascii'))
+            item['answer_enc'] = {'B': encrypted['ciphertext']}
+            item['answer_nonce'] = {'B': encrypted['nonce']}
+            item['answer_data_key'] = {'B': encrypted['key']}
+        elif 'PrivateKey' in answer:
+            logger.warning("answer for %s has a private key and no KMS key is configured, not stored", thing_name)
+            return False
+        else:
+            item['answer'] = {'S': json.dumps(answer)}
+
+        aws_clients.dynamodb().put_item(TableName = self.table_name, Item = item)
+        return True
+
+    def get(self, thing_name, CSR = None):
+        key = request_key(thing_name, CSR)
+        response = aws_clients.dynamodb().get_item(
+            TableName = self.table_name,
+            Key = {'request_key': {'S': key}},
+            ConsistentRead = True
+        )
+        return self.answer(response.get('Item'))
+
+    def get_many(self, requests):
+        # answers for (thing_name, CSR) tuples with BatchGetItem, by thing name
+        keys = dict((request_key(thing_name, CSR), thing_name) for thing_name, CSR in requests)
+        answers = {}
+        key_list = [{'request_key': {'S': k}} for k in keys]
+
+        for i in range(0, len(key_list), 100):
+            request = {self.table_name: {'Keys': key_list[i:i + 100], 'ConsistentRead': True}}
+            retries = 0
+            while request:
+                response = aws_clients.dynamodb().batch_get_item(RequestItems = request)
+                for item in response['Responses'].get(self.table_name, []):
+                    answer = self.answer(item)
+                    if answer is not None:
+                        answers[keys[item['request_key']['S']]] = answer
+                request = response.get('UnprocessedKeys')
+                if request:
+                    retries += 1
+                    time.sleep(min(0.05 * 2 ** retries, 1))
+
+        return answers
+
+    def answer(self, item):
+        # DynamoDB removes expired items within days, not at once
+        if not item or int(item['expires_at']['N']) < time.time():
+            return None
+        if 'answer' in item:
+            return json.loads(item['answer']['S'])
+        if self.envelope is None:
+            logger.error("stored answer for %s is encrypted and no KMS key is configured", item['thing_name']['S'])
+            return None
+        return json.loads(self.envelope.decrypt({
+            'key': item['answer_data_key']['B'],
+            'nonce': item['answer_nonce']['B'],
+            'ciphertext': item['answer_enc']['B']
+        }, item['request_key']['S'].encode('ascii')))
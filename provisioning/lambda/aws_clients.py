@@ -0,0 +1,49 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# aws_clients.py
+# boto3 clients that are shared within a container. DYNAMODB_ENDPOINT_URL
+# and KMS_ENDPOINT_URL point the clients to local stand-ins like DynamoDB
+# Local.
+# Clients are created on first use.
+
+import os
+
+import boto3
+from botocore.config import Config
+
+client_config = Config(max_pool_connections = 10)
+clients = {}
+
+
+def dynamodb():
+    if 'dynamodb' not in clients:
+        clients['dynamodb'] = boto3.client(
+            'dynamodb',
+            endpoint_url = os.environ.get('DYNAMODB_ENDPOINT_URL') or None,
+            config = client_config
+        )
+    return clients['dynamodb']
+
+
+def kms():
+    if 'kms' not in clients:
+        clients['kms'] = boto3.client(
+            'kms',
+            endpoint_url = os.environ.get('KMS_ENDPOINT_URL') or None,
+            config = client_config
+        )
+    return clients['kms']
@@ -0,0 +1,79 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# cbor_encode.py
+# minimal CBOR (RFC 8949) encoder for the compact provisioning answer: maps,
+# arrays, text and byte strings, integers, floats, booleans and null.
+# Byte strings are passed as bytearray, so that they are told apart from
+# text on Python 2 as well. The device decodes with cbor_decode.py.
+
+import struct
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+
+def head(major, n):
+    if n < 24:
+        return struct.pack('>B', major << 5 | n)
+    if n < 0x100:
+        return struct.pack('>BB', major << 5 | 24, n)
+    if n < 0x10000:
+        return struct.pack('>BH', major << 5 | 25, n)
+    if n < 0x100000000:
+        return struct.pack('>BI', major << 5 | 26, n)
+    return struct.pack('>BQ', major << 5 | 27, n)
+
+
+def encode(obj, out):
+    if obj is None:
+        out.append(b'\xf6')
+    elif obj is True:
+        out.append(b'\xf5')
+    elif obj is False:
+        out.append(b'\xf4')
+    elif isinstance(obj, bytearray) or (bytes is not str and isinstance(obj, bytes)):
+        out.append(head(2, len(obj)))
+        out.append(bytes(obj))
+    elif isinstance(obj, (text_type, str)):
+        data = obj.encode('utf-8') if isinstance(obj, text_type) else obj
+        out.append(head(3, len(data)))
+        out.append(data)
+    elif isinstance(obj, float):
+        out.append(b'\xfb' + struct.pack('>d', obj))
+    elif isinstance(obj, (int, type(2 ** 64))):
+        out.append(head(0, obj) if obj >= 0 else head(1, -1 - obj))
+    elif isinstance(obj, (list, tuple)):
+        out.append(head(4, len(obj)))
+        for item in obj:
+            encode(item, out)
+    elif isinstance(obj, dict):
+        out.append(head(5, len(obj)))
+        for key, value in obj.items():
+            encode(key, out)
+            encode(value, out)
+    else:
+        raise TypeError("can not encode {} as CBOR".format(type(obj).__name__))
+
+
+def dumps(obj):
+    out = []
+    encode(obj, out)
+    return b''.join(out)
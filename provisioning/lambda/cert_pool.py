@@ -0,0 +1,205 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# cert_pool.py
+# certificates that are issued ahead of time per region, with the IoT policy
+# already attached. Devices without a CSR get a certificate from the pool,
+# so that create_keys_and_certificate is not on the request path. The private
+# keys are stored envelope encrypted. A scheduled job refills the pool of
+# every region up to the high water mark once it drops below the low water
+# mark.
+#
+# Pool table: aws_region (hash key), cert_id (range key), cert_arn, cert_pem,
+# key_enc, key_nonce, key_data_key, key_bound, issued_at
+#
+# The data key is shared by the certificates of a refill run, region and
+# cert_id are the associated data of the AES-GCM encryption of every key, so
+# a key that is moved to another item does not decrypt. Items issued before
+# key_bound was introduced are decrypted without associated data.
+
+import logging
+import os
+import random
+import time
+
+from botocore.exceptions import ClientError
+from cryptography.exceptions import InvalidTag
+
+import aws_clients
+from kms_envelope import Envelope
+
+logger = logging.getLogger()
+
+
+def key_binding(region, cert_id):
+    return '{}#{}'.format(region, cert_id).encode('ascii')
+
+
+class CertPool(object):
+    def __init__(self, table_name, key_id, policy_name):
+        self.table_name = table_name
+        self.policy_name = policy_name
+        self.envelope = Envelope(key_id, {'purpose': 'iot-global-provisioning-cert-pool'})
+        self.low_water = int(os.environ.get('CERT_POOL_LOW_WATER', '20'))
+        self.high_water = int(os.environ.get('CERT_POOL_HIGH_WATER', '100'))
+        self.claim_pages = int(os.environ.get('CERT_POOL_CLAIM_PAGES', '5'))
+
+    def claim(self, region, c_iot = None):
+        # takes a certificate out of the pool with a conditional delete, a
+        # certificate that another request has taken in the meantime is
+        # skipped. Concurrent requests read the same first page, when all of
+        # its certificates are taken the next page is tried.
+        kwargs = {
+            'TableName': self.table_name,
+            'KeyConditionExpression': "aws_region = :r",
+            'ExpressionAttributeValues': {":r": {"S": region}},
+            'Limit': 10
+        }
+        for page in range(self.claim_pages):
+            response = aws_clients.dynamodb().query(**kwargs)
+            items = response['Items']
+            # concurrent requests start with different certificates
+            random.shuffle(items)
+
+            for item in items:
+                claimed = self.take(item, c_iot)
+                if claimed is not None:
+                    logger.info("claimed pooled certificate %s in %s", claimed['certificateId'], region)
+                    return claimed
+
+            if 'LastEvaluatedKey' not in response:
+                logger.warning("certificate pool for %s is empty", region)
+                return None
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        logger.warning("no certificate of the pool for %s could be claimed in %s pages", region, self.claim_pages)
+        return None
+
+    def take(self, item, c_iot = None):
+        try:
+            response = aws_clients.dynamodb().delete_item(
+                TableName = self.table_name,
+                Key = {"aws_region": item['aws_region'], "cert_id": item['cert_id']},
+                ConditionExpression = "attribute_exists(cert_id)",
+                ReturnValues = "ALL_OLD"
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return None
+            raise
+
+        item = response['Attributes']
+        associated_data = None
+        if item.get('key_bound', {}).get('BOOL'):
+            associated_data = key_binding(item['aws_region']['S'], item['cert_id']['S'])
+        try:
+            private_key = self.envelope.decrypt({
+                'key': item['key_data_key']['B'],
+                'nonce': item['key_nonce']['B'],
+                'ciphertext': item['key_enc']['B']
+            }, associated_data)
+        except InvalidTag:
+            # the key does not belong to this item, the certificate must not
+            # be handed out
+            logger.error("key of pooled certificate %s does not decrypt", item['cert_id']['S'])
+            self.deactivate(c_iot, item)
+            raise
+        except Exception:
+            # e.g. KMS failed, the certificate goes back into the pool
+            self.put_back(c_iot, item)
+            raise
+
+        return {
+            'certificateArn': item['cert_arn']['S'],
+            'certificateId': item['cert_id']['S'],
+            'certificatePem': item['cert_pem']['S'],
+            'keyPair': {'PrivateKey': private_key},
+            'pooled': True
+        }
+
+    def put_back(self, c_iot, item):
+        try:
+            aws_clients.dynamodb().put_item(
+                TableName = self.table_name,
+                Item = item,
+                ConditionExpression = "attribute_not_exists(cert_id)"
+            )
+        except Exception as e:
+            logger.error("returning certificate %s to the pool failed: %s", item['cert_id']['S'], e)
+            self.deactivate(c_iot, item)
+
+    def deactivate(self, c_iot, item):
+        # a certificate that is out of the pool and not handed out is
+        # deactivated instead of staying active with the policy attached
+        if c_iot is None:
+            logger.error("certificate %s is not in the pool anymore, deactivate it", item['cert_id']['S'])
+            return
+        try:
+            c_iot.update_certificate(certificateId = item['cert_id']['S'], newStatus = 'INACTIVE')
+            logger.warning("deactivated pooled certificate %s", item['cert_id']['S'])
+        except Exception as e:
+            logger.error("deactivating certificate %s failed: %s", item['cert_id']['S'], e)
+
+    def depth(self, region):
+        count = 0
+        kwargs = {
+            'TableName': self.table_name,
+            'KeyConditionExpression': "aws_region = :r",
+            'ExpressionAttributeValues': {":r": {"S": region}},
+            'Select': 'COUNT'
+        }
+        while True:
+            response = aws_clients.dynamodb().query(**kwargs)
+            count += response['Count']
+            if 'LastEvaluatedKey' not in response:
+                return count
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def issue(self, c_iot, region):
+        response = c_iot.create_keys_and_certificate(setAsActive = True)
+        c_iot.attach_policy(policyName = self.policy_name, target = response['certificateArn'])
+        encrypted = self.envelope.encrypt(response['keyPair']['PrivateKey'],
+                                          key_binding(region, response['certificateId']))
+
+        aws_clients.dynamodb().put_item(
+            TableName = self.table_name,
+            Item = {
+                'aws_region': {'S': region},
+                'cert_id': {'S': response['certificateId']},
+                'cert_arn': {'S': response['certificateArn']},
+                'cert_pem': {'S': response['certificatePem']},
+                'key_enc': {'B': encrypted['ciphertext']},
+                'key_nonce': {'B': encrypted['nonce']},
+                'key_data_key': {'B': encrypted['key']},
+                'key_bound': {'BOOL': True},
+                'issued_at': {'N': str(int(time.time()))}
+            }
+        )
+
+    def refill(self, c_iot, region):
+        # returns (depth before, number of issued certificates)
+        depth = self.depth(region)
+        if depth >= self.low_water:
+            return depth, 0
+
+        # a fresh data key for every refill run
+        self.envelope.new_data_key()
+        issued = 0
+        for i in range(self.high_water - depth):
+            self.issue(c_iot, region)
+            issued += 1
+        logger.info("issued %s certificates for %s, depth was %s", issued, region, depth)
+        return depth, issued
@@ -0,0 +1,154 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# geo_cache.py
+# caches geolocation results by IP address and by network prefix. Devices
+# behind the same NAT or in the same factory network share one lookup. An
+# optional DynamoDB table shares the results between Lambda containers.
+# The cache or backend that answered a lookup is counted in the request metrics:
+# geo_cache_hits, geo_cache_shared_hits or geo_cache_misses.
+
+import logging
+import os
+import time
+
+import aws_clients
+from geolocation import ip_to_int
+from ttl_cache import TTLCache
+
+logger = logging.getLogger()
+
+
+def cache_keys(ip, prefix_v4, prefix_v6):
+    version, value = ip_to_int(ip)
+    if version == 4:
+        prefix = 'v4/{}:{:x}'.format(prefix_v4, value >> (32 - prefix_v4))
+    else:
+        prefix = 'v6/{}:{:x}'.format(prefix_v6, value >> (128 - prefix_v6))
+    return 'ip:' + ip, prefix
+
+
+class DynamoDBGeoCache(object):
+    def __init__(self, table_name, ttl):
+        self.table_name = table_name
+        self.ttl = ttl
+
+    def get(self, key):
+        response = aws_clients.dynamodb().get_item(
+            TableName = self.table_name,
+            Key = {'cache_key': {'S': key}}
+        )
+        item = response.get('Item')
+        # expired items are removed by DynamoDB TTL with some delay
+        if item is None or int(item['expires_at']['N']) <= time.time():
+            return None
+        return {
+            'latitude': float(item['latitude']['N']),
+            'longitude': float(item['longitude']['N']),
+            'country_code': item['country_code']['S'] if 'country_code' in item else None
+        }
+
+    def put(self, key, location):
+        item = {
+            'cache_key': {'S': key},
+            'latitude': {'N': repr(location['latitude'])},
+            'longitude': {'N': repr(location['longitude'])},
+            'expires_at': {'N': str(int(time.time() + self.ttl))}
+        }
+        if location.get('country_code'):
+            item['country_code'] = {'S': location['country_code']}
+        aws_clients.dynamodb().put_item(TableName = self.table_name, Item = item)
+
+
+class CachingGeolocator(object):
+    def __init__(self, geolocator, maxsize = None, ttl = None, prefix_v4 = None, prefix_v6 = None,
+                 shared_table = None, metrics = None):
+        if maxsize is None:
+            maxsize = int(os.environ.get('GEO_CACHE_SIZE', '10000'))
+        if ttl is None:
+            ttl = int(os.environ.get('GEO_CACHE_TTL', '86400'))
+        if prefix_v4 is None:
+            prefix_v4 = int(os.environ.get('GEO_CACHE_PREFIX_V4', '24'))
+        if prefix_v6 is None:
+            prefix_v6 = int(os.environ.get('GEO_CACHE_PREFIX_V6', '48'))
+        if shared_table is None:
+            shared_table = os.environ.get('GEO_CACHE_TABLE')
+
+        self.geolocator = geolocator
+        self.cache = TTLCache(maxsize, ttl)
+        self.prefix_v4 = prefix_v4
+        self.prefix_v6 = prefix_v6
+        self.shared = DynamoDBGeoCache(shared_table, ttl) if shared_table else None
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.metrics = metrics
+
+    def lookup(self, ip):
+        ip_key, prefix_key = cache_keys(ip, self.prefix_v4, self.prefix_v6)
+
+        source = 'geo_cache_hits'
+        result = self.cache.get_any((ip_key, prefix_key))
+        if result is None:
+            source = 'geo_cache_shared_hits'
+            result = self.lookup_shared(prefix_key)
+        if result is None:
+            source = 'geo_cache_misses'
+            result = self.geolocator.lookup(ip)
+            # unknown locations are not cached, the backend might have failed
+            if result['latitude'] is not None and result['longitude'] is not None:
+                self.store_shared(prefix_key, result)
+            else:
+                self.log_stats(source)
+                return result
+
+        self.cache.put(ip_key, result)
+        self.cache.put(prefix_key, result)
+        self.log_stats(source)
+        return result
+
+    def lookup_shared(self, key):
+        if self.shared is None:
+            return None
+        try:
+            result = self.shared.get(key)
+        except Exception as e:
+            logger.error("shared geo cache lookup failed for %s: %s", key, e)
+            return None
+        if result is None:
+            self.shared_misses += 1
+        else:
+            self.shared_hits += 1
+        return result
+
+    def store_shared(self, key, location):
+        if self.shared is None:
+            return
+        try:
+            self.shared.put(key, location)
+        except Exception as e:
+            logger.error("storing %s in shared geo cache failed: %s", key, e)
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats['shared_hits'] = self.shared_hits
+        stats['shared_misses'] = self.shared_misses
+        return stats
+
+    def log_stats(self, source):
+        if self.metrics is not None:
+            self.metrics.count(source)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("geo cache stats: %s", self.stats())
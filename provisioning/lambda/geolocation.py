@@ -0,0 +1,189 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# geolocation.py
+# resolves the location of an IP address. The default backend looks the address
+# up in a range table that is packaged with the Lambda, ipstack.com can be used
+# as fallback.
+#
+# Range table file layout (little endian):
+#   header:      magic 'GEOR', version (H), reserved (H), ipv4 count (I), ipv6 count (I)
+#   ipv4 ranges: start (I), end (I), lat (f), lon (f), country code (2s)
+#   ipv6 ranges: start high/low (QQ), end high/low (QQ), lat (f), lon (f), country code (2s)
+# Both sections are sorted by start address and ranges do not overlap.
+
+import json
+import logging
+import mmap
+import os
+import socket
+import struct
+
+logger = logging.getLogger()
+
+TABLE_MAGIC = b'GEOR'
+TABLE_VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+IPV4_RECORD = struct.Struct('<IIff2s')
+IPV6_RECORD = struct.Struct('<QQQQff2s')
+
+ipstack_api_url = 'http://api.ipstack.com/'
+ipstack_timeout = float(os.environ.get('IPSTACK_TIMEOUT', '3'))
+
+default_table_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'geo-ranges.bin')
+
+
+def ip_to_int(ip):
+    # returns (version, integer) for an IPv4 or IPv6 address, IPv4 mapped
+    # IPv6 addresses are treated as IPv4
+    if ':' in ip:
+        packed = socket.inet_pton(socket.AF_INET6, ip)
+        if packed[:12] == b'\x00' * 10 + b'\xff\xff':
+            return 4, struct.unpack('>I', packed[12:])[0]
+        hi, lo = struct.unpack('>QQ', packed)
+        return 6, (hi << 64) | lo
+    return 4, struct.unpack('>I', socket.inet_aton(ip))[0]
+
+
+def location(lat, lon, country_code):
+    return {'latitude': lat, 'longitude': lon, 'country_code': country_code}
+
+
+class RangeTableBackend(object):
+    name = 'table'
+
+    def __init__(self, table_file):
+        self.table_file = table_file
+        self.table = None
+        self.ipv4_count = 0
+        self.ipv6_count = 0
+        self.ipv6_offset = 0
+
+    def available(self):
+        return os.path.isfile(self.table_file)
+
+    def load(self):
+        # mapped on first use, the pages are shared with the OS page cache
+        with open(self.table_file, 'rb') as f:
+            table = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        magic, version, _, ipv4_count, ipv6_count = HEADER.unpack_from(table, 0)
+        if magic != TABLE_MAGIC or version != TABLE_VERSION:
+            raise ValueError("{} is not a version {} range table".format(self.table_file, TABLE_VERSION))
+
+        self.ipv4_count = ipv4_count
+        self.ipv6_count = ipv6_count
+        self.ipv6_offset = HEADER.size + ipv4_count * IPV4_RECORD.size
+        self.table = table
+        logger.info("loaded range table %s: ipv4 ranges: %s, ipv6 ranges: %s",
+                    self.table_file, ipv4_count, ipv6_count)
+
+    def find(self, record, offset, count, value, start_of):
+        # binary search for the last range starting at or before value
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if start_of(record.unpack_from(self.table, offset + mid * record.size)) <= value:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        return record.unpack_from(self.table, offset + (lo - 1) * record.size)
+
+    def lookup(self, ip):
+        if self.table is None:
+            self.load()
+
+        version, value = ip_to_int(ip)
+
+        if version == 4:
+            r = self.find(IPV4_RECORD, HEADER.size, self.ipv4_count, value, lambda r: r[0])
+            if r is None or value > r[1]:
+                return None
+            lat, lon, country_code = r[2], r[3], r[4]
+        else:
+            r = self.find(IPV6_RECORD, self.ipv6_offset, self.ipv6_count, value,
+                          lambda r: (r[0] << 64) | r[1])
+            if r is None or value > ((r[2] << 64) | r[3]):
+                return None
+            lat, lon, country_code = r[4], r[5], r[6]
+
+        return location(lat, lon, country_code.decode('ascii').strip('\x00') or None)
+
+
+class IpstackBackend(object):
+    name = 'ipstack'
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def available(self):
+        return bool(self.api_key)
+
+    def lookup(self, ip):
+        import requests
+
+        request_url = ipstack_api_url + ip + '?access_key=' + self.api_key
+        r = requests.get(request_url, timeout = ipstack_timeout)
+        j = json.loads(r.text)
+        logger.debug("j: %s", j)
+        if j.get('latitude') is None or j.get('longitude') is None:
+            return None
+        return location(j['latitude'], j['longitude'], j.get('country_code'))
+
+
+def create_backends(names = None):
+    # GEO_BACKENDS is an ordered, comma separated list, later backends are
+    # used when earlier ones do not know the address
+    if names is None:
+        names = os.environ.get('GEO_BACKENDS', 'table,ipstack')
+
+    backends = []
+    for name in [n.strip() for n in names.split(',') if n.strip()]:
+        if name == RangeTableBackend.name:
+            backend = RangeTableBackend(os.environ.get('GEO_TABLE_FILE', default_table_file))
+        elif name == IpstackBackend.name:
+            backend = IpstackBackend(os.environ.get('IPSTACK_API_KEY'))
+        else:
+            raise ValueError("unknown geolocation backend: {}".format(name))
+
+        if backend.available():
+            backends.append(backend)
+        else:
+            logger.warning("geolocation backend %s is not available", name)
+
+    return backends
+
+
+class Geolocator(object):
+    def __init__(self, backends = None):
+        self.backends = backends
+
+    def lookup(self, ip):
+        if self.backends is None:
+            self.backends = create_backends()
+
+        for backend in self.backends:
+            try:
+                result = backend.lookup(ip)
+            except Exception as e:
+                logger.error("geolocation backend %s failed for IP %s: %s", backend.name, ip, e)
+                continue
+            if result is not None:
+                logger.debug("backend %s located IP %s: %s", backend.name, ip, result)
+                return result
+
+        return location(None, None, None)
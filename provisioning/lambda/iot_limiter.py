@@ -0,0 +1,281 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# iot_limiter.py
+# client side rate limiting for the AWS IoT control plane APIs, which are
+# limited per account and region. Every call passes a token bucket per
+# region and API. Throttled calls are retried with exponential backoff and
+# full jitter and halve the rate of their bucket, the rate grows back over
+# time. Optionally the calls per region, API and second are
+# counted in a DynamoDB table so that all Lambda containers share the limit.
+
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectionError
+
+import aws_clients
+
+logger = logging.getLogger()
+
+# requests per second per account and region, see the AWS IoT Core
+# service quotas. IOT_API_LIMITS overrides single APIs.
+DEFAULT_LIMITS = {
+    'AttachPolicy': 15,
+    'AttachThingPrincipal': 100,
+    'CreateCertificateFromCsr': 15,
+    'CreateKeysAndCertificate': 10,
+    'CreatePolicy': 10,
+    'CreatePolicyVersion': 10,
+    'CreateThing': 100,
+    'DeleteCertificate': 10,
+    'DeletePolicyVersion': 10,
+    'DeleteThing': 100,
+    'DescribeEndpoint': 10,
+    'DetachPolicy': 15,
+    'DetachThingPrincipal': 100,
+    'GetPolicy': 15,
+    'ListPolicyVersions': 10,
+    'UpdateCertificate': 10
+}
+DEFAULT_LIMIT = 10
+
+THROTTLING_CODES = set(['ThrottlingException', 'TooManyRequestsException', 'RequestLimitExceeded'])
+TRANSIENT_CODES = set(['ServiceUnavailableException', 'InternalFailureException', 'InternalException'])
+
+
+class LimiterTimeout(Exception):
+    pass
+
+
+def throttled(e):
+    # the call was not made or rejected for its rate, not for its content
+    if isinstance(e, LimiterTimeout):
+        return True
+    return isinstance(e, ClientError) and e.response['Error']['Code'] in THROTTLING_CODES
+
+
+def parse_limits(value):
+    # "CreateThing=50,AttachPolicy=10"
+    limits = {}
+    for part in (value or '').split(','):
+        if part.strip():
+            api, tps = part.split('=')
+            limits[api.strip()] = float(tps)
+    return limits
+
+
+def api_name(client, method):
+    mapping = getattr(getattr(client, 'meta', None), 'method_to_api_mapping', None)
+    if mapping and method in mapping:
+        return mapping[method]
+    return re.sub(r'(^|_)([a-z])', lambda m: m.group(2).upper(), method)
+
+
+class TokenBucket(object):
+    # the rate is halved on throttling, at most once per second since
+    # concurrent calls are throttled together, and grows back to the limit
+    # within recovery seconds
+    def __init__(self, rate, clock = time.time, recovery = 20.0):
+        self.max_rate = float(rate)
+        self.min_rate = min(1.0, self.max_rate)
+        self.rate = self.max_rate
+        self.burst = max(1.0, self.max_rate)
+        self.tokens = self.burst
+        self.recovery = recovery
+        self.clock = clock
+        self.updated = clock()
+        self.decreased = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # takes a token, returns the seconds to wait for it
+        with self.lock:
+            now = self.clock()
+            elapsed = max(0, now - self.updated)
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.rate = min(self.max_rate, self.rate + elapsed * self.max_rate / self.recovery)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def release(self):
+        with self.lock:
+            self.tokens += 1
+
+    def throttled(self):
+        with self.lock:
+            now = self.clock()
+            # the service is above its limit, the burst is gone
+            self.tokens = min(self.tokens, 0)
+            if now - self.decreased >= 1:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.decreased = now
+
+
+class DynamoDBBudget(object):
+    # calls per region, API and second of all containers. A call is allowed
+    # if the counter of the current second is below the limit, items expire
+    # with DynamoDB TTL.
+    def __init__(self, table_name, clock = time.time, sleep = time.sleep):
+        self.table_name = table_name
+        self.clock = clock
+        self.sleep = sleep
+        self.exhausted = 0
+
+    def acquire(self, region, api, limit, deadline):
+        while True:
+            second = int(self.clock())
+            try:
+                aws_clients.dynamodb().update_item(
+                    TableName = self.table_name,
+                    Key = {'counter_key': {'S': '{}#{}#{}'.format(region, api, second)}},
+                    UpdateExpression = 'ADD calls :one SET expires_at = :expires',
+                    ConditionExpression = 'attribute_not_exists(calls) OR calls < :limit',
+                    ExpressionAttributeValues = {
+                        ':one': {'N': '1'},
+                        ':limit': {'N': str(int(limit))},
+                        ':expires': {'N': str(second + 300)}
+                    }
+                )
+                return
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+            self.exhausted += 1
+            if self.clock() >= deadline:
+                raise LimiterTimeout("shared limit of {} in {} exhausted".format(api, region))
+            self.sleep(max(0, second + 1 - self.clock()) + random.uniform(0, 0.05))
+
+
+class IotLimiter(object):
+    def __init__(self, limits = None, share = 1.0, max_attempts = 6, base_delay = 0.05, max_delay = 2.0,
+                 max_wait = 10.0, budget = None, clock = time.time, sleep = time.sleep):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        # share of the account limit for this container, 1.0 with a budget
+        self.share = share
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self.budget = budget
+        self.clock = clock
+        self.sleep = sleep
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def bucket(self, region, api):
+        key = (region, api)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            with self.lock:
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(self.limits.get(api, DEFAULT_LIMIT) * self.share, self.clock)
+                    self.buckets[key] = bucket
+        return bucket
+
+    def count(self, api, name, n = 1):
+        with self.lock:
+            counters = self.counters.setdefault(api, {'calls': 0, 'throttled': 0, 'retries': 0, 'waited_ms': 0})
+            counters[name] += n
+
+    def acquire(self, region, api, bucket):
+        wait = bucket.reserve()
+        if wait > self.max_wait:
+            bucket.release()
+            raise LimiterTimeout("rate limit of {} in {} exceeded".format(api, region))
+        if wait > 0:
+            self.count(api, 'waited_ms', int(wait * 1000))
+            self.sleep(wait)
+        if self.budget is not None:
+            self.budget.acquire(region, api, self.limits.get(api, DEFAULT_LIMIT), self.clock() + self.max_wait)
+
+    def call(self, region, api, func, *args, **kwargs):
+        bucket = self.bucket(region, api)
+        for attempt in range(self.max_attempts):
+            self.acquire(region, api, bucket)
+            try:
+                result = func(*args, **kwargs)
+            except ClientError as e:
+                code = e.response['Error']['Code']
+                if code in THROTTLING_CODES:
+                    self.count(api, 'throttled')
+                    bucket.throttled()
+                elif code not in TRANSIENT_CODES:
+                    raise
+                if attempt + 1 == self.max_attempts:
+                    raise
+            except ConnectionError:
+                if attempt + 1 == self.max_attempts:
+                    raise
+            else:
+                self.count(api, 'calls')
+                return result
+
+            self.count(api, 'retries')
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            logger.info("%s in %s failed, retrying in %.0f ms", api, region, delay * 1000)
+            self.sleep(delay)
+
+    def stats(self):
+        with self.lock:
+            stats = dict((api, dict(c)) for api, c in self.counters.items())
+        for (region, api), bucket in self.buckets.items():
+            if api in stats:
+                stats[api].setdefault('rate', {})[region] = round(bucket.rate, 2)
+        return stats
+
+
+class LimitedClient(object):
+    # wraps a boto3 client of a region, API calls pass the limiter
+    passthrough = set(['meta', 'exceptions', 'can_paginate', 'get_paginator', 'get_waiter', 'close'])
+
+    def __init__(self, client, region, limiter):
+        self.client = client
+        self.region = region
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name.startswith('_') or name in self.passthrough or not callable(attr):
+            return attr
+        api = api_name(self.client, name)
+
+        def call(*args, **kwargs):
+            return self.limiter.call(self.region, api, attr, *args, **kwargs)
+        return call
+
+
+def create_limiter():
+    budget = None
+    if os.environ.get('IOT_LIMITER_TABLE'):
+        budget = DynamoDBBudget(os.environ['IOT_LIMITER_TABLE'])
+    return IotLimiter(
+        limits = parse_limits(os.environ.get('IOT_API_LIMITS')),
+        share = float(os.environ.get('IOT_LIMIT_SHARE', '1.0')),
+        max_attempts = int(os.environ.get('IOT_MAX_ATTEMPTS', '6')),
+        max_wait = float(os.environ.get('IOT_LIMITER_MAX_WAIT', '10')),
+        budget = budget
+    )
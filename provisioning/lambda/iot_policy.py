@@ -0,0 +1,93 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# iot_policy.py
+# the AWS IoT policy that is attached to the certificates of the devices.
+# Used by the Lambda function and by tools/bootstrap-regions.py, which
+# creates or updates the policy in all regions at deploy time.
+
+import json
+import logging
+
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+account_ids = {}
+
+
+def get_account_id():
+    # resolved once per container or tool run
+    if 'account' not in account_ids:
+        response = boto3.client('sts').get_caller_identity()
+        account_ids['account'] = response['Account']
+    return account_ids['account']
+
+
+def policy_document(region, account_id):
+    arn = 'arn:aws:iot:{}:{}:'.format(region, account_id)
+    return {
+        "Version": "2012-10-17",
+        "Statement": [{
+            "Effect": "Allow",
+            "Action": ["iot:Connect"],
+            "Resource": [arn + "client/${iot:ClientId}"]
+        },
+        {
+            "Effect": "Allow",
+            "Action": ["iot:Publish"],
+            "Resource": [arn + "topic/data/${iot:ClientId}/*"]
+        }]
+    }
+
+
+def ensure_policy(c_iot, policy_name, region, account_id = None, update = False):
+    # creates the policy if it does not exist. With update a policy that
+    # differs from policy_document() gets a new default version.
+    # Returns 'exists', 'created' or 'updated'.
+    try:
+        response = c_iot.get_policy(policyName = policy_name)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ResourceNotFoundException':
+            raise
+        response = None
+
+    if response is not None and not update:
+        return 'exists'
+
+    document = policy_document(region, account_id or get_account_id())
+
+    if response is None:
+        logger.info("creating iot policy %s in %s", policy_name, region)
+        c_iot.create_policy(policyName = policy_name, policyDocument = json.dumps(document))
+        return 'created'
+
+    if json.loads(response['policyDocument']) == document:
+        return 'exists'
+
+    # a policy has at most five versions, the oldest one that is not the
+    # default version is deleted to make room
+    versions = c_iot.list_policy_versions(policyName = policy_name)['policyVersions']
+    if len(versions) >= 5:
+        oldest = min((v for v in versions if not v['isDefaultVersion']), key = lambda v: v['createDate'])
+        c_iot.delete_policy_version(policyName = policy_name, policyVersionId = oldest['versionId'])
+
+    logger.info("updating iot policy %s in %s", policy_name, region)
+    c_iot.create_policy_version(policyName = policy_name, policyDocument = json.dumps(document), setAsDefault = True)
+    return 'updated'
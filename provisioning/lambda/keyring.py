@@ -0,0 +1,141 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# keyring.py
+# public keys to verify the thing name signature of a provisioning request.
+# A device uses its own key if the attribute pub_key (PEM) is set in its item
+# of the provisioning table, otherwise the global provisioning key. Parsed
+# keys are cached so that hot devices neither read DynamoDB nor parse PEM.
+# Per device keys are off by default (DEVICE_KEYS), then the item is not read
+# and all devices use the global key.
+#
+# Signatures: RSA PKCS#1 v1.5 with SHA-256, ECDSA with SHA-256 (P-256) or
+# SHA-384 (P-384 and larger curves), Ed25519.
+
+import base64
+import logging
+import os
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+
+import aws_clients
+from ttl_cache import TTLCache
+
+logger = logging.getLogger()
+
+
+def ecdsa_hash(curve):
+    return hashes.SHA256() if curve.key_size <= 256 else hashes.SHA384()
+
+
+class Verifier(object):
+    def __init__(self, pub_key_pem):
+        if not isinstance(pub_key_pem, bytes):
+            pub_key_pem = pub_key_pem.encode('ascii')
+        self.key = load_pem_public_key(pub_key_pem)
+
+        if isinstance(self.key, rsa.RSAPublicKey):
+            self.key_type = 'rsa'
+        elif isinstance(self.key, ec.EllipticCurvePublicKey):
+            self.key_type = 'ecdsa-' + self.key.curve.name
+        elif isinstance(self.key, ed25519.Ed25519PublicKey):
+            self.key_type = 'ed25519'
+        else:
+            raise ValueError("unsupported key type: {}".format(type(self.key).__name__))
+
+    def verify(self, message, sig):
+        if not isinstance(message, bytes):
+            message = message.encode('utf-8')
+
+        try:
+            if self.key_type == 'rsa':
+                self.key.verify(sig, message, padding.PKCS1v15(), hashes.SHA256())
+            elif self.key_type == 'ed25519':
+                self.key.verify(sig, message)
+            else:
+                self.key.verify(sig, message, ec.ECDSA(ecdsa_hash(self.key.curve)))
+            return True
+        except InvalidSignature:
+            return False
+
+
+class Keyring(object):
+    def __init__(self, default_key_file, table_name, maxsize = None, ttl = None, device_keys = None):
+        if maxsize is None:
+            maxsize = int(os.environ.get('KEYRING_CACHE_SIZE', '10000'))
+        if ttl is None:
+            ttl = int(os.environ.get('KEYRING_CACHE_TTL', '300'))
+        if device_keys is None:
+            device_keys = os.environ.get('DEVICE_KEYS', 'false').lower() == 'true'
+
+        self.default_key_file = default_key_file
+        self.table_name = table_name
+        self.device_keys = device_keys
+        self.default = None
+        self.cache = TTLCache(maxsize, ttl)
+
+    def default_verifier(self):
+        if self.default is None:
+            with open(self.default_key_file, 'rb') as f:
+                self.default = Verifier(f.read())
+            logger.info("loaded %s key from %s", self.default.key_type, self.default_key_file)
+        return self.default
+
+    def device_key(self, thing_name):
+        response = aws_clients.dynamodb().get_item(
+            TableName = self.table_name,
+            Key = {"thing_name": {"S": thing_name}},
+            ProjectionExpression = "pub_key"
+        )
+        item = response.get('Item', {})
+        if 'pub_key' in item:
+            return item['pub_key']['S']
+        return None
+
+    def verifier(self, thing_name):
+        if not self.device_keys:
+            return self.default_verifier()
+
+        verifier = self.cache.get(thing_name)
+        if verifier is None:
+            pub_key_pem = self.device_key(thing_name)
+            if pub_key_pem:
+                verifier = Verifier(pub_key_pem)
+                logger.info("loaded %s key for %s", verifier.key_type, thing_name)
+            else:
+                verifier = self.default_verifier()
+            self.cache.put(thing_name, verifier)
+        return verifier
+
+    def verify(self, thing_name, sig):
+        # sig is base64 encoded
+        verifier = self.verifier(thing_name)
+        return verifier.verify(thing_name, base64.b64decode(sig))
+
+    def prime(self, thing_name, pub_key_pem):
+        # caches a key that has been read together with other attributes
+        if not self.device_keys:
+            return
+        if pub_key_pem:
+            self.cache.put(thing_name, Verifier(pub_key_pem))
+        else:
+            self.cache.put(thing_name, self.default_verifier())
+
+    def invalidate(self, thing_name):
+        self.cache.invalidate(thing_name)
@@ -0,0 +1,71 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# kms_envelope.py
+# envelope encryption for secrets that are stored in DynamoDB. Secrets are
+# encrypted with AES-GCM under a data key from AWS KMS, the encrypted data
+# key is stored next to the ciphertext. Decrypted data keys are cached so
+# that secrets encrypted with the same data key need only one KMS call.
+# Associated data, e.g. the key of the item, binds a ciphertext to its item.
+
+import logging
+import os
+
+import aws_clients
+from ttl_cache import TTLCache
+
+logger = logging.getLogger()
+
+
+class Envelope(object):
+    def __init__(self, key_id, context):
+        # the encryption context binds the ciphertext to its purpose
+        self.key_id = key_id
+        self.context = context
+        self.data_key = None
+        self.data_keys = TTLCache(100, int(os.environ.get('DATA_KEY_CACHE_TTL', '3600')))
+
+    def new_data_key(self):
+        response = aws_clients.kms().generate_data_key(
+            KeyId = self.key_id,
+            KeySpec = 'AES_256',
+            EncryptionContext = self.context
+        )
+        self.data_key = (response['Plaintext'], response['CiphertextBlob'])
+
+    def encrypt(self, plaintext, associated_data = None):
+        if self.data_key is None:
+            self.new_data_key()
+        key, encrypted_key = self.data_key
+        nonce = os.urandom(12)
+        if not isinstance(plaintext, bytes):
+            plaintext = plaintext.encode('utf-8')
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        ciphertext = AESGCM(key).encrypt(nonce, plaintext, associated_data)
+        return {'key': encrypted_key, 'nonce': nonce, 'ciphertext': ciphertext}
+
+    def decrypt(self, record, associated_data = None):
+        encrypted_key = bytes(record['key'])
+        key = self.data_keys.get(encrypted_key)
+        if key is None:
+            response = aws_clients.kms().decrypt(
+                CiphertextBlob = encrypted_key,
+                EncryptionContext = self.context
+            )
+            key = response['Plaintext']
+            self.data_keys.put(encrypted_key, key)
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        return AESGCM(key).decrypt(bytes(record['nonce']), bytes(record['ciphertext']), associated_data).decode('utf-8')
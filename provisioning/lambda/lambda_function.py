@@ -14,29 +14,68 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 
-import base64
+import answer_encoding
+import aws_clients
 import boto3
 import json
 import logging
 import os
-import re
-import requests
-import string
+import random
 import sys
+import threading
 import time
-from OpenSSL import crypto
-from OpenSSL.crypto import X509
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from time import gmtime, strftime
-from geopy.distance import great_circle
+from answer_store import AnswerStore
+from geo_cache import CachingGeolocator, cache_keys
+from geolocation import Geolocator
+from iot_limiter import LimitedClient, create_limiter, throttled
+from iot_policy import ensure_policy, get_account_id
+from keyring import Keyring
+from metrics import RequestMetrics
+from region_index import load_index, load_regions
+from rtt_routing import RttRouter, RttStats
+from task_graph import TaskGraph
 
 # globals
-ipstack_api_url = 'http://api.ipstack.com/'
-ipstack_api_key = os.environ['IPSTACK_API_KEY']
-
 iot_policy_name = 'GlobalDevicePolicy'
 dynamodb_table_name = 'iot-global-provisioning'
 pub_key_file = 'global-provisioning.pub.key.pem'
 
+# seconds after which a provisioning claim of a failed request can be taken over
+claim_timeout = int(os.environ.get('PROVISIONING_CLAIM_TIMEOUT', '300'))
+
+# batch requests
+batch_max_devices = int(os.environ.get('BATCH_MAX_DEVICES', '100'))
+batch_workers_per_region = int(os.environ.get('BATCH_WORKERS_PER_REGION', '4'))
+
+# per region iot client, endpoint and policy state, kept for the
+# lifetime of a warm container
+region_state_ttl = int(os.environ.get('REGION_STATE_TTL', '3600'))
+region_states = {}
+region_states_lock = threading.Lock()
+
+# IoT API calls are rate limited per region and API and retried by the
+# limiter, see iot_limiter.py. Without the limiter botocore retries.
+iot_limiter = create_limiter() if os.environ.get('IOT_LIMITER', 'true').lower() == 'true' else None
+if iot_limiter is not None:
+    iot_client_config = Config(max_pool_connections = 10, retries = {'max_attempts': 0})
+else:
+    iot_client_config = Config(max_pool_connections = 10)
+
+# certificates issued ahead of time for devices without CSR, the pool and
+# its crypto dependencies are loaded on first use, see get_cert_pool()
+cert_pool = None
+
+# answers of provisioned devices for retried requests, see answer_store.py
+answer_store = AnswerStore(os.environ['ANSWER_TABLE'], os.environ.get('ANSWER_KMS_KEY_ID')) \
+    if os.environ.get('ANSWER_TABLE') else None
+
+# thread pool for the IoT calls of provision_device
+iot_executor = ThreadPoolExecutor(max_workers = int(os.environ.get('IOT_WORKERS', '16')))
+
 # Configure logging
 logger = logging.getLogger()
 
@@ -44,232 +83,764 @@ for h in logger.handlers:
     logger.removeHandler(h)
 h = logging.StreamHandler(sys.stdout)
 
-FORMAT = "[%(asctime)s - %(levelname)s - %(filename)s:%(lineno)s - %(funcName)s - %(message)s"
+FORMAT = "[%(asctime)s - %(levelname)s - %(filename)s:%(lineno)s - %(funcName)s - %(request_id)s]: %(message)s"
 h.setFormatter(logging.Formatter(FORMAT))
 
-logger.addHandler(h)
-logger.setLevel(logging.INFO)
-
-class RequestIdAdapter(logging.LoggerAdapter):
-    def process(self, msg, kwargs):
-        return '%s]: %s' % (self.extra['request_id'], msg), kwargs
-
-regions = [
-    {"name": "ap-northeast-1", "lat": "35.9", "lon": "140.0"},
-    {"name": "eu-west-1", "lat": "53.5", "lon": "-6.1"},
-    {"name": "ap-southeast-2", "lat": "-33.7", "lon": "151.4"},
-    {"name": "us-east-2", "lat": "40.4", "lon": "-82.5"},
-    {"name": "eu-central-1", "lat": "50.3", "lon": "8.9"},
-    {"name": "us-east-1", "lat": "32.4", "lon": "-98.0"},
-    {"name": "ap-northeast-2", "lat": "37.8", "lon": "127.2"},
-    {"name": "ap-southeast-1", "lat": "1.5", "lon": "104.1"},
-    {"name": "ap-south-1", "lat": "19.1", "lon": "73.0"},
-    {"name": "us-west-2", "lat": "44.2", "lon": "-120.5"},
-    {"name": "eu-west-2", "lat": "51.7", "lon": "0.1"}
-]
-
-default_region = "eu-west-2"
+# request id of the current invocation, added to the log records of all
+# threads working on the request
+request_id = '-'
 
-def get_ip_location(ip):
-    request_url = ipstack_api_url + '/' + ip + '?access_key=' + ipstack_api_key
-    logger.debug("request_url: {}".format(request_url))
-    r = requests.get(request_url)
-    j = json.loads(r.text)
-    logger.debug("j: {}".format(j))
-    return j
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id
+        return True
+
+h.addFilter(RequestIdFilter())
+logger.addHandler(h)
+logger.setLevel(getattr(logging, os.environ.get('LOG_LEVEL', 'INFO').upper()))
+
+# events and API responses are logged at debug level for this share of
+# requests only
+payload_sample_rate = float(os.environ.get('LOG_PAYLOAD_SAMPLE_RATE', '1.0'))
+log_payloads = False
+
+def log_payload(name, payload):
+    if log_payloads:
+        logger.debug("%s: %s", name, payload)
+
+# stage timings, one embedded metric format record per request
+metrics = RequestMetrics()
+
+# regions prepared by tools/bootstrap-regions.py: the policy exists and the
+# endpoint is known. Without the manifest the policy is checked on the first
+# request for a region.
+readiness_file = os.environ.get('READINESS_MANIFEST',
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'region-readiness.json'))
+
+# objects that are reused by all requests of a container, created by init()
+geolocator = None
+keyring = None
+region_index = None
+rtt_router = None
+default_region = None
+ready_regions = None
+
+# bootstrapped regions whose state has been invalidated, they are checked
+# like regions without manifest
+recheck_regions = set()
+
+# create the DynamoDB client and load the global public key in the init
+# phase of the container instead of in its first request
+eager_init = os.environ.get('EAGER_INIT', 'true').lower() == 'true'
+initialized = False
+
+def init():
+    global geolocator, keyring, region_index, rtt_router, default_region, ready_regions, initialized
+    if initialized:
+        return
+    start = time.time()
+
+    # ip geolocation backends are set up on first use, results are cached
+    # per IP and network prefix
+    geolocator = CachingGeolocator(Geolocator(), metrics = metrics)
+
+    # verifiers for the thing name signature, per device keys are read from
+    # the provisioning table
+    keyring = Keyring(pub_key_file, dynamodb_table_name)
+
+    # geohash cell index for the region lookup
+    region_index = load_index()
+    default_region = load_regions()['default_region']
+
+    # regions that are not ready are excluded from routing, devices without
+    # location go to the ready region closest to the default region
+    ready_regions = load_readiness(readiness_file)
+    if ready_regions is not None:
+        region_index.exclude(set(r['name'] for r in region_index.regions) - set(ready_regions))
+        routable = region_index.routable(default_region)
+        if routable != default_region:
+            logger.warning("default region %s is not ready, using %s", default_region, routable)
+            default_region = routable
+
+    # measured handshake times of the devices to the regions
+    if os.environ.get('RTT_ROUTING', 'true').lower() == 'true':
+        rtt_router = RttRouter(region_index, RttStats())
+
+    if eager_init:
+        try:
+            aws_clients.dynamodb()
+            keyring.default_verifier()
+        except Exception as e:
+            # retried on first use
+            logger.warning("eager initialization failed: %s", e)
+
+    initialized = True
+    logger.info("initialized in %.1f ms", (time.time() - start) * 1000)
+
+
+def load_readiness(manifest_file):
+    # returns {region: endpoint} of the ready regions or None
+    if not os.path.isfile(manifest_file):
+        return None
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    if manifest.get('policy_name') != iot_policy_name:
+        logger.error("readiness manifest %s is for policy %s, ignoring it", manifest_file, manifest.get('policy_name'))
+        return None
+
+    # a manifest of another account, e.g. packaged for another stage, would
+    # skip the checks of regions that are not prepared in this one. The
+    # account id is cached for the policy checks.
+    try:
+        account_id = get_account_id()
+    except Exception as e:
+        logger.error("checking the account of readiness manifest %s failed, ignoring it: %s", manifest_file, e)
+        return None
+    if manifest.get('account_id') != account_id:
+        logger.error("readiness manifest %s is for account %s, not %s, ignoring it",
+                     manifest_file, manifest.get('account_id'), account_id)
+        return None
 
+    ready = dict((name, r['endpoint']) for name, r in manifest['regions'].items() if r.get('ready'))
+    not_ready = sorted(name for name, r in manifest['regions'].items() if not r.get('ready'))
+    logger.info("readiness manifest %s: ready regions: %s, not ready: %s", manifest_file, len(ready), not_ready)
+    return ready
 
-def find_best_region(lat, lon):
-    min_distance = 40000
-    closest_region = None
 
-    for r in regions:
-        logger.debug("r: {}".format(r))
-        elat = float(r["lat"])
-        elon = float(r["lon"])
-        logger.debug("elat: {}, elon: {}".format(elat, elon))
-        distance = great_circle((lat, lon), (elat, elon)).km
-        logger.debug("distance: {}".format(distance))
-        if distance <= min_distance:
-            min_distance = distance
-            closest_region = r["name"]
-        logger.debug("min_distance: {}".format(min_distance))
+def get_cert_pool():
+    global cert_pool
+    if cert_pool is None and os.environ.get('CERT_POOL_TABLE') and os.environ.get('CERT_POOL_KMS_KEY_ID'):
+        from cert_pool import CertPool
+        cert_pool = CertPool(os.environ['CERT_POOL_TABLE'], os.environ['CERT_POOL_KMS_KEY_ID'], iot_policy_name)
+    return cert_pool
 
-    logger.info("closest_region: {}, distance: {}".format(closest_region, min_distance))
 
-    return {"region": closest_region, "distance": min_distance}
+def get_ip_location(ip):
+    j = geolocator.lookup(ip)
+    log_payload("location", j)
+    return j
 
 
-def get_account_id():
-    client = boto3.client('sts')
-    response = client.get_caller_identity()
-    logger.info("response: {}".format(response))
-    return response['Account']
+def find_best_region(lat, lon, country_code = None):
+    best_region = region_index.lookup(lat, lon, country_code)
+    logger.info("closest_region: %s, distance: %s", best_region['region'], best_region['distance'])
+    return best_region
 
 
 def create_iot_policy_if_missing(c_iot, region):
     try:
-        response = c_iot.get_policy(policyName = iot_policy_name)
-        logger.info("policy exists already: response: {}".format(response))
+        ensure_policy(c_iot, iot_policy_name, region)
+        return True
     except Exception as e:
-        if re.match('.*ResourceNotFoundException.*', str(e)):
-            logger.info("creating iot policy {}".format(iot_policy_name))
-            account_id = get_account_id()
-            arn_connect = 'arn:aws:iot:' + region + ':' + account_id + ':client/${iot:ClientId}'
-            arn_publish = 'arn:aws:iot:' + region + ':' + account_id + ':topic/data/${iot:ClientId}/*'
-            logger.info("arn_connect: {}".format(arn_connect))
-            logger.info("arn_publish: {}".format(arn_publish))
-
-            policy_document = '''{
-                "Version": "2012-10-17",
-                "Statement": [{
-                    "Effect": "Allow",
-                    "Action": ["iot:Connect"],
-                    "Resource": [ "''' + arn_connect + '''" ]
-                },
-                {
-                    "Effect": "Allow",
-                    "Action": ["iot:Publish"],
-                    "Resource": [ "''' + arn_publish + '''" ]
-                }]
-            }'''
-
-            response = c_iot.create_policy(
-                policyName = iot_policy_name,
-                policyDocument = policy_document
-            )
-            logger.info("response: {}".format(response))
+        logger.error("checking iot policy in %s failed: %s", region, e)
+    return False
+
+
+def get_region_state(region, refresh = False):
+    # batch requests provision devices of a region in parallel, only one of
+    # them initializes the region
+    with region_states_lock:
+        return init_region_state(region, refresh)
+
+
+def init_region_state(region, refresh):
+    state = region_states.get(region)
+    now = time.time()
+
+    if state is None or refresh or now - state['created'] > region_state_ttl:
+        logger.info("initializing region state for %s", region)
+        c_iot = boto3.client('iot', region_name = region, config = iot_client_config)
+        if iot_limiter is not None:
+            c_iot = LimitedClient(c_iot, region, iot_limiter)
+        # bootstrapped regions need no endpoint lookup and no policy check
+        bootstrapped = ready_regions is not None and region in ready_regions and region not in recheck_regions
+        if bootstrapped:
+            endpoint = ready_regions[region]
         else:
-            logger.error("unknown error: {}".format(e))
+            response = c_iot.describe_endpoint(endpointType='iot:Data-ATS')
+            log_payload("describe_endpoint", response)
+            endpoint = response['endpointAddress']
+        state = {
+            'client': c_iot,
+            'endpoint': endpoint,
+            'policy_verified': bootstrapped,
+            'created': now
+        }
+        region_states[region] = state
+
+    if not state['policy_verified']:
+        state['policy_verified'] = create_iot_policy_if_missing(state['client'], region)
+
+    return state
+
+
+def invalidate_region_state(region):
+    logger.info("invalidating region state for %s", region)
+    region_states.pop(region, None)
+    # the next request checks endpoint and policy again
+    recheck_regions.add(region)
 
 
 def provision_device(thing_name, region, CSR):
     answer = {}
-    logger.info("thing_name: {}, region {}".format(thing_name, region))
-    c_iot = boto3.client('iot', region_name = region)
+    logger.info("thing_name: %s, region %s", thing_name, region)
 
-    # endpoint
-    response = c_iot.describe_endpoint(endpointType='iot:Data-ATS')
-    logger.info("response: {}".format(response))
-    answer['endpointAddress'] = response['endpointAddress']
+    # client, endpoint and policy are cached per region
+    state = get_region_state(region)
+    c_iot = state['client']
+    answer['endpointAddress'] = state['endpoint']
 
-    # create policy if missing
-    create_iot_policy_if_missing(c_iot, region)
+    try:
+        provision_thing(c_iot, region, thing_name, CSR, answer)
+    except Exception as e:
+        # cached state might be stale, e.g. the policy was deleted. Throttled
+        # calls say nothing about the state and a recheck adds more calls.
+        if not throttled(e):
+            invalidate_region_state(region)
+        raise
+
+    return answer
 
-    # create thing
-    response = c_iot.create_thing(thingName = thing_name)
-    logger.info("response: {}".format(response))
+
+def create_certificate(c_iot, region, CSR):
+    if not CSR and get_cert_pool() is not None:
+        try:
+            response = cert_pool.claim(region, c_iot)
+            if response is not None:
+                return response
+        except Exception as e:
+            logger.error("claiming a certificate from the pool failed: %s", e)
 
     if CSR:
-        logger.info("CSR received: create_certificate_from_csr")
+        logger.debug("CSR received: create_certificate_from_csr")
         # create cert from csr
         response = c_iot.create_certificate_from_csr(
             certificateSigningRequest = CSR,
             setAsActive = True
         )
-        logger.debug("response: {}".format(response))
-        certificate_arn = response['certificateArn']
-        certificate_id = response['certificateId']
-        logger.info("certificate_arn: {}, certificate_id: {}".format(certificate_arn, certificate_id))
-        answer['certificatePem'] = response['certificatePem']
     else:
-        logger.info("no CSR received: create_keys_and_certificate")
+        logger.debug("no CSR received: create_keys_and_certificate")
         # create key/cert
         response = c_iot.create_keys_and_certificate(setAsActive = True)
-        logger.debug("response: {}".format(response))
-        certificate_arn = response['certificateArn']
-        certificate_id = response['certificateId']
-        logger.info("certificate_arn: {}, certificate_id: {}".format(certificate_arn, certificate_id))
-        answer['certificatePem'] = response['certificatePem']
-        answer['PrivateKey'] = response['keyPair']['PrivateKey']
-
-    # attach policy to certificate
-    response = c_iot.attach_policy(
-        policyName = iot_policy_name,
-        target = certificate_arn
-    )
-    logger.info("response: {}".format(response))
+    logger.info("certificate_arn: %s, certificate_id: %s", response['certificateArn'], response['certificateId'])
+    return response
 
-    response = c_iot.attach_thing_principal(
-        thingName = thing_name,
-        principal = certificate_arn
-    )
-    logger.info("response: {}".format(response))
 
-    return answer
+def create_thing(c_iot, thing_name):
+    # create_thing succeeds for an existing thing with the same attributes,
+    # with others it fails. The request id as attribute tells a thing that
+    # this request created from one that existed, e.g. when a device is
+    # provisioned again, without another call. 'created' tells the
+    # compensation whether the thing belongs to this request.
+    try:
+        response = c_iot.create_thing(
+            thingName = thing_name,
+            attributePayload = {'attributes': {'provisioning_request': request_id}})
+        response['created'] = True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ResourceAlreadyExistsException':
+            raise
+        logger.info("thing %s exists already", thing_name)
+        response = {'thingName': thing_name, 'created': False}
+    return response
+
+
+def delete_thing(c_iot, thing_name, response):
+    if response['created']:
+        c_iot.delete_thing(thingName = thing_name)
+
+
+def delete_certificate(c_iot, certificate_id):
+    c_iot.update_certificate(certificateId = certificate_id, newStatus = 'INACTIVE')
+    c_iot.delete_certificate(certificateId = certificate_id, forceDelete = True)
+
+
+def provision_thing(c_iot, region, thing_name, CSR, answer):
+    # thing and certificate are created in parallel, the policy is attached
+    # as soon as the certificate exists. Created resources are removed again
+    # if a step fails.
+    graph = TaskGraph(iot_executor)
+
+    graph.add('create_thing',
+              lambda r: create_thing(c_iot, thing_name),
+              compensate = lambda response: delete_thing(c_iot, thing_name, response))
+
+    graph.add('create_certificate',
+              lambda r: create_certificate(c_iot, region, CSR),
+              compensate = lambda response: delete_certificate(c_iot, response['certificateId']))
+
+    # attach policy to certificate, pooled certificates have it already
+    def attach_policy(r):
+        if r['create_certificate'].get('pooled'):
+            return None
+        return c_iot.attach_policy(
+            policyName = iot_policy_name,
+            target = r['create_certificate']['certificateArn'])
+
+    def detach_policy(response):
+        if response is not None:
+            c_iot.detach_policy(
+                policyName = iot_policy_name,
+                target = graph.results['create_certificate']['certificateArn'])
 
+    graph.add('attach_policy', attach_policy, depends = ['create_certificate'], compensate = detach_policy)
 
-def device_marked_for_provisioning(thing_name):
-    c_dynamo = boto3.client('dynamodb')
+    graph.add('attach_thing_principal',
+              lambda r: c_iot.attach_thing_principal(
+                  thingName = thing_name,
+                  principal = r['create_certificate']['certificateArn']),
+              depends = ['create_thing', 'create_certificate'],
+              compensate = lambda response: c_iot.detach_thing_principal(
+                  thingName = thing_name,
+                  principal = graph.results['create_certificate']['certificateArn']))
+
+    try:
+        results = graph.run()
+    finally:
+        for name, ms in graph.timings.items():
+            if name != 'total':
+                metrics.add('iot_' + name, ms)
+
+    log_payload("create_thing", results['create_thing'])
+    log_payload("attach_policy", results['attach_policy'])
+    log_payload("attach_thing_principal", results['attach_thing_principal'])
+
+    answer['certificateArn'] = results['create_certificate']['certificateArn']
+    answer['certificatePem'] = results['create_certificate']['certificatePem']
+    if not CSR:
+        answer['PrivateKey'] = results['create_certificate']['keyPair']['PrivateKey']
+
+
+def claim_device_for_provisioning(thing_name):
+    # moves the device from unprovisioned to provisioning in a single
+    # conditional write. Claims of crashed requests can be taken over after
+    # claim_timeout seconds.
+    now = int(time.time())
     key = {"thing_name": {"S": thing_name}}
-    logger.info("key {}".format(key))
 
-    response = c_dynamo.get_item(TableName = dynamodb_table_name, Key = key)
-    logger.info("response: {}".format(response))
+    try:
+        response = aws_clients.dynamodb().update_item(
+            TableName = dynamodb_table_name,
+            Key = key,
+            UpdateExpression = "SET prov_status = :p, prov_claimed_at = :now",
+            ConditionExpression = "prov_status = :u OR (prov_status = :p AND prov_claimed_at < :stale)",
+            ExpressionAttributeValues = {
+                ":u": {"S": "unprovisioned"},
+                ":p": {"S": "provisioning"},
+                ":now": {"N": str(now)},
+                ":stale": {"N": str(now - claim_timeout)}
+            },
+            ReturnValues = "ALL_NEW"
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            logger.error("thing %s not found in DynamoDB or not unprovisioned", thing_name)
+            return None
+        raise
 
-    if 'Item' in response:
-        if 'prov_status' in response['Item']:
-            status = response['Item']['prov_status']['S']
-            logger.info("status: {}".format(status))
-            if status == "unprovisioned":
-                return True
-        else:
-            logger.warn("no status in result")
-            return False
-    else:
-        logger.error("thing {} not found in DynamoDB".format(thing_name))
+    log_payload("update_item", response)
+    return response['Attributes']
 
-    return False
+
+def release_device_claim(thing_name, claimed_at):
+    # claimed_at is the claim token: a claim that another request has taken
+    # over after claim_timeout is left alone
+    key = {"thing_name": {"S": thing_name}}
+    logger.info("releasing claim for %s", thing_name)
+
+    try:
+        aws_clients.dynamodb().update_item(
+            TableName = dynamodb_table_name,
+            Key = key,
+            UpdateExpression = "SET prov_status = :u REMOVE prov_claimed_at",
+            ConditionExpression = "prov_status = :p AND prov_claimed_at = :c",
+            ExpressionAttributeValues = {
+                ":u": {"S": "unprovisioned"},
+                ":p": {"S": "provisioning"},
+                ":c": {"N": claimed_at}
+            }
+        )
+    except Exception as e:
+        # the claim expires after claim_timeout
+        logger.error("releasing claim for %s failed: %s", thing_name, e)
 
 
-def update_device_provisioning_status(thing_name, region):
-    c_dynamo = boto3.client('dynamodb')
+def update_device_provisioning_status(thing_name, region, claimed_at):
     datetime = time.strftime("%Y-%m-%dT%H:%M:%S", gmtime())
 
     key = {"thing_name": {"S": thing_name}}
-    logger.info("key {}".format(key))
-    update_expression = "SET prov_status = :s, prov_datetime = :d, aws_region = :r"
-    expression_attribute_values = {":s": {"S": "provisioned"}, ":d": {"S": datetime}, ":r": {"S": region}}
-
-    response = c_dynamo.update_item(
+    update_expression = "SET prov_status = :s, prov_datetime = :d, aws_region = :r REMOVE prov_claimed_at"
+    expression_attribute_values = {
+        ":s": {"S": "provisioned"},
+        ":d": {"S": datetime},
+        ":r": {"S": region},
+        ":p": {"S": "provisioning"},
+        ":c": {"N": claimed_at}
+    }
+
+    response = aws_clients.dynamodb().update_item(
         TableName = dynamodb_table_name,
         Key = key,
         UpdateExpression = update_expression,
+        ConditionExpression = "prov_status = :p AND prov_claimed_at = :c",
         ExpressionAttributeValues = expression_attribute_values
     )
-    logger.info("response: {}".format(response))
+    log_payload("update_item", response)
 
 
 def sig_verified(message, sig):
-    f = open(pub_key_file, 'r')
-    pub_key_pem = f.read()
-    f.close()
+    try:
+        if keyring.verify(message, sig):
+            logger.debug("signature verified for message %s", message)
+            return True
+        logger.error("verifying signature failed for message %s: invalid signature", message)
+    except Exception as e:
+        logger.error("verifying signature failed for message %s: %s", message, e)
+
+    return False
+
 
-    pub_key = crypto.load_publickey(crypto.FILETYPE_PEM, pub_key_pem)
-    sig = base64.b64decode(sig)
-    pub_key_x509 = X509()
-    pub_key_x509.set_pubkey(pub_key)
+def find_rtt_region(ip, rtt, lat, lon, country_code = None):
+    if rtt_router is None:
+        return None
+    # overrides, e.g. for data residency, win over handshake times
+    override = region_index.override(lat, lon, country_code)
+    prefix = cache_keys(ip, geolocator.prefix_v4, geolocator.prefix_v6)[1]
+    placement = rtt_router.place(prefix, rtt, lat, lon, allowed = [override] if override else None)
+    if placement is not None:
+        metrics.set_property('routing', placement['routing'])
+    return placement
 
+
+def record_rtt(ip, rtt):
+    # after the claim, recording must not fail the request
+    if rtt_router is None or not rtt:
+        return
     try:
-        crypto.verify(pub_key_x509, sig, message, 'sha256')
-        logger.info("signature verified for message {}".format(message))
-        return True
+        prefix = cache_keys(ip, geolocator.prefix_v4, geolocator.prefix_v6)[1]
+        rtt_router.record(prefix, rtt)
+    except Exception as e:
+        logger.error("recording the rtt of %s failed: %s", ip, e)
+
+
+def locate_device(ip, rtt = None):
+    # region for the handshake times that the device or others in its
+    # network have measured, otherwise for the device's IP address
+    with metrics.stage('geolocate'):
+        location = get_ip_location(ip)
+
+    lat = lon = None
+    if location['latitude'] != None and location['longitude'] != None:
+        lat = float(location['latitude'])
+        lon = float(location['longitude'])
+        logger.debug("lat: %s, lon: %s", lat, lon)
+
+    with metrics.stage('find_region'):
+        placement = find_rtt_region(ip, rtt, lat, lon, location.get('country_code'))
+        if placement is None and lat is not None:
+            placement = find_best_region(lat, lon, location.get('country_code'))
+
+    if placement is None:
+        return default_placement("no latitude or longitude for IP {}".format(ip))
+    return placement
+
+
+def default_placement(reason):
+    logger.warning("%s, using default region %s", reason, default_region)
+    return {
+        'region': default_region,
+        'message': "{}, using default region {}".format(reason, default_region)
+    }
+
+
+def pinned_placement(item):
+    # devices can be pinned to a region in the provisioning table
+    if 'region_pin' in item:
+        region = item['region_pin']['S']
+        if ready_regions is not None and region not in ready_regions:
+            logger.warning("device %s is pinned to %s which is not ready, routing it", item['thing_name']['S'], region)
+            return None
+        logger.info("device %s is pinned to %s", item['thing_name']['S'], region)
+        return {'region': region}
+    return None
+
+
+def claim_and_provision(thing_name, CSR, placement, pending_answer = None, on_claim = None):
+    # pending_answer: future of the stored answer read before the claim,
+    # on_claim: called once the device has been claimed
+    with metrics.stage('claim'):
+        item = claim_device_for_provisioning(thing_name)
+    if item is None:
+        # a retry of a request that has provisioned the device
+        answer = pending_answer.result() if pending_answer is not None else stored_answer(thing_name, CSR)
+        if answer is not None:
+            logger.info("device %s is provisioned, returning the stored answer", thing_name)
+            metrics.count('replayed')
+            return answer
+        logger.error("device %s is not marked for provisioning", thing_name)
+        return {"status": "error", "message": "you not"}
+
+    if on_claim is not None:
+        on_claim()
+
+    claimed_at = item['prov_claimed_at']['N']
+    placement = pinned_placement(item) or placement
+    region = placement['region']
+
+    try:
+        with metrics.stage('provision'):
+            answer = provision_device(thing_name, region, CSR)
+    except Exception as e:
+        logger.error("provisioning %s failed: %s", thing_name, e)
+        metrics.count('failed')
+        release_device_claim(thing_name, claimed_at)
+        return {"status": "error", "message": "provisioning failed"}
+
+    answer['region'] = region
+    if 'distance' in placement:
+        answer['distance'] = placement['distance']
+    if 'rtt' in placement:
+        answer['rtt'] = placement['rtt']
+    if 'message' in placement:
+        answer['message'] = placement['message']
+    answer['status'] = 'success'
+
+    # stored before the status update, so that a retry finds it even if
+    # this request does not finish
+    store_answer(thing_name, CSR, answer)
+
+    # the device has its certificate, a failed update must not turn this
+    # into an error. The claim expires after claim_timeout.
+    try:
+        with metrics.stage('update_status'):
+            update_device_provisioning_status(thing_name, region, claimed_at)
     except Exception as e:
-        logger.error("verifying signature failed for message {}: {}".format(message, e))
+        logger.error("updating the status of %s failed: %s", thing_name, e)
+        metrics.count('update_status_failed')
+    metrics.count('provisioned')
+    return answer
+
+
+def store_answer(thing_name, CSR, answer):
+    if answer_store is None:
+        return
+    try:
+        with metrics.stage('store_answer'):
+            answer_store.put(thing_name, CSR, answer)
+    except Exception as e:
+        # the device is provisioned, a retry gets an error
+        logger.error("storing the answer for %s failed: %s", thing_name, e)
+
+
+def stored_answer(thing_name, CSR):
+    if answer_store is None:
+        return None
+    try:
+        with metrics.stage('stored_answer'):
+            answer = answer_store.get(thing_name, CSR)
+    except Exception as e:
+        logger.error("reading the stored answer for %s failed: %s", thing_name, e)
+        return None
+    return answer
+
+
+def stored_answers(requests):
+    try:
+        with metrics.stage('stored_answer'):
+            answers = answer_store.get_many(requests)
+    except Exception as e:
+        logger.error("reading stored answers failed: %s", e)
+        return {}
+    if answers:
+        logger.info("returning stored answers for %s devices", len(answers))
+        metrics.count('replayed', len(answers))
+    return answers
+
+
+def get_device_addrs(event):
+    if 'params' in event and 'header' in event['params'] and 'X-Forwarded-For' in event['params']['header']:
+        device_addrs = ''.join(str(event['params']['header']['X-Forwarded-For']).split()).split(',')
+        logger.info("device_addrs: %s", device_addrs)
+        return device_addrs
+
+    logger.warning("can not find X-Forwarded-For")
+    return None
+
+
+def batch_get_devices(thing_names):
+    # provisioning table items for the thing names, read with BatchGetItem
+    items = {}
+    keys = [{"thing_name": {"S": t}} for t in set(thing_names)]
+
+    for i in range(0, len(keys), 100):
+        request = {dynamodb_table_name: {
+            'Keys': keys[i:i + 100],
+            'ProjectionExpression': 'thing_name, prov_status, pub_key, region_pin'
+        }}
+        retries = 0
+        while request:
+            response = aws_clients.dynamodb().batch_get_item(RequestItems = request)
+            for item in response['Responses'].get(dynamodb_table_name, []):
+                items[item['thing_name']['S']] = item
+            request = response.get('UnprocessedKeys')
+            if request:
+                retries += 1
+                time.sleep(min(0.05 * 2 ** retries, 1))
+
+    return items
+
+
+def batch_provision(devices, device_addrs, rtt = None):
+    if len(devices) > batch_max_devices:
+        logger.error("batch of %s devices exceeds the limit of %s", len(devices), batch_max_devices)
+        return {"status": "error", "message": "batch too large"}
+
+    results = [None] * len(devices)
+    pending = []
+
+    for i, device in enumerate(devices):
+        if not isinstance(device, dict) or device.get('thing-name') == None:
+            results[i] = {"status": "error", "message": "no thing name"}
+        elif device.get('thing-name-sig') == None:
+            results[i] = {"thing-name": device['thing-name'], "status": "error", "message": "no sig"}
+        else:
+            pending.append(i)
+
+    # allowlist status and device keys in as few reads as possible
+    with metrics.stage('batch_get'):
+        items = batch_get_devices([devices[i]['thing-name'] for i in pending])
+    bad_keys = set()
+    for thing_name, item in items.items():
+        # a malformed pub_key fails its device, not the batch
+        try:
+            keyring.prime(thing_name, item['pub_key']['S'] if 'pub_key' in item else None)
+        except Exception as e:
+            logger.error("loading the key of %s failed: %s", thing_name, e)
+            bad_keys.add(thing_name)
+
+    claimable = []
+    provisioned = []
+    for i in pending:
+        thing_name = devices[i]['thing-name']
+        item = items.get(thing_name)
+        if thing_name in bad_keys:
+            verified = False
+        else:
+            with metrics.stage('verify_signature'):
+                verified = sig_verified(thing_name, devices[i]['thing-name-sig'])
+        if not verified:
+            results[i] = {"thing-name": thing_name, "status": "error", "message": "wrong sig"}
+        elif answer_store is not None and item is not None and item.get('prov_status', {}).get('S') == 'provisioned':
+            provisioned.append(i)
+        elif item is None or item.get('prov_status', {}).get('S') not in ('unprovisioned', 'provisioning'):
+            logger.error("device %s is not marked for provisioning", thing_name)
+            results[i] = {"thing-name": thing_name, "status": "error", "message": "you not"}
+        else:
+            claimable.append(i)
+
+    # retries of devices that a previous request has provisioned, the
+    # stored answers are read at once
+    if provisioned:
+        answers = stored_answers([(devices[i]['thing-name'], devices[i].get('CSR')) for i in provisioned])
+        for i in provisioned:
+            thing_name = devices[i]['thing-name']
+            if thing_name in answers:
+                results[i] = dict(answers[thing_name], **{"thing-name": thing_name})
+            else:
+                logger.error("device %s is not marked for provisioning", thing_name)
+                results[i] = {"thing-name": thing_name, "status": "error", "message": "you not"}
+
+    # the devices of a batch share the source address, locate it once
+    placements = {}
+    by_region = {}
+    for i in claimable:
+        placement = pinned_placement(items[devices[i]['thing-name']])
+        if placement is None:
+            ip = device_addrs[0]
+            if ip not in placements:
+                # the address comes from X-Forwarded-For, a malformed one
+                # must not fail the whole batch
+                try:
+                    placements[ip] = locate_device(ip, rtt)
+                except Exception as e:
+                    logger.error("locating %s failed: %s", ip, e)
+                    placements[ip] = default_placement("IP {} could not be located".format(ip))
+            placement = placements[ip]
+        by_region.setdefault(placement['region'], []).append((i, placement))
+
+    # bounded concurrency per region, all regions in parallel. The devices
+    # share the handshake times, they are recorded once if any is claimed.
+    claimed = []
+    executors = []
+    futures = []
+    for region, region_devices in by_region.items():
+        logger.info("provisioning %s devices in %s", len(region_devices), region)
+        executor = ThreadPoolExecutor(max_workers = batch_workers_per_region)
+        executors.append(executor)
+        for i, placement in region_devices:
+            device = devices[i]
+            futures.append((i, executor.submit(claim_and_provision, device['thing-name'], device.get('CSR'), placement,
+                                              None, lambda: claimed.append(True))))
+
+    for i, future in futures:
+        try:
+            answer = future.result()
+        except Exception as e:
+            logger.error("provisioning %s failed: %s", devices[i]['thing-name'], e)
+            answer = {"status": "error", "message": "provisioning failed"}
+        answer['thing-name'] = devices[i]['thing-name']
+        results[i] = answer
+
+    for executor in executors:
+        executor.shutdown()
+
+    if claimed:
+        record_rtt(device_addrs[0], rtt)
+
+    succeeded = sum(1 for r in results if r['status'] == 'success')
+    logger.info("batch provisioned %s of %s devices", succeeded, len(devices))
+    return {"status": "success", "provisioned": succeeded, "results": results}
 
 
 def lambda_handler(event, context):
-    global logger
-    logger = RequestIdAdapter(logger, {'request_id': context.aws_request_id})
+    global request_id, log_payloads
+    request_id = context.aws_request_id
+    log_payloads = logger.isEnabledFor(logging.DEBUG) and random.random() < payload_sample_rate
+
+    body = event.get('body-json')
+    metrics.begin(request_id, Path = 'batch' if isinstance(body, dict) and 'devices' in body else 'single')
+    metrics.set_property('status', 'error')
+    try:
+        answer = handle_request(event)
+        metrics.set_property('status', answer['status'])
+        if 'message' in answer:
+            metrics.set_property('message', answer['message'])
+        if 'region' in answer:
+            metrics.set_property('region', answer['region'])
+
+        # JSON or a compact encoding for constrained devices
+        content_type = answer_encoding.negotiate(answer_encoding.accept_header(event))
+        if content_type != answer_encoding.JSON:
+            metrics.set_property('encoding', content_type)
+        return answer_encoding.encode(answer, content_type)
+    finally:
+        metrics.emit()
 
-    logger.info("event: {}".format(event))
+
+def handle_request(event):
+    log_payload("event", event)
 
     thing_name = None
     thing_name_sig = None
     CSR = None
-    answer = {}
 
     if 'body-json' in event:
+        if 'devices' in event['body-json']:
+            device_addrs = get_device_addrs(event)
+            if device_addrs is None:
+                return {"status": "error", "message": "no location"}
+            return batch_provision(event['body-json']['devices'], device_addrs, event['body-json'].get('region-rtt'))
+
         if 'thing-name' in event['body-json']:
             thing_name = event['body-json']['thing-name']
 
@@ -283,9 +854,9 @@ def lambda_handler(event, context):
         return {"status": "error", "message": "invalid request"}
 
 
-    logger.info("thing_name: {}".format(thing_name))
-    logger.info("thing_name_sig: {}".format(thing_name_sig))
-    logger.info("CSR: {}".format(CSR))
+    logger.info("thing_name: %s", thing_name)
+    log_payload("thing_name_sig", thing_name_sig)
+    log_payload("CSR", CSR)
 
     if thing_name == None:
         logger.error("no thing-name in request")
@@ -295,38 +866,60 @@ def lambda_handler(event, context):
         logger.error("no thing-name-sig in request")
         return {"status": "error", "message": "no sig"}
 
-    if not sig_verified(thing_name, thing_name_sig):
+    with metrics.stage('verify_signature'):
+        verified = sig_verified(thing_name, thing_name_sig)
+    if not verified:
         logger.error("signature could not be verified")
         return {"status": "error", "message": "wrong sig"}
 
-    if not device_marked_for_provisioning(thing_name):
-        logger.error("device is not marked for provisioning")
-        return {"status": "error", "message": "you not"}
-
-    if 'params' in event and 'header' in event['params'] and 'X-Forwarded-For' in event['params']['header']:
-        device_addrs = str(event['params']['header']['X-Forwarded-For']).translate(None, string.whitespace).split(',')
-        logger.info(device_addrs)
-    else:
-        logger.warn("can not find X-Forwarded-For")
+    device_addrs = get_device_addrs(event)
+    if device_addrs is None:
         return {"status": "error", "message": "no location"}
 
-    location = get_ip_location(device_addrs[0])
-    if location['latitude'] == None or location['longitude'] == None:
-        logger.warn("no latitude or longitude for IP {}, using default region {}".format(device_addrs[0], default_region))
-        answer = provision_device(thing_name, default_region, CSR)
-        answer['region'] = default_region
-        answer['message'] = "no latitude or longitude for IP {}, using default region {}".format(device_addrs[0], default_region)
-        answer['status'] = 'success'
-    else:
-        lat = float(location['latitude'])
-        lon = float(location['longitude'])
-        logger.info("lat: {}, lon: {}".format(lat, lon))
-        best_region = find_best_region(lat, lon)
-        answer = provision_device(thing_name, best_region['region'], CSR)
-        answer['region'] = best_region['region']
-        answer['distance'] = best_region['distance']
-        answer['status'] = 'success'
+    # the stored answer of a retry is read while the device is located, a
+    # failed claim then needs no further round trip. It is only used if the
+    # claim fails, a device that has been reset is provisioned anew.
+    pending_answer = None
+    if answer_store is not None:
+        pending_answer = iot_executor.submit(stored_answer, thing_name, CSR)
 
-    update_device_provisioning_status(thing_name, best_region['region'])
+    rtt = event['body-json'].get('region-rtt')
+    try:
+        placement = locate_device(device_addrs[0], rtt)
+    except Exception as e:
+        logger.error("locating %s failed: %s", thing_name, e)
+        return {"status": "error", "message": "provisioning failed"}
 
-    return answer
+    return claim_and_provision(thing_name, CSR, placement, pending_answer,
+                               lambda: record_rtt(device_addrs[0], rtt))
+
+
+def cert_pool_refill_handler(event, context):
+    global request_id
+    request_id = context.aws_request_id
+
+    # scheduled job that refills the certificate pools of all regions
+    if get_cert_pool() is None:
+        logger.error("certificate pool is not configured")
+        return {"status": "error", "message": "no cert pool"}
+
+    def refill(region):
+        state = get_region_state(region)
+        return cert_pool.refill(state['client'], region)
+
+    regions = [r['name'] for r in load_regions()['regions']]
+    report = {}
+    for region, future in [(r, iot_executor.submit(refill, r)) for r in regions]:
+        try:
+            depth, issued = future.result()
+            report[region] = {"depth": depth, "issued": issued}
+        except Exception as e:
+            logger.error("refilling certificate pool for %s failed: %s", region, e)
+            report[region] = {"error": str(e)}
+
+    logger.info("certificate pool: %s", report)
+    return {"status": "success", "regions": report}
+
+
+# runs in the init phase of the container
+init()
@@ -0,0 +1,105 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+# Per request metrics in CloudWatch Embedded Metric Format (EMF). The stages
+# of a request are timed and written as one JSON record to stdout when the
+# request is done, CloudWatch Logs extracts the metrics from the record
+# without any API call. Stages that run more than once in a request, e.g.
+# for each device of a batch, are written as a list of values.
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+namespace = os.environ.get('METRICS_NAMESPACE', 'GlobalDeviceProvisioning')
+enabled = os.environ.get('METRICS_EMF', 'true').lower() == 'true'
+
+# CloudWatch accepts up to 100 values per metric and record
+max_values = 100
+
+
+class RequestMetrics(object):
+    def __init__(self, namespace = namespace, stream = None):
+        self.namespace = namespace
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.begin(None)
+
+    def begin(self, request_id, **dimensions):
+        with self.lock:
+            self.started = time.time()
+            self.request_id = request_id
+            self.dimensions = dimensions
+            self.values = {}
+            self.units = {}
+            self.properties = {}
+
+    def add(self, name, value, unit = 'Milliseconds'):
+        with self.lock:
+            values = self.values.setdefault(name, [])
+            if len(values) < max_values:
+                values.append(value)
+            self.units[name] = unit
+
+    def count(self, name, n = 1):
+        with self.lock:
+            self.values[name] = [self.values.get(name, [0])[0] + n]
+            self.units[name] = 'Count'
+
+    def set_property(self, name, value):
+        with self.lock:
+            self.properties[name] = value
+
+    @contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, (time.time() - start) * 1000)
+
+    def record(self):
+        with self.lock:
+            self.values['total'] = [(time.time() - self.started) * 1000]
+            self.units['total'] = 'Milliseconds'
+
+            record = dict(self.properties)
+            record.update(self.dimensions)
+            record['requestId'] = self.request_id
+            for name, values in self.values.items():
+                values = [round(v, 2) for v in values]
+                record[name] = values[0] if len(values) == 1 else values
+            record['_aws'] = {
+                'Timestamp': int(self.started * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [sorted(self.dimensions)],
+                    'Metrics': [{'Name': n, 'Unit': u} for n, u in sorted(self.units.items())]
+                }]
+            }
+            return record
+
+    def emit(self):
+        if not enabled:
+            return
+        stream = self.stream or sys.stdout
+        stream.write(json.dumps(self.record(), separators = (',', ':')) + '\n')
+        stream.flush()
+
@@ -0,0 +1,226 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# region_index.py
+# maps a location to the closest region with a precomputed index of geohash
+# cells. Most cells resolve to a region directly, only cells close to the
+# border between regions (or a polygon override) fall back to computing the
+# distance to the candidate regions of that cell.
+# The index is created by tools/build-region-index.py from regions.json and
+# optional overrides.
+#
+# Cell values in the index:
+#   <int>                      index of the region for the whole cell
+#   [<int>, ...]               candidate regions, the closest one wins
+#   {"p": [...], "c": [...]}   polygon overrides to check first, then candidates
+
+import json
+import logging
+import math
+import os
+
+logger = logging.getLogger()
+
+EARTH_RADIUS = 6371.009
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+lambda_dir = os.path.dirname(os.path.abspath(__file__))
+default_regions_file = os.path.join(lambda_dir, 'regions.json')
+default_index_file = os.path.join(lambda_dir, 'region-index.json')
+
+
+def great_circle(lat1, lon1, lat2, lon2):
+    # same formula as geopy.distance.great_circle
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    sin_lat1, cos_lat1 = math.sin(lat1), math.cos(lat1)
+    sin_lat2, cos_lat2 = math.sin(lat2), math.cos(lat2)
+    delta_lon = lon2 - lon1
+    cos_delta_lon, sin_delta_lon = math.cos(delta_lon), math.sin(delta_lon)
+
+    d = math.atan2(math.sqrt((cos_lat2 * sin_delta_lon) ** 2 +
+                             (cos_lat1 * sin_lat2 - sin_lat1 * cos_lat2 * cos_delta_lon) ** 2),
+                   sin_lat1 * sin_lat2 + cos_lat1 * cos_lat2 * cos_delta_lon)
+    return EARTH_RADIUS * d
+
+
+def geohash_encode(lat, lon, precision):
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    n = 0
+    even = True
+
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_lo = mid
+            else:
+                bits = bits << 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_lo = mid
+            else:
+                bits = bits << 1
+                lat_hi = mid
+        even = not even
+        n += 1
+        if n == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            n = 0
+
+    return ''.join(chars)
+
+
+def point_in_polygon(lat, lon, polygon):
+    # ray casting, polygons are given as [[lat, lon], ...] and must not
+    # cross the antimeridian
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lon_i = polygon[i]
+        lat_j, lon_j = polygon[j]
+        if (lat_i > lat) != (lat_j > lat):
+            if lon < (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i:
+                inside = not inside
+        j = i
+    return inside
+
+
+def load_regions(regions_file = default_regions_file):
+    with open(regions_file) as f:
+        return json.load(f)
+
+
+class RegionIndex(object):
+    def __init__(self, regions, index = None):
+        self.regions = regions
+        self.index = index
+        self.cells = index['cells'] if index else {}
+        self.precision = index['precision'] if index else 0
+        self.countries = index.get('countries', {}) if index else {}
+        self.polygons = index.get('polygons', []) if index else []
+        self.excluded = set()
+
+    def exclude(self, names):
+        # regions that are not ready are excluded from routing, devices of
+        # their cells go to the closest of the other regions
+        self.excluded = set(i for i, r in enumerate(self.regions) if r['name'] in names)
+        if len(self.excluded) == len(self.regions):
+            # there is no region left to route to, provisioning fails in
+            # regions that are not ready, but not for every device
+            logger.error("no region is ready, routing to all regions, run tools/bootstrap-regions.py")
+            self.excluded = set()
+
+    def routable(self, name):
+        # the region or, if it is excluded, the closest region that is not
+        i = [r['name'] for r in self.regions].index(name)
+        if i not in self.excluded:
+            return name
+        r = self.regions[i]
+        candidates = [j for j in range(len(self.regions)) if j not in self.excluded]
+        return self.regions[self.closest(r['lat'], r['lon'], candidates)[0]]['name']
+
+    def closest(self, lat, lon, candidates):
+        min_distance = 40000
+        closest_region = None
+        for i in candidates:
+            r = self.regions[i]
+            distance = great_circle(lat, lon, r['lat'], r['lon'])
+            if distance <= min_distance:
+                min_distance = distance
+                closest_region = i
+        return closest_region, min_distance
+
+    def result(self, i, lat, lon, distance = None):
+        r = self.regions[i]
+        if distance is None:
+            distance = great_circle(lat, lon, r['lat'], r['lon'])
+        return {'region': r['name'], 'distance': distance}
+
+    def cell_value(self, lat, lon):
+        geohash = geohash_encode(lat, lon, self.precision)
+        for n in range(1, self.precision + 1):
+            value = self.cells.get(geohash[:n])
+            if value is not None:
+                return value
+        return None
+
+    def lookup(self, lat, lon, country_code = None):
+        result = self.indexed_lookup(lat, lon, country_code)
+        if self.excluded and result[0] in self.excluded:
+            result = self.closest(lat, lon, [i for i in range(len(self.regions)) if i not in self.excluded])
+        return self.result(result[0], lat, lon, result[1])
+
+    def override(self, lat, lon, country_code = None):
+        # name of the region a country or polygon override assigns the
+        # location to, None without override or if that region is excluded
+        i = self.countries.get(country_code) if country_code else None
+        if i is None and lat is not None and lon is not None:
+            for p in self.polygons:
+                if point_in_polygon(lat, lon, p['polygon']):
+                    i = p['region']
+                    break
+        if i is None or i in self.excluded:
+            return None
+        return self.regions[i]['name']
+
+    def indexed_lookup(self, lat, lon, country_code):
+        # returns (region index, distance or None)
+        if country_code and country_code in self.countries:
+            return self.countries[country_code], None
+
+        value = self.cell_value(lat, lon) if self.index else None
+
+        if isinstance(value, int):
+            return value, None
+
+        candidates = range(len(self.regions))
+        if isinstance(value, dict):
+            for p in value['p']:
+                if point_in_polygon(lat, lon, self.polygons[p]['polygon']):
+                    return self.polygons[p]['region'], None
+            candidates = value['c']
+        elif isinstance(value, list):
+            candidates = value
+
+        return self.closest(lat, lon, candidates)
+
+
+def load_index(regions_file = default_regions_file, index_file = default_index_file):
+    regions = load_regions(regions_file)['regions']
+
+    if not os.path.isfile(index_file):
+        logger.warning("region index %s not found, computing distances to all regions", index_file)
+        return RegionIndex(regions)
+
+    with open(index_file) as f:
+        index = json.load(f)
+
+    if [r['name'] for r in regions] != index['regions']:
+        logger.error("region index %s does not match %s, computing distances to all regions",
+                     index_file, regions_file)
+        return RegionIndex(regions)
+
+    logger.info("loaded region index %s: cells: %s, precision: %s",
+                index_file, len(index['cells']), index['precision'])
+    return RegionIndex(regions, index)
@@ -0,0 +1,177 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# rtt_routing.py
+# region selection by the TLS handshake times that a device has measured to
+# the regional AWS IoT endpoints, sent as region-rtt in the request. The
+# cost of a region is its handshake time plus RTT_DISTANCE_WEIGHT ms per km
+# between the device location and the region; the region with the lowest
+# cost wins. The handshake times are aggregated per network prefix, so that
+# devices of the same network that do not probe are routed by the
+# measurements of the others. An optional DynamoDB table (hash key
+# cache_key, e.g. the geo cache table) shares the aggregates between Lambda
+# containers. Without measurements the region is chosen by distance.
+# Country and polygon overrides of the region index restrict the regions a
+# device can be routed to, the handshake times only choose among them.
+
+import json
+import logging
+import os
+import time
+
+import aws_clients
+from region_index import great_circle
+from ttl_cache import TTLCache
+
+logger = logging.getLogger()
+
+
+class RttStats(object):
+    # moving average of the handshake time per prefix and region:
+    # {region: [samples, average ms]}
+    def __init__(self, maxsize = None, ttl = None, alpha = None, min_samples = None, table_name = None):
+        if maxsize is None:
+            maxsize = int(os.environ.get('RTT_STATS_SIZE', '10000'))
+        if ttl is None:
+            ttl = int(os.environ.get('RTT_STATS_TTL', '86400'))
+        if alpha is None:
+            alpha = float(os.environ.get('RTT_STATS_ALPHA', '0.2'))
+        if min_samples is None:
+            min_samples = int(os.environ.get('RTT_STATS_MIN_SAMPLES', '3'))
+        if table_name is None:
+            table_name = os.environ.get('RTT_STATS_TABLE')
+
+        self.cache = TTLCache(maxsize, ttl)
+        self.ttl = ttl
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.table_name = table_name
+
+    def load(self, prefix):
+        stats = self.cache.get(prefix)
+        if stats is None and self.table_name:
+            try:
+                response = aws_clients.dynamodb().get_item(
+                    TableName = self.table_name,
+                    Key = {'cache_key': {'S': 'rtt:' + prefix}}
+                )
+                item = response.get('Item')
+                if item is not None and int(item['expires_at']['N']) > time.time():
+                    stats = json.loads(item['rtt']['S'])
+            except Exception as e:
+                logger.error("loading rtt stats for %s failed: %s", prefix, e)
+        if stats is None:
+            stats = {}
+        self.cache.put(prefix, stats)
+        return stats
+
+    def update(self, prefix, rtt):
+        stats = self.load(prefix)
+        for region, ms in rtt.items():
+            n, average = stats.get(region, [0, ms])
+            stats[region] = [n + 1, round(average + self.alpha * (ms - average), 1)]
+
+        if self.table_name:
+            # concurrent updates of a prefix may overwrite each other, the
+            # average is an estimate anyway
+            try:
+                aws_clients.dynamodb().put_item(
+                    TableName = self.table_name,
+                    Item = {
+                        'cache_key': {'S': 'rtt:' + prefix},
+                        'rtt': {'S': json.dumps(stats, separators = (',', ':'))},
+                        'expires_at': {'N': str(int(time.time() + self.ttl))}
+                    }
+                )
+            except Exception as e:
+                logger.error("storing rtt stats for %s failed: %s", prefix, e)
+
+    def get(self, prefix):
+        # averages of the regions with enough samples
+        return dict((region, s[1]) for region, s in self.load(prefix).items() if s[0] >= self.min_samples)
+
+
+class RttRouter(object):
+    def __init__(self, region_index, stats, distance_weight = None, max_rtt = None):
+        if distance_weight is None:
+            distance_weight = float(os.environ.get('RTT_DISTANCE_WEIGHT', '0.01'))
+        if max_rtt is None:
+            max_rtt = float(os.environ.get('RTT_MAX_MS', '5000'))
+
+        self.region_index = region_index
+        self.stats = stats
+        self.distance_weight = distance_weight
+        self.max_rtt = max_rtt
+
+    def regions(self):
+        # regions that can be routed to by name
+        index = self.region_index
+        return dict((r['name'], r) for i, r in enumerate(index.regions) if i not in index.excluded)
+
+    def valid(self, rtt, regions):
+        # the measurements come from the device, unknown regions and values
+        # that are not plausible are ignored
+        if not isinstance(rtt, dict):
+            return {}
+        valid = {}
+        for region, ms in rtt.items():
+            if region in regions and isinstance(ms, (int, float)) and not isinstance(ms, bool) \
+                    and 0 < ms <= self.max_rtt:
+                valid[region] = float(ms)
+        return valid
+
+    def place(self, prefix, rtt, lat = None, lon = None, allowed = None):
+        # returns the placement or None to route by distance. allowed limits
+        # the regions to choose from. The measurements are not recorded here,
+        # see record.
+        regions = self.regions()
+        measured = self.valid(rtt, regions)
+        if measured:
+            source = 'probe'
+        elif prefix is not None:
+            source = 'prefix'
+            measured = self.valid(self.stats.get(prefix), regions)
+        if allowed is not None:
+            measured = dict((region, ms) for region, ms in measured.items() if region in allowed)
+        if not measured:
+            return None
+
+        best = None
+        for region, ms in measured.items():
+            distance = None
+            cost = ms
+            if lat is not None and lon is not None:
+                distance = great_circle(lat, lon, regions[region]['lat'], regions[region]['lon'])
+                cost += self.distance_weight * distance
+            if best is None or cost < best[0]:
+                best = (cost, region, ms, distance)
+
+        cost, region, ms, distance = best
+        logger.info("lowest rtt region: %s, rtt: %.1f ms, cost: %.1f, source: %s", region, ms, cost, source)
+        placement = {'region': region, 'rtt': ms, 'routing': source}
+        if distance is not None:
+            placement['distance'] = distance
+        return placement
+
+    def record(self, prefix, rtt):
+        # adds the measurements of a device to the stats of its prefix. Only
+        # for devices that have been claimed, the values come from the device
+        # and must not steer other devices unless it is in the allowlist.
+        measured = self.valid(rtt, self.regions())
+        if measured and prefix is not None:
+            self.stats.update(prefix, measured)
@@ -0,0 +1,101 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# task_graph.py
+# runs steps that depend on each other on a thread pool. A step starts as soon
+# as the steps it depends on have finished. If a step fails no further steps
+# are started and the compensation of every finished step is run in reverse
+# order of completion before the error is raised.
+
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, wait
+
+logger = logging.getLogger()
+
+
+class TaskGraph(object):
+    def __init__(self, executor):
+        self.executor = executor
+        self.steps = OrderedDict()
+        self.results = {}
+        self.timings = OrderedDict()
+
+    def add(self, name, func, depends = (), compensate = None):
+        # func gets the results of all finished steps, compensate the result
+        # of its own step
+        for d in depends:
+            if d not in self.steps:
+                raise ValueError("step {} depends on unknown step {}".format(name, d))
+        self.steps[name] = (func, tuple(depends), compensate)
+
+    def timed(self, name, func):
+        def run(results):
+            start = time.time()
+            try:
+                return func(results)
+            finally:
+                self.timings[name] = (time.time() - start) * 1000
+        return run
+
+    def run(self):
+        start = time.time()
+        pending = OrderedDict(self.steps)
+        running = {}
+        completed = []
+        error = None
+
+        while pending or running:
+            if error is None:
+                for name, (func, depends, _) in list(pending.items()):
+                    if all(d in self.results for d in depends):
+                        # steps get a snapshot of the results so far
+                        running[self.executor.submit(self.timed(name, func), dict(self.results))] = name
+                        del pending[name]
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    self.results[name] = future.result()
+                    completed.append(name)
+                except Exception as e:
+                    logger.error("step %s failed: %s", name, e)
+                    if error is None:
+                        error = e
+
+        self.timings['total'] = (time.time() - start) * 1000
+
+        if error is not None:
+            self.compensate(completed)
+            raise error
+
+        return self.results
+
+    def compensate(self, completed):
+        for name in reversed(completed):
+            compensate = self.steps[name][2]
+            if compensate is None:
+                continue
+            try:
+                logger.info("compensating step %s", name)
+                compensate(self.results[name])
+            except Exception as e:
+                logger.error("compensating step %s failed: %s", name, e)
@@ -0,0 +1,78 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# ttl_cache.py
+# bounded in-memory cache with per entry expiry and LRU eviction. The cache
+# is shared by the worker threads of batch requests.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default = None):
+        return self.get_any((key,), default)
+
+    def get_any(self, keys, default = None):
+        # value of the first of keys that is cached, counted as one hit or miss
+        with self.lock:
+            now = time.time()
+            for key in keys:
+                entry = self.entries.pop(key, None)
+                if entry is not None:
+                    value, expires = entry
+                    if expires > now:
+                        # most recently used entries are kept at the end
+                        self.entries[key] = entry
+                        self.hits += 1
+                        return value
+            self.misses += 1
+            return default
+
+    def put(self, key, value, ttl = None):
+        if ttl is None:
+            ttl = self.ttl
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, time.time() + ttl)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last = False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
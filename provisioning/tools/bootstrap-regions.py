@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# bootstrap-regions.py
+# prepares all regions of regions.json for provisioning at deploy time. The
+# account id is resolved once, the policy GlobalDevicePolicy is created or
+# updated in all regions in parallel and the ATS endpoint of every region is
+# looked up. The result is written to the readiness manifest that is
+# packaged with the Lambda function: the function skips the policy check for
+# ready regions and does not route devices to regions that are not ready.
+#
+#   ./bootstrap-regions.py
+#   ./bootstrap-regions.py -o ../lambda/region-readiness.json --regions eu-west-1,us-east-1
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+lambda_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda')
+sys.path.insert(0, lambda_dir)
+
+from iot_policy import ensure_policy, get_account_id
+from region_index import load_regions
+
+
+def bootstrap(region, policy_name, account_id):
+    start = time.time()
+    c_iot = boto3.client('iot', region_name = region, config = Config(retries = {'max_attempts': 10}))
+    try:
+        policy = ensure_policy(c_iot, policy_name, region, account_id, update = True)
+        endpoint = c_iot.describe_endpoint(endpointType = 'iot:Data-ATS')['endpointAddress']
+    except Exception as e:
+        return {'ready': False, 'error': str(e), 'seconds': round(time.time() - start, 2)}
+    return {'ready': True, 'endpoint': endpoint, 'policy': policy, 'seconds': round(time.time() - start, 2)}
+
+
+parser = argparse.ArgumentParser(description='Create or update the device policy in all regions and write the readiness manifest')
+parser.add_argument("-r", "--regions-file", action="store", dest="regions_file",
+                    default=os.path.join(lambda_dir, 'regions.json'), help="region table, default: ../lambda/regions.json")
+parser.add_argument("-o", "--output", action="store", dest="output",
+                    default=os.path.join(lambda_dir, 'region-readiness.json'),
+                    help="readiness manifest, default: ../lambda/region-readiness.json")
+parser.add_argument("-p", "--policy-name", action="store", dest="policy_name", default="GlobalDevicePolicy",
+                    help="name of the IoT policy, default: GlobalDevicePolicy")
+parser.add_argument("--regions", action="store", dest="regions",
+                    help="comma separated subset of the regions, the others are marked as not ready")
+parser.add_argument("-w", "--workers", action="store", type=int, dest="workers", default=16,
+                    help="regions bootstrapped in parallel, default: 16")
+args = parser.parse_args()
+
+regions = [r['name'] for r in load_regions(args.regions_file)['regions']]
+selected = set(args.regions.split(',')) if args.regions else set(regions)
+
+account_id = get_account_id()
+print("=> account: {}, policy: {}, regions: {}".format(account_id, args.policy_name, len(selected)))
+
+start = time.time()
+results = {}
+with ThreadPoolExecutor(max_workers = args.workers) as executor:
+    futures = dict((r, executor.submit(bootstrap, r, args.policy_name, account_id)) for r in regions if r in selected)
+    for region in regions:
+        if region in futures:
+            results[region] = futures[region].result()
+        else:
+            results[region] = {'ready': False, 'error': 'not selected'}
+
+for region in regions:
+    r = results[region]
+    if r['ready']:
+        print("   {:<16} ready, policy {}, {}s".format(region, r['policy'], r['seconds']))
+    else:
+        print("   {:<16} NOT READY: {}".format(region, r['error']))
+
+manifest = {
+    'policy_name': args.policy_name,
+    'account_id': account_id,
+    'created': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    'regions': results
+}
+with open(args.output, 'w') as f:
+    json.dump(manifest, f, indent = 2, sort_keys = True)
+
+ready = sum(1 for r in results.values() if r['ready'])
+print("=> {} of {} regions ready, {:.1f}s, manifest: {}".format(ready, len(regions), time.time() - start, args.output))
+if ready < len(selected):
+    sys.exit(1)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# build-geo-table.py
+# converts a CSV dump of IP ranges into the binary range table that is
+# used by the geolocation module of the Lambda function.
+#
+# CSV columns: start_ip, end_ip, latitude, longitude[, country_code]
+# start and end can be given as dotted/colon notation or as integers.
+
+import argparse
+import csv
+import os
+import socket
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from geolocation import HEADER, IPV4_RECORD, IPV6_RECORD, TABLE_MAGIC, TABLE_VERSION, ip_to_int
+
+
+def parse_address(value, other):
+    value = value.strip()
+    if value.isdigit():
+        n = int(value)
+        # integer ranges are IPv4 if both ends fit into 32 bit
+        if n < 2 ** 32 and (other is None or int(other.strip()) < 2 ** 32):
+            return 4, n
+        return 6, n
+    return ip_to_int(value)
+
+
+def read_ranges(csv_file):
+    ipv4 = []
+    ipv6 = []
+    skipped = 0
+
+    with open(csv_file) as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith('#'):
+                continue
+            try:
+                start_version, start = parse_address(row[0], row[1])
+                end_version, end = parse_address(row[1], row[0])
+                lat = float(row[2])
+                lon = float(row[3])
+            except (ValueError, IndexError, socket.error):
+                # header line or incomplete record
+                skipped += 1
+                continue
+
+            if start_version != end_version or start > end:
+                skipped += 1
+                continue
+
+            country_code = row[4].strip().upper()[:2] if len(row) > 4 else ''
+            record = (start, end, lat, lon, country_code.encode('ascii'))
+            if start_version == 4:
+                ipv4.append(record)
+            else:
+                ipv6.append(record)
+
+    return ipv4, ipv6, skipped
+
+
+def drop_overlaps(ranges):
+    ranges.sort()
+    result = []
+    for r in ranges:
+        if result and r[0] <= result[-1][1]:
+            print("warning: dropping overlapping range {}-{}".format(r[0], r[1]))
+            continue
+        result.append(r)
+    return result
+
+
+def write_table(out_file, ipv4, ipv6):
+    tmp_file = out_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(HEADER.pack(TABLE_MAGIC, TABLE_VERSION, 0, len(ipv4), len(ipv6)))
+        for start, end, lat, lon, country_code in ipv4:
+            f.write(IPV4_RECORD.pack(start, end, lat, lon, country_code))
+        for start, end, lat, lon, country_code in ipv6:
+            f.write(IPV6_RECORD.pack(start >> 64, start & (2 ** 64 - 1),
+                                     end >> 64, end & (2 ** 64 - 1), lat, lon, country_code))
+    os.rename(tmp_file, out_file)
+
+
+parser = argparse.ArgumentParser(description='Build the IP range table for the global provisioning Lambda')
+parser.add_argument("-i", "--input", action="store", required=True, dest="csv_file", help="CSV file with IP ranges")
+parser.add_argument("-o", "--output", action="store", dest="out_file",
+                    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda', 'geo-ranges.bin'),
+                    help="range table to write, default: lambda/geo-ranges.bin")
+
+args = parser.parse_args()
+
+ipv4, ipv6, skipped = read_ranges(args.csv_file)
+ipv4 = drop_overlaps(ipv4)
+ipv6 = drop_overlaps(ipv6)
+write_table(args.out_file, ipv4, ipv6)
+
+print("=> wrote {}: ipv4 ranges: {}, ipv6 ranges: {}, skipped lines: {}, size: {} bytes".format(
+    args.out_file, len(ipv4), len(ipv6), skipped, os.path.getsize(args.out_file)))
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# build-region-index.py
+# compiles regions.json and optional overrides into the geohash cell index
+# that is used by find_best_region in the Lambda function.
+#
+#   build   write lambda/region-index.json
+#   verify  compare the index with the brute force geopy search on a lat/lon grid
+#
+# Overrides file:
+#   {
+#     "countries": {"<ISO country code>": "<region>", ...},
+#     "polygons": [{"region": "<region>", "polygon": [[lat, lon], ...]}, ...]
+#   }
+# Polygons are checked in the given order and must not cross the antimeridian.
+
+import argparse
+import json
+import os
+import sys
+import time
+
+lambda_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda')
+sys.path.insert(0, lambda_dir)
+
+from region_index import GEOHASH_ALPHABET, RegionIndex, great_circle, load_regions, point_in_polygon
+
+# boundary points per cell edge to bound the distance from the cell center
+EDGE_SAMPLES = 16
+RADIUS_MARGIN = 1.05
+
+
+def children(geohash, bbox):
+    # the 32 sub cells of a cell with their bounding boxes
+    lat_lo, lat_hi, lon_lo, lon_hi = bbox
+    # bits of the next character alternate starting with longitude if the
+    # total number of bits so far is even
+    lon_first = (len(geohash) * 5) % 2 == 0
+    for i, c in enumerate(GEOHASH_ALPHABET):
+        b = [(i >> shift) & 1 for shift in (4, 3, 2, 1, 0)]
+        la_lo, la_hi, lo_lo, lo_hi = lat_lo, lat_hi, lon_lo, lon_hi
+        lon_turn = lon_first
+        for bit in b:
+            if lon_turn:
+                mid = (lo_lo + lo_hi) / 2
+                lo_lo, lo_hi = (mid, lo_hi) if bit else (lo_lo, mid)
+            else:
+                mid = (la_lo + la_hi) / 2
+                la_lo, la_hi = (mid, la_hi) if bit else (la_lo, mid)
+            lon_turn = not lon_turn
+        yield geohash + c, (la_lo, la_hi, lo_lo, lo_hi)
+
+
+def boundary_points(bbox):
+    lat_lo, lat_hi, lon_lo, lon_hi = bbox
+    for k in range(EDGE_SAMPLES + 1):
+        f = float(k) / EDGE_SAMPLES
+        lat = lat_lo + f * (lat_hi - lat_lo)
+        lon = lon_lo + f * (lon_hi - lon_lo)
+        yield lat, lon_lo
+        yield lat, lon_hi
+        yield lat_lo, lon
+        yield lat_hi, lon
+
+
+def candidate_regions(bbox, regions, candidates):
+    # regions that can be the closest one for some point of the cell. With the
+    # cell radius r and the distance d from the center to a region, every
+    # point of the cell is between d - r and d + r away from that region.
+    lat_lo, lat_hi, lon_lo, lon_hi = bbox
+    clat = (lat_lo + lat_hi) / 2
+    clon = (lon_lo + lon_hi) / 2
+    radius = max(great_circle(clat, clon, lat, lon) for lat, lon in boundary_points(bbox)) * RADIUS_MARGIN
+
+    distances = [(great_circle(clat, clon, regions[i]['lat'], regions[i]['lon']), i) for i in candidates]
+    min_distance = min(d for d, i in distances)
+    return [i for d, i in distances if d - radius <= min_distance + radius]
+
+
+def segments_intersect(p1, p2, p3, p4):
+    def orientation(a, b, c):
+        v = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+        return (v > 0) - (v < 0)
+
+    o1 = orientation(p1, p2, p3)
+    o2 = orientation(p1, p2, p4)
+    o3 = orientation(p3, p4, p1)
+    o4 = orientation(p3, p4, p2)
+    # collinear touching counts as intersection to stay on the safe side
+    return (o1 != o2 and o3 != o4) or 0 in (o1, o2, o3, o4) and \
+        min(p1[0], p2[0]) <= max(p3[0], p4[0]) and min(p3[0], p4[0]) <= max(p1[0], p2[0]) and \
+        min(p1[1], p2[1]) <= max(p3[1], p4[1]) and min(p3[1], p4[1]) <= max(p1[1], p2[1])
+
+
+def polygon_relation(bbox, polygon):
+    # 'inside', 'outside' or 'partial'
+    lat_lo, lat_hi, lon_lo, lon_hi = bbox
+    lats = [p[0] for p in polygon]
+    lons = [p[1] for p in polygon]
+    if max(lats) < lat_lo or min(lats) > lat_hi or max(lons) < lon_lo or min(lons) > lon_hi:
+        return 'outside'
+
+    corners = [(lat_lo, lon_lo), (lat_lo, lon_hi), (lat_hi, lon_hi), (lat_hi, lon_lo)]
+    edges = list(zip(corners, corners[1:] + corners[:1]))
+    for k in range(len(polygon)):
+        a = tuple(polygon[k - 1])
+        b = tuple(polygon[k])
+        if lat_lo <= b[0] <= lat_hi and lon_lo <= b[1] <= lon_hi:
+            return 'partial'
+        for c, d in edges:
+            if segments_intersect(a, b, c, d):
+                return 'partial'
+
+    clat = (lat_lo + lat_hi) / 2
+    clon = (lon_lo + lon_hi) / 2
+    return 'inside' if point_in_polygon(clat, clon, polygon) else 'outside'
+
+
+def compile_cells(regions, polygons, precision):
+    cells = {}
+    stack = [(geohash, bbox, list(range(len(regions))), list(range(len(polygons))))
+             for geohash, bbox in children('', (-90.0, 90.0, -180.0, 180.0))]
+
+    while stack:
+        geohash, bbox, candidates, polygon_ids = stack.pop()
+
+        partial = []
+        owner = None
+        for p in polygon_ids:
+            relation = polygon_relation(bbox, polygons[p]['polygon'])
+            if relation == 'inside':
+                owner = p
+                break
+            if relation == 'partial':
+                partial.append(p)
+
+        if owner is not None:
+            if not partial:
+                cells[geohash] = polygons[owner]['region']
+                continue
+            # the polygon covers whatever the partial ones leave of the cell
+            partial.append(owner)
+
+        candidates = candidate_regions(bbox, regions, candidates)
+
+        if not partial and len(candidates) == 1:
+            cells[geohash] = candidates[0]
+        elif len(geohash) == precision:
+            cells[geohash] = {'p': partial, 'c': candidates} if partial else candidates
+        else:
+            for child, child_bbox in children(geohash, bbox):
+                stack.append((child, child_bbox, candidates, partial))
+
+    return cells
+
+
+def load_overrides(overrides_file, names):
+    if not overrides_file:
+        return {}, []
+    with open(overrides_file) as f:
+        overrides = json.load(f)
+
+    countries = dict((c.upper(), names.index(r)) for c, r in overrides.get('countries', {}).items())
+    polygons = [{'region': names.index(p['region']), 'polygon': p['polygon']}
+                for p in overrides.get('polygons', [])]
+    return countries, polygons
+
+
+def build(args):
+    regions = load_regions(args.regions_file)['regions']
+    names = [r['name'] for r in regions]
+    countries, polygons = load_overrides(args.overrides_file, names)
+
+    start = time.time()
+    cells = compile_cells(regions, polygons, args.precision)
+    boundary = sum(1 for v in cells.values() if not isinstance(v, int))
+
+    index = {
+        'precision': args.precision,
+        'regions': names,
+        'countries': countries,
+        'polygons': polygons,
+        'cells': cells
+    }
+    with open(args.index_file, 'w') as f:
+        json.dump(index, f, separators = (',', ':'), sort_keys = True)
+
+    print("=> wrote {}: cells: {}, boundary cells: {}, size: {} bytes, {:.1f}s".format(
+        args.index_file, len(cells), boundary, os.path.getsize(args.index_file), time.time() - start))
+
+
+def brute_force(regions, lat, lon):
+    # the original find_best_region implementation
+    from geopy.distance import great_circle as geopy_great_circle
+
+    min_distance = 40000
+    closest_region = None
+    for r in regions:
+        distance = geopy_great_circle((lat, lon), (float(r['lat']), float(r['lon']))).km
+        if distance <= min_distance:
+            min_distance = distance
+            closest_region = r['name']
+    return closest_region
+
+
+def verify(args):
+    regions = load_regions(args.regions_file)['regions']
+    with open(args.index_file) as f:
+        index = RegionIndex(regions, json.load(f))
+
+    if index.polygons:
+        print("warning: polygon overrides are part of the index, differences inside polygons are expected")
+
+    checked = 0
+    mismatches = 0
+    steps_lat = int(180 / args.step)
+    steps_lon = int(360 / args.step)
+    for i in range(steps_lat + 1):
+        lat = -90.0 + i * args.step
+        for j in range(steps_lon + 1):
+            lon = -180.0 + j * args.step
+            expected = brute_force(regions, lat, lon)
+            actual = index.lookup(lat, lon)['region']
+            checked += 1
+            if expected != actual:
+                mismatches += 1
+                print("mismatch at lat: {}, lon: {}: expected {}, got {}".format(lat, lon, expected, actual))
+
+    print("=> checked {} points, mismatches: {}".format(checked, mismatches))
+    return 1 if mismatches else 0
+
+
+parser = argparse.ArgumentParser(description='Compile the geohash region index for the global provisioning Lambda')
+parser.add_argument("command", choices=["build", "verify"], help="build or verify the index")
+parser.add_argument("-r", "--regions", action="store", dest="regions_file",
+                    default=os.path.join(lambda_dir, 'regions.json'), help="region table, default: lambda/regions.json")
+parser.add_argument("-o", "--overrides", action="store", dest="overrides_file",
+                    help="JSON file with country and polygon overrides")
+parser.add_argument("-i", "--index", action="store", dest="index_file",
+                    default=os.path.join(lambda_dir, 'region-index.json'),
+                    help="index file, default: lambda/region-index.json")
+parser.add_argument("-p", "--precision", action="store", type=int, dest="precision", default=3,
+                    help="maximum geohash length of a cell, default: 3")
+parser.add_argument("-s", "--step", action="store", type=float, dest="step", default=1.0,
+                    help="grid step in degrees for verify, default: 1.0")
+
+args = parser.parse_args()
+
+if args.command == 'build':
+    build(args)
+else:
+    sys.exit(verify(args))
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# fleet-report.py
+# reports the provisioning status of the fleet from the DynamoDB table
+# iot-global-provisioning. The table is read with a parallel Scan: every
+# segment is scanned by a worker of a pool, page by page. A page is counted
+# and written to the detail files of its segment before the next one is read,
+# so memory does not grow with the size of the table.
+#
+# Counts: by prov_status, by aws_region and by prov_datetime bucket (hour,
+# day or month, UTC). Detail: one compressed columnar file per segment,
+# Parquet if pyarrow is installed, otherwise one gzip file per column with a
+# JSON value per line. A checkpoint file makes runs incremental: the next run
+# only reports devices provisioned since the start of the previous one.
+#
+#   ./fleet-report.py -o report
+#   ./fleet-report.py -o report-$(date +%F) -c fleet-report.checkpoint --bucket hour
+#   ./fleet-report.py --endpoint-url http://localhost:8000 --summary-only
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import boto3
+from botocore.config import Config
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+COLUMNS = ['thing_name', 'prov_status', 'aws_region', 'prov_datetime', 'region_pin']
+# length of the prefix of prov_datetime (%Y-%m-%dT%H:%M:%S) per bucket
+BUCKETS = {'hour': 13, 'day': 10, 'month': 7}
+
+
+def row(item):
+    return dict((c, item[c]['S'] if c in item else None) for c in COLUMNS)
+
+
+class ParquetWriter(object):
+    def __init__(self, path):
+        self.path = path + '.parquet'
+        schema = pyarrow.schema([(c, pyarrow.string()) for c in COLUMNS])
+        self.writer = pyarrow.parquet.ParquetWriter(self.path, schema, compression = 'zstd')
+
+    def write(self, rows):
+        # every page becomes a row group
+        self.writer.write_table(pyarrow.table(dict((c, [r[c] for r in rows]) for c in COLUMNS)))
+
+    def close(self):
+        self.writer.close()
+
+
+class ColumnWriter(object):
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.files = dict((c, gzip.open(os.path.join(path, c + '.gz'), 'wt')) for c in COLUMNS)
+
+    def write(self, rows):
+        for c in COLUMNS:
+            self.files[c].write(''.join(json.dumps(r[c]) + '\n' for r in rows))
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+class Counts(object):
+    def __init__(self, bucket):
+        self.prefix = BUCKETS[bucket]
+        self.status = Counter()
+        self.region = Counter()
+        self.bucket = Counter()
+
+    def add(self, rows):
+        for r in rows:
+            self.status[r['prov_status'] or 'none'] += 1
+            self.region[r['aws_region'] or 'none'] += 1
+            self.bucket[r['prov_datetime'][:self.prefix] if r['prov_datetime'] else 'none'] += 1
+
+    def merge(self, other):
+        self.status.update(other.status)
+        self.region.update(other.region)
+        self.bucket.update(other.bucket)
+
+
+class Progress(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = 0
+        self.scanned = 0
+        self.capacity = 0.0
+        self.pages = 0
+
+    def add(self, response):
+        with self.lock:
+            self.items += response['Count']
+            self.scanned += response['ScannedCount']
+            self.capacity += response.get('ConsumedCapacity', {}).get('CapacityUnits', 0)
+            self.pages += 1
+
+
+def scan_segment(segment, args, since, progress):
+    counts = Counts(args.bucket)
+    writer = None
+    if not args.summary_only:
+        path = os.path.join(args.output_dir, 'part-{:05d}'.format(segment))
+        writer = ParquetWriter(path) if args.format == 'parquet' else ColumnWriter(path)
+
+    request = {
+        'TableName': args.table_name,
+        'Segment': segment,
+        'TotalSegments': args.segments,
+        'ProjectionExpression': ', '.join(COLUMNS),
+        'ReturnConsumedCapacity': 'TOTAL'
+    }
+    if args.page_size:
+        request['Limit'] = args.page_size
+    if since:
+        request['FilterExpression'] = 'prov_datetime >= :since'
+        request['ExpressionAttributeValues'] = {':since': {'S': since}}
+
+    try:
+        while True:
+            response = c_dynamo.scan(**request)
+            progress.add(response)
+            rows = [row(i) for i in response['Items']]
+            counts.add(rows)
+            if writer and rows:
+                writer.write(rows)
+            if 'LastEvaluatedKey' not in response:
+                return counts
+            request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    finally:
+        if writer:
+            writer.close()
+
+
+def load_checkpoint(checkpoint_file, table_name):
+    if not checkpoint_file or not os.path.isfile(checkpoint_file):
+        return None
+    with open(checkpoint_file) as f:
+        checkpoint = json.load(f)
+    if checkpoint['table'] != table_name:
+        raise ValueError("checkpoint {} belongs to {}".format(checkpoint_file, checkpoint['table']))
+    return checkpoint['since']
+
+
+def save_checkpoint(checkpoint_file, table_name, since):
+    tmp_file = checkpoint_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump({'table': table_name, 'since': since}, f)
+    os.rename(tmp_file, checkpoint_file)
+
+
+def print_counts(title, counter):
+    print("   {}".format(title))
+    for key, count in sorted(counter.items()):
+        print("     {:<24} {:>10}".format(key, count))
+
+
+parser = argparse.ArgumentParser(description='Report the provisioning status of the fleet')
+parser.add_argument("-t", "--table", action="store", dest="table_name", default="iot-global-provisioning",
+                    help="DynamoDB table, default: iot-global-provisioning")
+parser.add_argument("-o", "--output-dir", action="store", dest="output_dir",
+                    help="directory for the detail files and summary.json, default: fleet-report-<UTC time>")
+parser.add_argument("-s", "--segments", action="store", type=int, dest="segments", default=16,
+                    help="number of parallel scan segments, default: 16")
+parser.add_argument("-w", "--workers", action="store", type=int, dest="workers", default=8,
+                    help="number of segments scanned at the same time, default: 8")
+parser.add_argument("-c", "--checkpoint", action="store", dest="checkpoint_file",
+                    help="checkpoint file, with an existing checkpoint only devices provisioned since the previous run are reported")
+parser.add_argument("-b", "--bucket", action="store", dest="bucket", choices=sorted(BUCKETS), default="day",
+                    help="prov_datetime bucket of the counts, default: day")
+parser.add_argument("-f", "--format", action="store", dest="format", choices=['parquet', 'columns'],
+                    default='parquet' if pyarrow else 'columns',
+                    help="detail file format, parquet needs pyarrow, default: parquet if pyarrow is installed, otherwise columns")
+parser.add_argument("--page-size", action="store", type=int, dest="page_size",
+                    help="items per Scan page, default: 1 MB pages")
+parser.add_argument("--summary-only", action="store_true", dest="summary_only", default=False,
+                    help="only count, do not write detail files")
+parser.add_argument("--endpoint-url", action="store", dest="endpoint_url",
+                    help="DynamoDB endpoint, e.g. http://localhost:8000 for DynamoDB Local")
+args = parser.parse_args()
+
+if args.format == 'parquet' and pyarrow is None:
+    parser.error("--format parquet needs pyarrow: pip install pyarrow")
+args.workers = min(args.workers, args.segments)
+
+c_dynamo = boto3.client('dynamodb', endpoint_url = args.endpoint_url,
+                        config = Config(max_pool_connections = args.workers + 2,
+                                        retries = {'max_attempts': 10, 'mode': 'standard'}))
+
+# the next run starts at the start of this run: devices provisioned while a
+# segment is scanned are reported again rather than missed
+started_at = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
+since = load_checkpoint(args.checkpoint_file, args.table_name)
+if since:
+    print("=> devices provisioned since {}".format(since))
+
+if not args.output_dir:
+    args.output_dir = 'fleet-report-' + started_at.replace('-', '').replace(':', '')
+if not os.path.isdir(args.output_dir):
+    os.makedirs(args.output_dir)
+
+progress = Progress()
+counts = Counts(args.bucket)
+failures = 0
+start = time.time()
+with ThreadPoolExecutor(max_workers = args.workers) as executor:
+    futures = [executor.submit(scan_segment, s, args, since, progress) for s in range(args.segments)]
+    pending = futures
+    while pending:
+        done, pending = wait(pending, timeout = 5)
+        if pending:
+            elapsed = time.time() - start
+            print("   scanned: {}, reported: {}, {:.0f} items/s, {:.0f} RCU".format(
+                progress.scanned, progress.items, progress.scanned / elapsed, progress.capacity))
+    for segment, f in enumerate(futures):
+        if f.exception():
+            print("error: segment {} failed: {}".format(segment, f.exception()))
+            failures += 1
+        else:
+            counts.merge(f.result())
+
+elapsed = time.time() - start
+summary = {
+    'table': args.table_name,
+    'started_at': started_at,
+    'since': since,
+    'complete': not failures,
+    'items': progress.items,
+    'scanned': progress.scanned,
+    'consumed_capacity': progress.capacity,
+    'seconds': round(elapsed, 3),
+    'items_per_s': round(progress.scanned / max(elapsed, 0.001)),
+    'format': None if args.summary_only else args.format,
+    'prov_status': dict(counts.status),
+    'aws_region': dict(counts.region),
+    'prov_datetime_' + args.bucket: dict(counts.bucket)
+}
+with open(os.path.join(args.output_dir, 'summary.json'), 'w') as f:
+    json.dump(summary, f, indent = 2, sort_keys = True)
+
+print_counts("prov_status", counts.status)
+print_counts("aws_region", counts.region)
+print_counts("prov_datetime ({})".format(args.bucket), counts.bucket)
+print("=> reported: {}, scanned: {}, pages: {}, {:.0f} RCU, {:.1f}s, {:.0f} items/s, {} to {}".format(
+    progress.items, progress.scanned, progress.pages, progress.capacity, elapsed,
+    progress.scanned / max(elapsed, 0.001), 'summary' if args.summary_only else args.format, args.output_dir))
+if failures:
+    print("   {} of {} segments failed, the checkpoint was not updated".format(failures, args.segments))
+    sys.exit(1)
+if args.checkpoint_file:
+    save_checkpoint(args.checkpoint_file, args.table_name, started_at)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+
+# import-profile.py
+# reports the cold start cost of the Lambda function per dependency. The
+# function module is imported in a fresh interpreter with -X importtime,
+# the self time of every imported module is summed up per top level
+# package. The results can be written as JSON and compared with the
+# results of a previous release. -X importtime needs Python 3.7 or newer.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+lambda_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda')
+
+CHILD = '''
+import sys, time
+sys.stderr.write('import-profile: start\\n')
+sys.stderr.flush()
+start = time.time()
+import {module}
+sys.stderr.write('import-profile: wall {{}}\\n'.format((time.time() - start) * 1e6))
+'''
+
+
+def local_modules(directory):
+    return set(os.path.splitext(f)[0] for f in os.listdir(directory) if f.endswith('.py'))
+
+
+def group_of(name, local, stdlib):
+    root = name.split('.')[0]
+    if root in local:
+        return '{} (lambda)'.format(root)
+    if root in stdlib or root.startswith('_'):
+        return '(stdlib)'
+    return root
+
+
+def profile_once(python, module, directory):
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    p = subprocess.Popen([python, '-X', 'importtime', '-c', CHILD.format(module = module)],
+                         cwd = directory, env = env, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    out, err = p.communicate()
+    if p.returncode != 0:
+        raise RuntimeError("importing {} failed:\n{}".format(module, err.decode('utf-8', 'replace')))
+
+    started = False
+    modules = []
+    wall = None
+    for line in err.decode('utf-8', 'replace').splitlines():
+        if line.startswith('import-profile: start'):
+            started = True
+        elif line.startswith('import-profile: wall'):
+            wall = float(line.split()[-1])
+        elif started and line.startswith('import time:') and '|' in line:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            if self_us.strip().isdigit():
+                modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return wall, modules
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else 0
+
+
+def python_version(python):
+    out = subprocess.check_output([python, '-c', 'import sys; print(sys.version.split()[0])'])
+    return out.decode().strip()
+
+
+def profile(python, module, directory, runs, version):
+    local = local_modules(directory)
+    stdlib = set(getattr(sys, 'stdlib_module_names', ()))
+
+    # the first run compiles the byte code
+    profile_once(python, module, directory)
+
+    walls = []
+    groups = {}
+    counts = {}
+    for i in range(runs):
+        wall, modules = profile_once(python, module, directory)
+        walls.append(wall)
+        totals = {}
+        for name, self_us, cumulative_us in modules:
+            group = group_of(name, local, stdlib)
+            totals[group] = totals.get(group, 0) + self_us
+            if i == 0:
+                counts[group] = counts.get(group, 0) + 1
+        for group, total in totals.items():
+            groups.setdefault(group, []).append(total)
+
+    return {
+        'python': version,
+        'module': module,
+        'runs': runs,
+        'wall_ms': round(median(walls) / 1000.0, 2),
+        'dependencies': dict((g, {'self_ms': round(median(v) / 1000.0, 2), 'modules': counts.get(g, 0)})
+                             for g, v in groups.items())
+    }
+
+
+def print_results(results, baseline, top):
+    print("=> python {}, import {}: {} ms (median of {} runs)".format(
+        results['python'], results['module'], results['wall_ms'], results['runs']))
+    if baseline:
+        print("   baseline: {} ms".format(baseline['wall_ms']))
+
+    deps = sorted(results['dependencies'].items(), key = lambda d: -d[1]['self_ms'])
+    print("\n{:<32} {:>10} {:>8} {:>10}".format('dependency', 'self ms', 'modules', 'baseline'))
+    for name, d in deps[:top]:
+        base = '-'
+        if baseline:
+            base = baseline['dependencies'].get(name, {}).get('self_ms', 0)
+        print("{:<32} {:>10} {:>8} {:>10}".format(name, d['self_ms'], d['modules'], base))
+    if len(deps) > top:
+        print("{:<32} {:>10}".format('({} more)'.format(len(deps) - top),
+                                     round(sum(d['self_ms'] for n, d in deps[top:]), 2)))
+
+
+parser = argparse.ArgumentParser(description='Cold start cost of the Lambda function per dependency')
+parser.add_argument("-m", "--module", action="store", dest="module", default="lambda_function",
+                    help="module to import, default: lambda_function")
+parser.add_argument("-d", "--dir", action="store", dest="directory", default=lambda_dir,
+                    help="directory of the Lambda function, default: ../lambda")
+parser.add_argument("-p", "--python", action="store", dest="python", default=sys.executable,
+                    help="python interpreter (3.7 or newer), e.g. the version of the Lambda runtime")
+parser.add_argument("-n", "--runs", action="store", type=int, dest="runs", default=5,
+                    help="number of runs, the median is reported, default: 5")
+parser.add_argument("-t", "--top", action="store", type=int, dest="top", default=20,
+                    help="number of dependencies to show, default: 20")
+parser.add_argument("-o", "--output", action="store", dest="output", help="write the results as JSON")
+parser.add_argument("-c", "--compare", action="store", dest="compare", help="JSON results of a previous run")
+args = parser.parse_args()
+
+baseline = None
+if args.compare:
+    with open(args.compare) as f:
+        baseline = json.load(f)
+
+version = python_version(args.python)
+if tuple(int(v) for v in version.split('.')[:2]) < (3, 7):
+    parser.error("{} is Python {}, -X importtime needs Python 3.7 or newer".format(args.python, version))
+
+results = profile(args.python, args.module, args.directory, args.runs, version)
+print_results(results, baseline, args.top)
+
+if args.output:
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent = 2, sort_keys = True)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# load-allowlist.py
+# loads a manifest of devices that may be provisioned into the DynamoDB table
+# iot-global-provisioning. The manifest is read as a stream and written with
+# BatchWriteItem by a pool of workers. Progress is stored in a checkpoint file
+# so that an interrupted import can be resumed.
+#
+# Manifest formats (by file extension):
+#   .csv    header with thing_name and optional pub_key (PEM) and region columns
+#   .jsonl  one object per line: {"thing_name": ..., "pub_key": ..., "region": ...}
+#
+# region pins a device to a region, pub_key is the device's own public key for
+# the thing name signature (used when the Lambda function has DEVICE_KEYS=true).
+
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+lambda_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda')
+sys.path.insert(0, lambda_dir)
+
+from region_index import load_regions
+
+BATCH_SIZE = 25
+MAX_ATTEMPTS = 10
+
+
+def read_manifest(manifest_file):
+    with open(manifest_file) as f:
+        if manifest_file.endswith('.jsonl'):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            for row in csv.DictReader(f):
+                yield row
+
+
+def to_item(record, status, regions):
+    thing_name = (record.get('thing_name') or '').strip()
+    if not thing_name:
+        raise ValueError("record without thing_name: {}".format(record))
+
+    item = {'thing_name': {'S': thing_name}, 'prov_status': {'S': status}}
+    if record.get('pub_key'):
+        item['pub_key'] = {'S': record['pub_key']}
+    if record.get('region'):
+        if record['region'] not in regions:
+            raise ValueError("unknown region {} for {}".format(record['region'], thing_name))
+        item['region_pin'] = {'S': record['region']}
+    return item
+
+
+def batches(records, skip, status, regions):
+    # (sequence number, items) of up to 25 items, duplicates within a batch
+    # are not allowed by BatchWriteItem, the last record wins
+    seq = 0
+    batch = {}
+    count = 0
+    for record in records:
+        count += 1
+        if count <= skip:
+            continue
+        item = to_item(record, status, regions)
+        batch[item['thing_name']['S']] = item
+        if len(batch) == BATCH_SIZE:
+            yield seq, count, list(batch.values())
+            seq += 1
+            batch = {}
+    if batch:
+        yield seq, count, list(batch.values())
+
+
+class Loader(object):
+    def __init__(self, c_dynamo, table_name, skip_existing):
+        self.c_dynamo = c_dynamo
+        self.table_name = table_name
+        self.skip_existing = skip_existing
+        self.lock = threading.Lock()
+        self.written = 0
+        self.skipped = 0
+        self.retries = 0
+        self.errors = 0
+
+    def existing(self, items):
+        keys = [{'thing_name': i['thing_name']} for i in items]
+        found = set()
+        request = {self.table_name: {'Keys': keys, 'ProjectionExpression': 'thing_name'}}
+        attempt = 0
+        while request:
+            response = self.c_dynamo.batch_get_item(RequestItems = request)
+            for item in response['Responses'].get(self.table_name, []):
+                found.add(item['thing_name']['S'])
+            request = response.get('UnprocessedKeys')
+            if request:
+                attempt += 1
+                self.backoff(attempt)
+        return found
+
+    def backoff(self, attempt):
+        # exponential backoff with full jitter
+        time.sleep(random.uniform(0, min(5.0, 0.05 * 2 ** attempt)))
+
+    def write(self, items):
+        if self.skip_existing:
+            found = self.existing(items)
+            if found:
+                items = [i for i in items if i['thing_name']['S'] not in found]
+                with self.lock:
+                    self.skipped += len(found)
+            if not items:
+                return
+
+        request = {self.table_name: [{'PutRequest': {'Item': i}} for i in items]}
+        attempt = 0
+        while request:
+            response = self.c_dynamo.batch_write_item(RequestItems = request)
+            unprocessed = response.get('UnprocessedItems') or {}
+            done = len(request[self.table_name]) - len(unprocessed.get(self.table_name, []))
+            with self.lock:
+                self.written += done
+            request = unprocessed
+            if request:
+                attempt += 1
+                if attempt >= MAX_ATTEMPTS:
+                    raise RuntimeError("giving up on {} unprocessed items".format(len(request[self.table_name])))
+                with self.lock:
+                    self.retries += 1
+                self.backoff(attempt)
+
+
+class Checkpoint(object):
+    # tracks the number of manifest records up to which every batch has been
+    # written, batches finish out of order
+    def __init__(self, checkpoint_file, manifest_file):
+        self.checkpoint_file = checkpoint_file
+        self.manifest_file = os.path.abspath(manifest_file)
+        self.lock = threading.Lock()
+        self.records = 0
+        self.next_seq = 0
+        self.finished = {}
+
+    def load(self):
+        if not self.checkpoint_file or not os.path.isfile(self.checkpoint_file):
+            return 0
+        with open(self.checkpoint_file) as f:
+            checkpoint = json.load(f)
+        if checkpoint['manifest'] != self.manifest_file:
+            raise ValueError("checkpoint {} belongs to {}".format(self.checkpoint_file, checkpoint['manifest']))
+        self.records = checkpoint['records']
+        return self.records
+
+    def done(self, seq, records):
+        with self.lock:
+            self.finished[seq] = records
+            while self.next_seq in self.finished:
+                self.records = self.finished.pop(self.next_seq)
+                self.next_seq += 1
+
+    def save(self):
+        if not self.checkpoint_file:
+            return
+        with self.lock:
+            checkpoint = {'manifest': self.manifest_file, 'records': self.records}
+        tmp_file = self.checkpoint_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(checkpoint, f)
+        os.rename(tmp_file, self.checkpoint_file)
+
+
+def worker(loader, checkpoint, work, failures):
+    while True:
+        batch = work.get()
+        if batch is None:
+            return
+        seq, records, items = batch
+        try:
+            loader.write(items)
+            checkpoint.done(seq, records)
+        except Exception as e:
+            print("error: batch {} failed: {}".format(seq, e))
+            with loader.lock:
+                loader.errors += len(items)
+            failures.append(seq)
+
+
+parser = argparse.ArgumentParser(description='Load a device manifest into the global provisioning allowlist')
+parser.add_argument("-m", "--manifest", action="store", required=True, dest="manifest_file",
+                    help="CSV or JSONL manifest")
+parser.add_argument("-t", "--table", action="store", dest="table_name", default="iot-global-provisioning",
+                    help="DynamoDB table, default: iot-global-provisioning")
+parser.add_argument("-w", "--workers", action="store", type=int, dest="workers", default=8,
+                    help="number of parallel writers, default: 8")
+parser.add_argument("-c", "--checkpoint", action="store", dest="checkpoint_file",
+                    help="checkpoint file, an existing checkpoint resumes the import")
+parser.add_argument("-s", "--skip-existing", action="store_true", dest="skip_existing", default=False,
+                    help="do not overwrite devices that are already in the table, e.g. provisioned ones")
+parser.add_argument("--status", action="store", dest="status", default="unprovisioned",
+                    help="prov_status of the loaded devices, default: unprovisioned")
+parser.add_argument("--endpoint-url", action="store", dest="endpoint_url",
+                    help="DynamoDB endpoint, e.g. http://localhost:8000 for DynamoDB Local")
+args = parser.parse_args()
+
+c_dynamo = boto3.client('dynamodb', endpoint_url = args.endpoint_url,
+                        config = Config(max_pool_connections = args.workers + 2))
+regions = set(r['name'] for r in load_regions()['regions'])
+
+loader = Loader(c_dynamo, args.table_name, args.skip_existing)
+checkpoint = Checkpoint(args.checkpoint_file, args.manifest_file)
+skip = checkpoint.load()
+if skip:
+    print("=> resuming after {} records".format(skip))
+
+# the bounded queue keeps the reader from running ahead of the writers
+work = queue.Queue(maxsize = args.workers * 4)
+failures = []
+threads = [threading.Thread(target = worker, args = (loader, checkpoint, work, failures))
+           for i in range(args.workers)]
+for t in threads:
+    t.daemon = True
+    t.start()
+
+start = time.time()
+last_report = start
+try:
+    for batch in batches(read_manifest(args.manifest_file), skip, args.status, regions):
+        work.put(batch)
+        if time.time() - last_report >= 5:
+            last_report = time.time()
+            checkpoint.save()
+            print("   written: {}, {:.0f} items/s".format(loader.written, loader.written / (last_report - start)))
+finally:
+    for t in threads:
+        work.put(None)
+    for t in threads:
+        t.join()
+    checkpoint.save()
+
+elapsed = time.time() - start
+print("=> written: {}, skipped existing: {}, retries: {}, failed: {}, {:.1f}s, {:.0f} items/s".format(
+    loader.written, loader.skipped, loader.retries, loader.errors, elapsed, loader.written / max(elapsed, 0.001)))
+if failures:
+    print("   the checkpoint stops before the first failed batch, run again to resume")
+    sys.exit(1)